@@ -3,42 +3,1669 @@
 # feature : two pass 、字面常數 (literal)  、 EQU、 Control Section 、運算式 (Expression)
 #########################################################################
 import sys
+import os
 import json
 import re
+import glob
+import hashlib
+import mmap
+import marshal
+import math
+import struct
+import argparse
+import time
+import tracemalloc
+import types
+import itertools
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Lexer 使用的 token : C'..'/X'..'/=C'..'/=X'..' 字串常數、一般文字、逗號、落單的單引號或等號
+TOKEN_PATTERN = re.compile(r"(?:=[ \t]*)?[CX][ \t]*'[^'\n]*'?|[^\s,'=]+|[,'=]")
+# Scanner 需要特別處理的格式一 / 格式二指令 (與 scan() 裡的 format1_list、format2_list 相同)
+FORMAT1_SCAN_SET = frozenset(['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO', 'CSECT', 'LTORG'])
+FORMAT2_SCAN_SET = frozenset(['ADDR', 'COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR'])
+# Scanner 需要另外檢查格式的虛指令
+SCAN_KEYWORD_SET = frozenset(['START', 'END', 'RSUB', 'WORD', 'BYTE', 'RESW', 'RESB', 'EXTDEF', 'EXTREF'])
+
+# 讀取原始碼檔案 : 文字模式逐行讀取，依序產生每一行 (str，不先讀成 list)，讀完或 generator 關閉時關檔
+# 檔案打不開時在呼叫時就丟出 IOError；encoding 預設與 open() 相同
+def read_source(path, encoding=None):
+    f = open(path, mode='r', encoding=encoding)
+    return _source_lines(f)
+
+def _source_lines(f):
+    with f:
+        yield from f
+
+# 二進位中間檔 : 開頭是 INTERMEDIATE_MAGIC，之後每筆 record 為 4 bytes (little endian) 長度 + marshal 過的 tuple
+#   ('I', mnemonic, symbol, operand, lineNum, location)  pass one 處理過的指令
+#   ('L', mnemonic, location)                            放在上一個指令 (LTORG / END) 之後的 literal
+#   ('T', symbol table, extdef table, extref table, absolute symbols)  最後一筆，pass one 結束時的各個 table
+INTERMEDIATE_MAGIC = b'SICXE-IM\x01'
+RECORD_LENGTH = struct.Struct('<I')
+
+def pack_record(record) -> bytes:
+    data = marshal.dumps(record)
+    return RECORD_LENGTH.pack(len(data)) + data
+
+# 依序產生二進位中間檔的每筆 record (格式錯誤會丟出 ValueError)
+# source 為檔案路徑、已開啟的二進位檔案 (pass one 不寫中間檔時的暫存檔，見 Assembler.pass_one，都用 mmap 讀取)
+# 或記憶體中的中間檔內容 (bytes)
+def read_intermediate(source):
+    if isinstance(source, str):
+        with open(source, mode='rb') as f:
+            yield from _mapped_records(f, source)
+    elif hasattr(source, 'fileno'):
+        yield from _mapped_records(source, 'intermediate data')
+    else:
+        yield from _intermediate_records(memoryview(source), 'intermediate data')
+
+def _mapped_records(f, name):
+    if os.fstat(f.fileno()).st_size < len(INTERMEDIATE_MAGIC):
+        raise ValueError(f'{name} is not an intermediate file')
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        yield from _intermediate_records(mm, name)
+
+def _intermediate_records(data, name):
+    if data[:len(INTERMEDIATE_MAGIC)] != INTERMEDIATE_MAGIC:
+        raise ValueError(f'{name} is not an intermediate file')
+    pos = len(INTERMEDIATE_MAGIC)
+    end = len(data)
+    unpack_length, loads = RECORD_LENGTH.unpack_from, marshal.loads # pass one / pass two 每一行都會讀，先取出來
+    while pos < end:
+        if pos + 4 > end:
+            raise ValueError(f'{name} is truncated')
+        length, = unpack_length(data, pos)
+        pos += 4
+        if pos + length > end:
+            raise ValueError(f'{name} is truncated')
+        yield loads(data[pos:pos + length])
+        pos += length
+
+# 把二進位中間檔轉成一行一個 JSON 的文字 (與以前的文字中間檔相同，最後一行是各個 table)
+def dump_intermediate(path):
+    for record in read_intermediate(path):
+        if record[0] == 'I':
+            instr = Instruction(record[1], record[2], record[3], line_num=record[4], location=record[5])
+            yield json.dumps(instr.to_dict())
+        elif record[0] == 'L':
+            yield json.dumps(Instruction(record[1], '*', location=record[2]).to_dict())
+        else:
+            yield json.dumps({'symbol_table': record[1], 'extdef_table': record[2], 'extref_table': record[3]})
+
+# 組譯過程中無法繼續的錯誤 (原本會直接 exit(1))，由 assemble / execute 接住
+class AssemblerError(Exception):
+    pass
+
+# 報錯代碼 => 說明 (Diagnostic.code)
+DIAGNOSTIC_CODES = {
+    'E001': 'I/O error (source / intermediate file)',
+    'E100': 'statement format error',
+    'E101': 'nonexistent mnemonic',
+    'E102': 'operand missing or malformed',
+    'E103': 'register error',
+    'E104': 'expression error',
+    'E110': 'literal error',
+    'E120': 'data definition (BYTE / WORD / RESB / RESW) error',
+    'E130': 'START / END error',
+    'E131': 'CSECT / EXTDEF / EXTREF error',
+    'E132': 'BASE / EQU error',
+    'E140': 'macro definition / expansion error',
+    'E200': 'undefined symbol',
+    'E201': 'duplicate or reserved symbol',
+    'E900': 'too many errors',
+    'E999': 'internal error',
+}
+DIAGNOSTIC_LINE = re.compile(r'lin[e]?\s*(\d+)\s*:?\s*') # 報錯訊息開頭的行號
+
+# 一筆報錯 : line、column 從 1 開始 (不知道時為 None)，column 為出錯的 token 在該行的位置
+# severity : 'error' (繼續組譯，最後不輸出) 或 'fatal' (無法繼續，停止組譯)
+class Diagnostic:
+    __slots__ = ('code', 'line', 'column', 'severity', 'message')
+
+    def __init__(self, code, line, column, severity, message):
+        self.code = code
+        self.line = line
+        self.column = column
+        self.severity = severity
+        self.message = message
+
+    def to_dict(self) -> dict:
+        return {'code': self.code, 'line': self.line, 'column': self.column, 'severity': self.severity, 'message': self.message}
+
+    def __str__(self) -> str:
+        return self.message
+
+# 由報錯訊息建立 Diagnostic : code 由報錯的地方給 (見 DIAGNOSTIC_CODES)，行號取自訊息開頭的 'line N :'
+def make_diagnostic(message, code, severity='error', column=None) -> Diagnostic:
+    matched = DIAGNOSTIC_LINE.match(message)
+    line = int(matched.group(1)) if matched != None else None
+    return Diagnostic(code, line, column, severity, message)
+
+# 報錯的 column (從 1 開始) : 在原始碼行 line 裡依序找 tokens，回傳最後一個 token 的位置
+# 沒給 tokens 或找不到時為該行敘述開始的位置；巨集展開的敘述 (token list) 沒有原始碼，為 None
+def error_column(line, *tokens):
+    if type(line) is not str:
+        return None
+    column = start = len(line) - len(line.lstrip())
+    for token in tokens:
+        pos = line.find(token, start)
+        if pos != -1:
+            column, start = pos, pos + len(token)
+    return column + 1
+
+# mnemonic 編碼表 : 指令物件裡只存整數編號，同一個 mnemonic 字串只會存一份
+# 只登記虛指令 (PSEUDO_MNEMONICS) 與 optable 的指令 (建立 OpcodeTable 時)，使用者的輸入不會讓編碼表變大 :
+# literal (=C'EOF') 與其他不在表裡的字串，編號為 LITERAL_CODE，字串存在指令物件的 literal 欄位
+MNEMONIC_NAMES = [None] # 編號 => mnemonic 字串
+MNEMONIC_CODES = {} # mnemonic 字串 => 編號
+LITERAL_CODE = 0
+PSEUDO_MNEMONICS = ('START', 'END', 'BYTE', 'WORD', 'RESW', 'RESB', 'BASE', 'CSECT', 'EXTDEF', 'EXTREF', 'LTORG', 'EQU')
+
+def mnemonic_code(mnemonic) -> int:
+    code = MNEMONIC_CODES.get(mnemonic)
+    if code == None:
+        code = len(MNEMONIC_NAMES)
+        MNEMONIC_NAMES.append(mnemonic)
+        MNEMONIC_CODES[mnemonic] = code
+    return code
+
+for mnemonic in PSEUDO_MNEMONICS:
+    mnemonic_code(mnemonic)
+
+# 指令物件 : 取代原本每行一個 dict ('symbol' / 'mnemonic' / 'operand' / 'lineNum' / 'location' / 'objcode')
+# 用 __slots__ 省下 dict 的空間，mnemonic 存成整數編號 (literal 為 LITERAL_CODE，字串在 literal 欄位)，
+# opcode 為整數 (虛指令、literal 為 -1)，objcode 為 bytes，沒有的欄位一律是 None
+class Instruction:
+    __slots__ = ('code', 'literal', 'symbol', 'operand', 'line_num', 'location', 'opcode', 'objcode')
+
+    def __init__(self, mnemonic, symbol=None, operand=None, opcode=-1, line_num=None, location=None):
+        code = MNEMONIC_CODES.get(mnemonic)
+        if code != None:
+            self.code, self.literal = code, None
+        else:
+            self.code, self.literal = LITERAL_CODE, mnemonic
+        # symbol、operand 字串用 sys.intern 共用，同一個名稱在整個程式裡只存一份
+        self.symbol = sys.intern(symbol) if symbol != None else None
+        self.operand = sys.intern(operand) if type(operand) is str else operand # str 或 list (EXTDEF、EXTREF、格式二、索引定址)
+        self.line_num = line_num
+        self.location = location
+        self.opcode = opcode
+        self.objcode = None
+
+    @property
+    def mnemonic(self) -> str:
+        return MNEMONIC_NAMES[self.code] if self.code != LITERAL_CODE else self.literal
+
+    # 轉成原本 dict 的格式 (欄位順序相同，寫中間檔用)
+    def to_dict(self) -> dict:
+        instr = {}
+        if self.symbol != None:
+            instr['symbol'] = self.symbol
+        instr['mnemonic'] = self.mnemonic
+        if self.operand != None:
+            instr['operand'] = self.operand
+        if self.line_num != None:
+            instr['lineNum'] = self.line_num
+        if self.location != None:
+            instr['location'] = self.location
+        if self.objcode != None:
+            instr['objcode'] = self.objcode.hex().upper()
+        return instr
+
+# T record 產生器 : 一個程式區塊的 object code 依序累積在 bytearray 裡 (記住每個指令的結束位置)，
+# 一行 T record 結束時才一次轉成十六進位字串，每個指令的 object code 之後接一個空白 ('XXXXXX XXXX ')
+# 加上這個指令會超過 30 bytes 時換一行；RESW / RESB (記憶體不連續) 之後的指令也從新的一行開始
+class TextRecordBuilder:
+    __slots__ = ('positions', 'contents', 'buffer', 'cuts')
+
+    def __init__(self):
+        self.positions = []        # 每一行 T record 的起始位址
+        self.contents = []         # 已經結束的 T record 內容 (最後一行還在 buffer 裡)
+        self.buffer = bytearray()  # 最後一行的 object code
+        self.cuts = []             # 最後一行每個指令 object code 的結束位置 (沒有指令表示是 RESW / RESB 留下的空行)
+
+    # 把最後一行轉成字串
+    def __finish(self) -> None:
+        text = self.buffer.hex().upper()
+        begin = 0
+        pieces = []
+        for end in self.cuts:
+            pieces.append(text[begin * 2:end * 2])
+            begin = end
+        pieces.append('')
+        self.contents.append(' '.join(pieces))
+        self.buffer = bytearray()
+        self.cuts = []
+
+    # RESW / RESB : 記憶體不連續，下一個指令要從新的一行開始 (連續好幾個時只更新起始位址)
+    def gap(self, location) -> None:
+        if len(self.positions) == 0: # 程式區塊還沒有任何 object code
+            return
+        if len(self.cuts) == 0:
+            if location != None:
+                self.positions[-1] = location
+        else:
+            self.__finish()
+            self.positions.append(location if location != None else '')
+
+    def add(self, location, objcode) -> None:
+        cuts = self.cuts
+        if len(cuts) != 0 and cuts[-1] + len(objcode) <= 30: # 大部分的指令 : 接在同一行後面 (cuts[-1] 就是目前長度)
+            self.buffer += objcode
+            cuts.append(cuts[-1] + len(objcode))
+            return
+        if len(self.positions) == 0 or len(self.buffer) + len(objcode) > 30: # 超過 30 byte 要換一個 T record
+            if len(self.positions) != 0:
+                self.__finish()
+            self.positions.append(location)
+        elif len(self.cuts) == 0: # 上一個是要重新寫 T record 的虛指令，更新 location 為此指令當開頭
+            self.positions[-1] = location
+        self.buffer += objcode
+        self.cuts.append(len(self.buffer))
+
+    # 結束這個程式區塊，回傳 {起始位址: T record 內容}，之後可以重新開始下一個程式區塊
+    def records(self) -> dict:
+        if len(self.positions) != 0:
+            self.__finish()
+        records = {}
+        for index, position in enumerate(self.positions):
+            records[position] = self.contents[index]
+        self.positions = []
+        self.contents = []
+        return records
+
+# 組譯列表 (listing) : pass two 每處理完一個指令就寫一行 (行號、位址、敘述、object code)，
+# 每個程式區塊結束時寫出該區塊的 symbol table，write_object_program 再接上 object program 的 records
+# 敘述由指令物件的 symbol / mnemonic / operand 組回來 (不重新讀原始碼，comment 不會出現)；
+# 每行先放在 buffer，累積 LISTING_BUFFER_LINES 行才一次寫入檔案，不保留整份列表
+LISTING_BUFFER_LINES = 4096
+
+class ListingWriter:
+    def __init__(self, path):
+        self.file = open(path, mode='w')
+        self.buffer = []
+        self.lines = 0 # 已經寫出的敘述行數
+        self.__write(f'{"Line":>5s}  {"Loc":<6s}  {"Source statement":<40s}  Object code\n\n')
+
+    def __write(self, text) -> None:
+        self.buffer.append(text)
+        if len(self.buffer) >= LISTING_BUFFER_LINES:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.write(''.join(self.buffer))
+        self.buffer.clear()
+
+    # operand 是 list 時 (EXTDEF / EXTREF、格式二、索引定址 [symbol, ',X']) 用逗號接回去
+    def __operand(self, operand) -> str:
+        if operand == None:
+            return ''
+        if isinstance(operand, list):
+            text = operand[0]
+            for token in operand[1:]:
+                text += token if token[0] == ',' else ',' + token
+            return text
+        return operand
+
+    def statement(self, instr) -> None:
+        operand = instr.operand
+        if type(operand) is not str:
+            operand = self.__operand(operand)
+        location = instr.location
+        objcode = instr.objcode
+        line = (f'{instr.line_num if instr.line_num != None else "":>5}  {"%06X" % location if location != None else "":<6}  '
+                f'{instr.symbol or "":<8} {instr.mnemonic:<8} {operand:<22}  ')
+        buffer = self.buffer
+        buffer.append(line + objcode.hex().upper() + '\n' if objcode != None else line.rstrip() + '\n')
+        if len(buffer) >= LISTING_BUFFER_LINES:
+            self.flush()
+        self.lines += 1
+
+    # 在 pass two 依序處理的指令集中間插入 : 指令處理完 (有 object code 之後) 才寫出
+    def follow(self, instructions):
+        previous = None
+        for instr in instructions:
+            if previous != None:
+                self.statement(previous)
+            yield instr
+            previous = instr
+        if previous != None:
+            self.statement(previous)
+
+    # 程式區塊的 symbol table (依名稱排序，不含 literal)，absolute symbol 標上 A
+    def symbols(self, block, symbol_table, absolute=()) -> None:
+        self.__write(f'\nSymbol table : {block}\n')
+        for name in sorted(symbol_table):
+            if name[0] != '=':
+                self.__write('    {:<8s} {:06X} {}'.format(name, symbol_table[name] & 0xFFFFFF, 'A' if name in absolute else 'R').rstrip() + '\n')
+        self.__write('\n')
+
+    # 一個程式區塊的 H / D / R / T / M / E records
+    def records(self, record_list) -> None:
+        for record in record_list:
+            self.__write(record + '\n')
+        self.__write('\n')
+
+    # 最後寫出報錯訊息並關閉檔案
+    def close(self, errors=()) -> None:
+        if len(errors):
+            self.__write(f'\nErrors : {len(errors)}\n')
+            for reason in errors:
+                self.__write(f'    {reason}\n')
+        self.flush()
+        self.file.close()
+
+# 組譯結果 : 存放每個程式區塊的 H/D/R/T/M/E 資訊以及錯誤訊息，不會碰到檔案或 stdout
+class ObjectProgram:
+    def __init__(self, program_info=None, end_position=(), errors=None):
+        self.sections = program_info if program_info != None else {} # 程式區塊名稱 => 該區塊的資訊
+        self.end_position = end_position # (程式區塊名稱, 起始位址)，沒有就是空 tuple
+        self.errors = errors if errors != None else [] # 所有報錯訊息
+
+    # 組譯是否成功
+    @property
+    def ok(self) -> bool:
+        return len(self.errors) == 0 and len(self.sections) > 0
+
+    # 依序產生每個程式區塊的 records，每個元素為 (程式區塊名稱, [record 字串...])
+    def records(self):
+        for symbol, info in self.sections.items():
+            record_list = ['H {:<6s} {:06X} {:06X}'.format(symbol, info['start'], info['length'])]
+            if info['extdef']: # external define
+                record_list.append(info['extdef'])
+            if info['extref']: # external reference
+                record_list.append(info['extref'])
+            # T record
+            for offset, content in info['objcode'].items():
+                if content == '': # 因為為了分行 T record，可能會有 '' (空字串) 的問題
+                    continue
+                record_list.append('T {:06X} {:02X} {}'.format(offset, len(content.replace(' ', '')) // 2, content))
+            record_list += info['modified'] # modified record
+            if len(self.end_position) != 0 and symbol == self.end_position[0]:
+                record_list.append('E {:06X}'.format(self.end_position[1]))
+            else:
+                record_list.append('E')
+            yield symbol, record_list
+
+    # 輸出成 object program 檔案的文字內容
+    def to_text(self) -> str:
+        text = ''
+        for _, record_list in self.records():
+            text += '\n'.join(record_list) + '\n\n'
+        return text
+
+    # 每個程式區塊的資料 (給 loader / 模擬器用，不需要再解析十六進位文字)，每個元素為 dict :
+    #   name、start、length : H record
+    #   extdef : {symbol: 位址}、extref : [symbol, ...]
+    #   text : [(位址, bytes), ...]
+    #   modified : [(位址, half byte 數, '+' 或 '-', symbol), ...] (symbol 為 '' 表示這個程式區塊的載入位址)
+    #   entry : 起始執行位址 (E record)，沒有就是 None
+    def binary_sections(self) -> list:
+        sections = []
+        for name, info in self.sections.items():
+            tokens = info['extdef'].split()[1:] # 'D name 位址 name 位址 ...'
+            modified = []
+            for record in info['modified']: # 'M 位址 長度 +symbol' (沒有 symbol 的是相對於這個程式區塊的起始位址)
+                fields = record.split()
+                symbol = fields[3] if len(fields) == 4 else '+'
+                modified.append((int(fields[1], 16), int(fields[2], 16), symbol[0], symbol[1:]))
+            sections.append({
+                'name': name,
+                'start': info['start'],
+                'length': info['length'],
+                'extdef': {tokens[i]: int(tokens[i + 1], 16) for i in range(0, len(tokens), 2)},
+                'extref': info['extref'].split()[1:],
+                'text': [(position, bytes.fromhex(content)) for position, content in info['objcode'].items() if content != ''],
+                'modified': modified,
+                'entry': self.end_position[1] if len(self.end_position) != 0 and self.end_position[0] == name else None,
+            })
+        return sections
+
+    # 程式區塊的記憶體映像 : 長度為 H record 的長度，T record 放到 (位址 - 起始位址)，沒有 object code 的地方 (RESW / RESB) 為 0
+    def memory_image(self, name) -> bytearray:
+        info = self.sections[name]
+        image = bytearray(info['length'])
+        for position, content in info['objcode'].items():
+            if content != '':
+                data = bytes.fromhex(content)
+                offset = position - info['start']
+                image[offset:offset + len(data)] = data
+        return image
+
+    # 每個程式區塊寫一個記憶體映像檔 (stem_區塊名稱.img，一次寫入)，回傳寫出的檔名
+    def write_memory_images(self, stem) -> list:
+        paths = []
+        for name in self.sections:
+            path = f'{stem}_{name}.img'
+            with open(path, mode='wb') as f:
+                f.write(self.memory_image(name))
+            paths.append(path)
+        return paths
+
+    # 寫出二進位的可重定位 object 檔 (格式見 RELOCATABLE_MAGIC)
+    def write_relocatable(self, path) -> None:
+        with open(path, mode='wb') as f:
+            f.write(pack_relocatable(self.binary_sections()))
+
+# 二進位可重定位 object 檔 : 開頭是 RELOCATABLE_MAGIC、u16 程式區塊數，之後每個程式區塊依序為
+# (數字都是 little endian；name 為 u8 長度 + UTF-8 字串)
+#   H : name、u32 起始位址、u32 長度
+#   D : u16 個數，每個為 name、u32 位址
+#   symbol 表 : u16 個數，每個為 name (EXTREF 的 symbol 在前面，再來是 M record 用到的其他 symbol)
+#   R : u16 個數，每個為 u16 symbol 表索引
+#   T : u32 個數，每個為 u32 位址、u8 長度、object code
+#   M : u32 個數，每個固定 8 bytes (MODIFIED_ENTRY) : i32 位址 (與文字的 M record 相同，可能是負的)、u8 half byte 數、'+' 或 '-'、u16 symbol 表索引
+#   E : u8 有沒有起始執行位址、u32 起始執行位址
+RELOCATABLE_MAGIC = b'SICXE-OB\x01'
+MODIFIED_ENTRY = struct.Struct('<iBcH')
+
+def _pack_name(name) -> bytes:
+    data = name.encode('utf-8')
+    return struct.pack('<B', len(data)) + data
+
+# 把 ObjectProgram.binary_sections() 的資料轉成二進位可重定位 object 檔的內容
+def pack_relocatable(sections) -> bytes:
+    out = bytearray(RELOCATABLE_MAGIC)
+    out += struct.pack('<H', len(sections))
+    for section in sections:
+        symbols = list(section['extref'])
+        for _, _, _, symbol in section['modified']:
+            if symbol not in symbols:
+                symbols.append(symbol)
+        index = {symbol: i for i, symbol in enumerate(symbols)}
+        out += _pack_name(section['name']) + struct.pack('<II', section['start'], section['length'])
+        out += struct.pack('<H', len(section['extdef']))
+        for symbol, location in section['extdef'].items():
+            out += _pack_name(symbol) + struct.pack('<I', location)
+        out += struct.pack('<H', len(symbols))
+        for symbol in symbols:
+            out += _pack_name(symbol)
+        out += struct.pack('<H', len(section['extref']))
+        for symbol in section['extref']:
+            out += struct.pack('<H', index[symbol])
+        out += struct.pack('<I', len(section['text']))
+        for location, data in section['text']:
+            out += struct.pack('<IB', location, len(data)) + data
+        out += struct.pack('<I', len(section['modified']))
+        for location, half_bytes, sign, symbol in section['modified']:
+            out += MODIFIED_ENTRY.pack(location, half_bytes, sign.encode(), index[symbol])
+        entry = section['entry']
+        out += struct.pack('<BI', entry != None, entry if entry != None else 0)
+    return bytes(out)
+
+# 讀取二進位可重定位 object 檔，回傳與 ObjectProgram.binary_sections() 相同格式的 list
+# 不是可重定位 object 檔或檔案不完整時 raise ValueError
+def read_relocatable(path) -> list:
+    with open(path, mode='rb') as f:
+        data = f.read()
+    if not data.startswith(RELOCATABLE_MAGIC):
+        raise ValueError(f'{path} is not a relocatable object file')
+    position = len(RELOCATABLE_MAGIC)
+
+    def take(fmt):
+        nonlocal position
+        values = struct.unpack_from(fmt, data, position)
+        position += struct.calcsize(fmt)
+        return values if len(values) > 1 else values[0]
+
+    def take_name():
+        nonlocal position
+        size = take('<B')
+        if position + size > len(data):
+            raise struct.error('name out of range')
+        name = data[position:position + size].decode('utf-8')
+        position += size
+        return name
+
+    sections = []
+    try:
+        for _ in range(take('<H')):
+            section = {'name': take_name()}
+            section['start'], section['length'] = take('<II')
+            section['extdef'] = {}
+            for _ in range(take('<H')):
+                symbol = take_name()
+                section['extdef'][symbol] = take('<I')
+            symbols = [take_name() for _ in range(take('<H'))]
+            section['extref'] = [symbols[take('<H')] for _ in range(take('<H'))]
+            section['text'] = []
+            for _ in range(take('<I')):
+                location, size = take('<IB')
+                if position + size > len(data):
+                    raise struct.error('text record out of range')
+                section['text'].append((location, data[position:position + size]))
+                position += size
+            section['modified'] = []
+            for _ in range(take('<I')):
+                location, half_bytes, sign, symbol = MODIFIED_ENTRY.unpack_from(data, position)
+                position += MODIFIED_ENTRY.size
+                section['modified'].append((location, half_bytes, sign.decode(), symbols[symbol]))
+            has_entry, entry = take('<BI')
+            section['entry'] = entry if has_entry else None
+            sections.append(section)
+    except (struct.error, IndexError, UnicodeDecodeError):
+        raise ValueError(f'{path} is truncated or corrupted')
+    return sections
+
+# 解析文字格式的 object program (H / D / R / T / M / E)，回傳與 ObjectProgram.binary_sections() 相同格式的 list
+# 格式錯誤時 raise ValueError
+def parse_object_text(text) -> list:
+    sections = []
+    section = None
+    for line_num, line in enumerate(text.splitlines(), 1):
+        fields = line.split()
+        if len(fields) == 0:
+            continue
+        try:
+            if fields[0] == 'H':
+                section = {'name': fields[1], 'start': int(fields[2], 16), 'length': int(fields[3], 16),
+                           'extdef': {}, 'extref': [], 'text': [], 'modified': [], 'entry': None}
+                sections.append(section)
+            elif section == None:
+                raise ValueError('record before H record')
+            elif fields[0] == 'D':
+                for i in range(1, len(fields), 2):
+                    section['extdef'][fields[i]] = int(fields[i + 1], 16)
+            elif fields[0] == 'R':
+                section['extref'] += fields[1:]
+            elif fields[0] == 'T':
+                section['text'].append((int(fields[1], 16), bytes.fromhex(''.join(fields[3:]))))
+            elif fields[0] == 'M':
+                symbol = fields[3] if len(fields) == 4 else '+'
+                section['modified'].append((int(fields[1], 16), int(fields[2], 16), symbol[0], symbol[1:]))
+            elif fields[0] == 'E':
+                section['entry'] = int(fields[1], 16) if len(fields) > 1 else None
+                section = None
+            else:
+                raise ValueError(f'unknown record {fields[0]}')
+        except (ValueError, IndexError) as e:
+            raise ValueError(f'line {line_num} : {e}')
+    return sections
+
+# 讀取 object 檔 : 二進位可重定位 object 檔 (RELOCATABLE_MAGIC) 或文字格式的 object program
+def read_object_file(path) -> list:
+    with open(path, mode='rb') as f:
+        head = f.read(len(RELOCATABLE_MAGIC))
+    if head == RELOCATABLE_MAGIC:
+        return read_relocatable(path)
+    with open(path, mode='r') as f:
+        try:
+            return parse_object_text(f.read())
+        except ValueError as e:
+            raise ValueError(f'{path} {e}')
+
+# 連結載入器 (linking loader) : 把多個 object program 依序載入到 load_address 開始的一塊記憶體，回傳 dict :
+#   address : 載入位址、image : 記憶體映像 (bytearray)、estab : 外部符號表 {程式區塊名稱或 EXTDEF symbol: 載入後的位址}
+#   sections : [(程式區塊名稱, 載入位址, 長度), ...]、entry : 起始執行位址 (第一個有 E record 位址的程式區塊)、errors : 報錯訊息
+# programs 的每個元素是一個 object program : ObjectProgram 或 binary_sections() 格式的 list
+# 第一輪 : 依序分配每個程式區塊的位址並建立 ESTAB (dict)，重複定義的外部符號報錯 (以第一個為準)
+# 第二輪 : 把 T record 複製進記憶體映像，再依照 M record 修改 (找不到的外部符號報錯，不修改)
+# M record 的位址與組譯器輸出的相同，是相對於該 object program 的起始位址 (START 的 operand)
+def link_programs(programs, load_address=0) -> dict:
+    programs = [program.binary_sections() if isinstance(program, ObjectProgram) else program for program in programs]
+    estab = {}
+    errors = []
+    placed = [] # (程式區塊, 載入位址, 該 object program 的起始位址)
+    cs_address = load_address
+    for sections in programs:
+        program_start = sections[0]['start'] if len(sections) else 0
+        for section in sections:
+            if section['name'] in estab:
+                errors.append(f"duplicate external symbol {section['name']} (control section)")
+            else:
+                estab[section['name']] = cs_address
+            for symbol, location in section['extdef'].items():
+                if symbol in estab:
+                    errors.append(f"duplicate external symbol {symbol} ({section['name']})")
+                else:
+                    estab[symbol] = cs_address + location - section['start']
+            placed.append((section, cs_address, program_start))
+            cs_address += section['length']
+
+    image = bytearray(cs_address - load_address)
+    entry = None
+    for section, address, program_start in placed:
+        base = address - load_address - section['start'] # 位址 => image 的索引
+        for location, data in section['text']:
+            image[base + location:base + location + len(data)] = data
+        for symbol in section['extref']:
+            if symbol not in estab:
+                errors.append(f"undefined external symbol {symbol} ({section['name']})")
+        relocation = address - section['start'] # 沒有 symbol 的 M record : 程式區塊實際載入位址與組譯時位址的差
+        for location, half_bytes, sign, symbol in section['modified']:
+            if symbol == '':
+                value = relocation
+            elif symbol in estab:
+                value = estab[symbol]
+            else:
+                if symbol not in section['extref']: # EXTREF 裡的已經報錯過
+                    errors.append(f"undefined external symbol {symbol} ({section['name']})")
+                continue
+            index = base + location + program_start
+            size = (half_bytes + 1) // 2
+            mask = (1 << (half_bytes * 4)) - 1
+            field = int.from_bytes(image[index:index + size], 'big')
+            patched = (field + value if sign == '+' else field - value) & mask
+            image[index:index + size] = ((field & ~mask) | patched).to_bytes(size, 'big')
+        if entry == None and section['entry'] != None:
+            entry = address + section['entry'] - section['start']
+    return {
+        'address': load_address,
+        'image': image,
+        'estab': estab,
+        'sections': [(section['name'], address, section['length']) for section, address, _ in placed],
+        'entry': entry,
+        'errors': errors,
+    }
+
+# 以程式區塊 (START / CSECT) 為單位的組譯結果快取，存在 directory 裡，一個 key 一個檔案 (marshal)
+# 總大小超過 max_bytes 時，從最久沒用到的檔案開始刪 (LRU，以檔案的 mtime 當作最後使用時間)
+class SectionCache:
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def __path(self, key) -> str:
+        return os.path.join(self.directory, key + '.sec')
+
+    # 找不到或檔案壞掉都回傳 None
+    def get(self, key):
+        path = self.__path(key)
+        try:
+            with open(path, mode='rb') as f:
+                entry = marshal.loads(f.read())
+            os.utime(path) # 更新最後使用時間
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        return entry
+
+    # 先寫到暫存檔再 rename，多個 process 共用同一個 cache 時也不會讀到寫一半的檔案
+    def put(self, key, entry) -> None:
+        path = self.__path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, mode='wb') as f:
+            f.write(marshal.dumps(entry))
+        os.replace(temp_path, path)
+
+    # 刪掉最久沒用到的檔案，直到總大小不超過 max_bytes
+    def evict(self) -> None:
+        files = []
+        total = 0
+        for dir_entry in os.scandir(self.directory):
+            if not dir_entry.name.endswith('.sec'):
+                continue
+            try:
+                stat = dir_entry.stat()
+            except OSError: # 可能剛被其他 process 刪掉
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, dir_entry.path))
+            total += stat.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+# 與 SectionCache 相同介面，但存在記憶體裡 (watch mode 用，assembler 一直在記憶體中時不需要寫檔)
+# entry 以 marshal 過的 bytes 保存 (與檔案版相同，取出的是新的物件)，總大小超過 max_bytes 時刪掉最久沒用到的
+class MemorySectionCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.__entries = {} # key => marshal 過的 entry (dict 保持順序 : 越後面越近使用)
+        self.__total = 0
+
+    def get(self, key):
+        data = self.__entries.pop(key, None)
+        if data == None:
+            return None
+        self.__entries[key] = data # 移到最後 (最近使用)
+        return marshal.loads(data)
+
+    def put(self, key, entry) -> None:
+        data = marshal.dumps(entry)
+        old = self.__entries.pop(key, None)
+        if old != None:
+            self.__total -= len(old)
+        self.__entries[key] = data
+        self.__total += len(data)
+
+    def evict(self) -> None:
+        while self.__total > self.max_bytes and len(self.__entries):
+            key = next(iter(self.__entries))
+            self.__total -= len(self.__entries.pop(key))
+
+# opcode table (opCode.txt : 每行 "助記憶碼  格式  opcode(十六進位)"，格式為 1、2 或 3/4)
+# 預設讀 assembler 同一個資料夾的 opCode.txt，不受執行時的 cwd 影響
+OPCODE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'opCode.txt')
+OPTABLE_MAGIC = 'SICXE-OP\x01' # 預先編譯的 opcode table (marshal) 開頭
+
+# 解析好的 opcode table，同一個 process 裡所有 Assembler 共用 (見 load_optable)，內容不可修改
+#   formats : 助記憶碼 => 格式 (整數 1、2、3；3 表示 3/4)
+#   codes   : 助記憶碼與格式四的 +助記憶碼 => opcode 整數值
+#   digest  : 內容的 hash (增量組譯的 cache key 會用到，opCode.txt 改變時 cache 全部失效)
+class OpcodeTable:
+    __slots__ = ('path', 'formats', 'codes', 'digest')
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.formats = types.MappingProxyType({name: format for name, (format, code) in entries.items()})
+        codes = {}
+        for name, (format, code) in entries.items():
+            codes[name] = code
+            codes['+' + name] = code
+        self.codes = types.MappingProxyType(codes)
+        self.digest = hashlib.sha256(repr(sorted(entries.items())).encode()).hexdigest()
+
+# 解析 opCode.txt，回傳 {助記憶碼: (格式, opcode)}
+def parse_optable(path) -> dict:
+    entries = {}
+    with open(path, mode="r") as f:
+        for line in f:
+            opcode_arr = line.split()
+            if len(opcode_arr) == 0: # 空白行
+                continue
+            entries[opcode_arr[0]] = (int(opcode_arr[1].split('/')[0]), int(opcode_arr[2], base=16))
+    return entries
+
+_optables = {} # (opcode table 路徑, mtime, size) => OpcodeTable，每個 process 每份 table 只讀一次
+
+# 取得 path (預設 OPCODE_FILE) 的 OpcodeTable，同一個 process 裡重複呼叫不會重讀檔案
+# 有給 compiled_file 時使用預先編譯的 table (marshal)，不存在或比 opCode.txt 舊時重新解析並寫入 (寫入失敗就不寫)
+def load_optable(path=None, compiled_file=None) -> OpcodeTable:
+    path = os.path.abspath(path if path != None else OPCODE_FILE)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    table = _optables.get(key)
+    if table != None:
+        return table
+    entries = None
+    if compiled_file != None:
+        try:
+            with open(compiled_file, mode='rb') as f:
+                magic, source, entries = marshal.loads(f.read())
+            if magic != OPTABLE_MAGIC or tuple(source) != key:
+                entries = None
+        except (OSError, ValueError, EOFError, TypeError):
+            entries = None
+    if entries == None:
+        entries = parse_optable(path)
+        if compiled_file != None:
+            try:
+                temp_path = f'{compiled_file}.{os.getpid()}.tmp'
+                with open(temp_path, mode='wb') as f:
+                    f.write(marshal.dumps((OPTABLE_MAGIC, key, entries)))
+                os.replace(temp_path, compiled_file)
+            except OSError:
+                pass
+    table = OpcodeTable(path, entries)
+    _optables[key] = table
+    return table
+
+# SIC/XE 模擬器 =====================================================================
+# 暫存器編號 (與格式二指令的暫存器編號相同)
+REGISTER_NAMES = {'A': 0, 'X': 1, 'L': 2, 'B': 3, 'S': 4, 'T': 5, 'F': 6, 'PC': 8, 'SW': 9}
+MEMORY_SIZE = 1 << 20        # SIC/XE 記憶體 1 MB
+HALT_ADDRESS = 0xFFFFFF      # 載入時 L 的初始值 : 程式最後 RSUB / J @RETADR 回到這裡就結束
+SIMPLE, IMMEDIATE, INDIRECT = 0, 1, 2 # 格式三 / 四的定址方式
+
+class SimulatorError(Exception):
+    pass
+
+def _signed(value) -> int: # 24 bits 的補數表示轉成有號整數
+    return value - 0x1000000 if value & 0x800000 else value
+
+def _compare(left, right) -> int:
+    return (left > right) - (left < right)
+
+# SIC/XE 的 48 bits 浮點數 : 1 bit 正負號、11 bits 指數 (excess 1024)、36 bits 小數 (0.1xxx 正規化)
+def decode_float(value) -> float:
+    if value & 0x7FFFFFFFFFFF == 0:
+        return 0.0
+    fraction = (value & 0xFFFFFFFFF) / (1 << 36)
+    result = fraction * 2.0 ** (((value >> 36) & 0x7FF) - 1024)
+    return -result if value >> 47 else result
+
+def encode_float(number) -> int:
+    if number == 0:
+        return 0
+    fraction, exponent = math.frexp(abs(number)) # fraction 在 [0.5, 1)
+    exponent = min(max(exponent + 1024, 0), 0x7FF)
+    return (number < 0) << 47 | exponent << 36 | int(fraction * (1 << 36))
+
+# SIC/XE 模擬器 : 執行載入到 memory (bytearray) 的程式
+# 解碼過的指令依照位址存在 cache，迴圈裡重複執行的指令不需要重新解碼 nixbpe；寫入記憶體時清掉被蓋到的指令
+# 裝置 (TD / RD / WD) 對應 device_dir 裡的檔案 : 裝置 F1 => F1.dev (讀的檔案不存在時視為空檔案)
+class Simulator:
+    def __init__(self, optable=None, device_dir='.'):
+        self.optable = optable if isinstance(optable, OpcodeTable) else load_optable(optable)
+        self.memory = bytearray(MEMORY_SIZE)
+        self.registers = [0] * 10 # A X L B S T F (浮點數) - PC SW，SW 在 dump() 時由 cc 算出
+        self.registers[6] = 0.0
+        self.cc = 0               # condition code : -1 (<)、0 (=)、1 (>)
+        self.device_dir = device_dir
+        self.devices = {}         # (裝置編號, 'rb' 或 'wb') => 檔案，也可以直接放入自己的檔案物件
+        self.steps = 0            # 已執行的指令數
+        self.halt_address = HALT_ADDRESS
+        self.__decoded = {}       # 位址 => 解碼過的指令
+        self.__operations = {}    # opcode => (格式, 執行的 method)
+        handlers = {
+            'ADD': self.__add, 'SUB': self.__sub, 'MUL': self.__mul, 'DIV': self.__div,
+            'AND': self.__and, 'OR': self.__or, 'COMP': self.__comp, 'TIX': self.__tix,
+            'LDA': self.__load(0), 'LDX': self.__load(1), 'LDL': self.__load(2), 'LDB': self.__load(3),
+            'LDS': self.__load(4), 'LDT': self.__load(5), 'LDCH': self.__ldch,
+            'STA': self.__store(0), 'STX': self.__store(1), 'STL': self.__store(2), 'STB': self.__store(3),
+            'STS': self.__store(4), 'STT': self.__store(5), 'STCH': self.__stch, 'STSW': self.__stsw,
+            'J': self.__j, 'JEQ': self.__jeq, 'JGT': self.__jgt, 'JLT': self.__jlt, 'JSUB': self.__jsub, 'RSUB': self.__rsub,
+            'TD': self.__td, 'RD': self.__rd, 'WD': self.__wd,
+            'LDF': self.__ldf, 'STF': self.__stf, 'ADDF': self.__addf, 'SUBF': self.__subf,
+            'MULF': self.__mulf, 'DIVF': self.__divf, 'COMPF': self.__compf,
+            'ADDR': self.__addr, 'SUBR': self.__subr, 'MULR': self.__mulr, 'MURL': self.__mulr, 'DIVR': self.__divr,
+            'COMPR': self.__compr, 'CLEAR': self.__clear, 'RMO': self.__rmo, 'TIXR': self.__tixr,
+            'SHIFTL': self.__shiftl, 'SHIFTR': self.__shiftr,
+            'FIX': self.__fix, 'FLOAT': self.__float, 'NORM': self.__nop, 'HIO': self.__nop, 'SIO': self.__nop, 'TIO': self.__tio,
+        }
+        for name, format in self.optable.formats.items(): # 與組譯器使用同一份 opcode table
+            if name in handlers:
+                self.__operations[self.optable.codes[name]] = (format, handlers[name])
+
+    # 載入 object program (ObjectProgram、binary_sections() 格式的 list 或 object 檔路徑，可以多個) 並設定 PC / L
+    # load_address 沒給時載入到第一個程式區塊的起始位址 (組譯時的位址)，回傳 link_programs() 的結果
+    def load(self, programs, load_address=None) -> dict:
+        if not isinstance(programs, (list, tuple)) or (len(programs) and isinstance(programs[0], dict)):
+            programs = [programs]
+        programs = [read_object_file(program) if isinstance(program, str) else program for program in programs]
+        if load_address == None:
+            first = programs[0].binary_sections() if isinstance(programs[0], ObjectProgram) else programs[0]
+            load_address = first[0]['start'] if len(first) else 0
+        result = link_programs(programs, load_address)
+        if len(result['errors']):
+            raise SimulatorError('; '.join(result['errors']))
+        if load_address + len(result['image']) > MEMORY_SIZE:
+            raise SimulatorError('program does not fit in memory')
+        self.write(load_address, result['image'])
+        self.registers[8] = result['entry'] if result['entry'] != None else load_address
+        self.registers[2] = self.halt_address
+        return result
+
+    # 寫入記憶體 (會清掉被蓋到的已解碼指令)
+    def write(self, address, data) -> None:
+        self.memory[address:address + len(data)] = data
+        decoded = self.__decoded
+        if len(decoded):
+            for location in range(address - 3, address + len(data)):
+                decoded.pop(location, None)
+
+    # 暫存器內容 {名稱: 值}
+    def dump(self) -> dict:
+        registers = {name: self.registers[number] for name, number in REGISTER_NAMES.items()}
+        registers['SW'] = {-1: 0x40, 0: 0x00, 1: 0x80}[self.cc]
+        return registers
+
+    # 關閉裝置檔案
+    def close(self) -> None:
+        for device in self.devices.values():
+            device.close()
+        self.devices = {}
+
+    # 執行到程式結束 (PC 回到 halt_address)、遇到跳到自己的 J (無窮迴圈) 或執行了 max_steps 個指令
+    # 回傳停止原因 'halt'、'loop' 或 'steps'；不合法的指令或記憶體位址 raise SimulatorError
+    def run(self, max_steps=None) -> str:
+        registers = self.registers
+        decoded_cache = self.__decoded
+        limit = self.steps + max_steps if max_steps != None else -1
+        steps = self.steps
+        try:
+            while True:
+                pc = registers[8]
+                if pc == self.halt_address:
+                    reason = 'halt'
+                    break
+                if steps == limit:
+                    reason = 'steps'
+                    break
+                decoded = decoded_cache.get(pc)
+                if decoded == None:
+                    decoded = self.__decode(pc)
+                    decoded_cache[pc] = decoded
+                handler, next_pc, target, use_base, use_index, mode = decoded
+                registers[8] = next_pc
+                steps += 1
+                if mode == None: # 格式一 / 二 : target、use_base 為 r1、r2
+                    handler(target, use_base)
+                else:
+                    if use_base:
+                        target += registers[3]
+                    if use_index:
+                        target += registers[1]
+                    handler(target, mode)
+                if registers[8] == pc: # J 跳到自己
+                    reason = 'loop'
+                    break
+        except IndexError:
+            raise SimulatorError(f'memory access out of range at {pc:06X}')
+        finally:
+            self.steps = steps
+        return reason
+
+    # 解碼 pc 位址的指令，回傳 (method, 下一個指令的位址, 目標位址的固定部分, 加 B, 加 X, 定址方式)
+    def __decode(self, pc) -> tuple:
+        memory = self.memory
+        first = memory[pc]
+        operation = self.__operations.get(first & 0xFC)
+        if operation == None:
+            raise SimulatorError(f'invalid instruction {first:02X} at {pc:06X}')
+        format, handler = operation
+        if format == 1:
+            return handler, pc + 1, 0, 0, False, None
+        if format == 2:
+            second = memory[pc + 1]
+            return handler, pc + 2, second >> 4, second & 0xF, False, None
+        second = memory[pc + 1]
+        n, i = first >> 1 & 1, first & 1
+        use_index = second & 0x80 != 0
+        if n == 0 and i == 0: # SIC 格式 : 15 bits 位址
+            return handler, pc + 3, (second & 0x7F) << 8 | memory[pc + 2], False, use_index, SIMPLE
+        mode = IMMEDIATE if n == 0 else INDIRECT if i == 0 else SIMPLE
+        if second & 0x10: # e : 格式四
+            return handler, pc + 4, (second & 0xF) << 16 | memory[pc + 2] << 8 | memory[pc + 3], False, use_index, mode
+        displacement = (second & 0xF) << 8 | memory[pc + 2]
+        if second & 0x20: # p : PC 相對定址
+            if displacement & 0x800:
+                displacement -= 0x1000
+            displacement += pc + 3
+        return handler, pc + 3, displacement, second & 0x40 != 0, use_index, mode
+
+    # 記憶體存取 ----------------------------------------------------------------------
+    def __word(self, address) -> int:
+        memory = self.memory
+        return memory[address] << 16 | memory[address + 1] << 8 | memory[address + 2]
+
+    def __set_word(self, address, value) -> None:
+        self.write(address, (value & 0xFFFFFF).to_bytes(3, 'big'))
+
+    def __operand(self, target, mode) -> int: # 運算元 (一個 word)
+        if mode == IMMEDIATE:
+            return target & 0xFFFFFF
+        if mode == INDIRECT:
+            target = self.__word(target)
+        return self.__word(target)
+
+    def __byte(self, target, mode) -> int: # 運算元 (一個 byte)
+        if mode == IMMEDIATE:
+            return target & 0xFF
+        if mode == INDIRECT:
+            target = self.__word(target)
+        return self.memory[target]
+
+    def __float_operand(self, target, mode) -> float: # 運算元 (浮點數，6 bytes)
+        if mode == INDIRECT:
+            target = self.__word(target)
+        return decode_float(int.from_bytes(self.memory[target:target + 6], 'big'))
+
+    def __address(self, target, mode) -> int: # 寫入 / 跳躍的位址
+        return self.__word(target) if mode == INDIRECT else target
+
+    # 格式三 / 四的指令 ----------------------------------------------------------------
+    def __add(self, target, mode):
+        self.registers[0] = (self.registers[0] + self.__operand(target, mode)) & 0xFFFFFF
+
+    def __sub(self, target, mode):
+        self.registers[0] = (self.registers[0] - self.__operand(target, mode)) & 0xFFFFFF
+
+    def __mul(self, target, mode):
+        self.registers[0] = (_signed(self.registers[0]) * _signed(self.__operand(target, mode))) & 0xFFFFFF
+
+    def __div(self, target, mode):
+        self.registers[0] = self.__divide(self.registers[0], self.__operand(target, mode))
+
+    def __divide(self, left, right) -> int:
+        left, right = _signed(left), _signed(right)
+        if right == 0:
+            raise SimulatorError(f'division by zero at {self.registers[8]:06X}')
+        quotient = abs(left) // abs(right)
+        return (quotient if (left < 0) == (right < 0) else -quotient) & 0xFFFFFF
+
+    def __and(self, target, mode):
+        self.registers[0] &= self.__operand(target, mode)
+
+    def __or(self, target, mode):
+        self.registers[0] |= self.__operand(target, mode)
+
+    def __comp(self, target, mode):
+        self.cc = _compare(_signed(self.registers[0]), _signed(self.__operand(target, mode)))
+
+    def __tix(self, target, mode):
+        self.registers[1] = (self.registers[1] + 1) & 0xFFFFFF
+        self.cc = _compare(_signed(self.registers[1]), _signed(self.__operand(target, mode)))
+
+    def __load(self, register):
+        def load(target, mode):
+            self.registers[register] = self.__operand(target, mode)
+        return load
+
+    def __store(self, register):
+        def store(target, mode):
+            self.__set_word(self.__address(target, mode), self.registers[register])
+        return store
+
+    def __ldch(self, target, mode):
+        self.registers[0] = (self.registers[0] & 0xFFFF00) | self.__byte(target, mode)
+
+    def __stch(self, target, mode):
+        self.write(self.__address(target, mode), bytes((self.registers[0] & 0xFF,)))
+
+    def __stsw(self, target, mode):
+        self.__set_word(self.__address(target, mode), self.dump()['SW'])
+
+    def __j(self, target, mode):
+        self.registers[8] = self.__address(target, mode)
+
+    def __jeq(self, target, mode):
+        if self.cc == 0:
+            self.registers[8] = self.__address(target, mode)
+
+    def __jgt(self, target, mode):
+        if self.cc > 0:
+            self.registers[8] = self.__address(target, mode)
+
+    def __jlt(self, target, mode):
+        if self.cc < 0:
+            self.registers[8] = self.__address(target, mode)
+
+    def __jsub(self, target, mode):
+        self.registers[2] = self.registers[8]
+        self.registers[8] = self.__address(target, mode)
+
+    def __rsub(self, target, mode):
+        self.registers[8] = self.registers[2]
+
+    # 裝置 : 裝置編號對應 device_dir 裡的 XX.dev 檔案，第一次使用時才開啟
+    def __device(self, number, mode):
+        device = self.devices.get((number, mode))
+        if device == None:
+            path = os.path.join(self.device_dir, f'{number:02X}.dev')
+            if mode == 'rb' and not os.path.exists(path):
+                device = open(os.devnull, mode='rb')
+            else:
+                device = open(path, mode=mode)
+            self.devices[(number, mode)] = device
+        return device
+
+    def __td(self, target, mode): # 裝置永遠是 ready (<)
+        self.cc = -1
+
+    def __rd(self, target, mode): # 讀到檔案結尾時讀到 0
+        data = self.__device(self.__byte(target, mode), 'rb').read(1)
+        self.registers[0] = (self.registers[0] & 0xFFFF00) | (data[0] if len(data) else 0)
+
+    def __wd(self, target, mode):
+        self.__device(self.__byte(target, mode), 'wb').write(bytes((self.registers[0] & 0xFF,)))
+
+    def __ldf(self, target, mode):
+        self.registers[6] = self.__float_operand(target, mode)
+
+    def __stf(self, target, mode):
+        self.write(self.__address(target, mode), encode_float(self.registers[6]).to_bytes(6, 'big'))
+
+    def __addf(self, target, mode):
+        self.registers[6] += self.__float_operand(target, mode)
+
+    def __subf(self, target, mode):
+        self.registers[6] -= self.__float_operand(target, mode)
+
+    def __mulf(self, target, mode):
+        self.registers[6] *= self.__float_operand(target, mode)
+
+    def __divf(self, target, mode):
+        divisor = self.__float_operand(target, mode)
+        if divisor == 0:
+            raise SimulatorError(f'division by zero at {self.registers[8]:06X}')
+        self.registers[6] /= divisor
+
+    def __compf(self, target, mode):
+        self.cc = _compare(self.registers[6], self.__float_operand(target, mode))
+
+    # 格式一 / 二的指令 (r1、r2 為暫存器編號) -------------------------------------------
+    def __addr(self, r1, r2):
+        self.registers[r2] = (self.registers[r2] + self.registers[r1]) & 0xFFFFFF
+
+    def __subr(self, r1, r2):
+        self.registers[r2] = (self.registers[r2] - self.registers[r1]) & 0xFFFFFF
+
+    def __mulr(self, r1, r2):
+        self.registers[r2] = (_signed(self.registers[r2]) * _signed(self.registers[r1])) & 0xFFFFFF
+
+    def __divr(self, r1, r2):
+        self.registers[r2] = self.__divide(self.registers[r2], self.registers[r1])
+
+    def __compr(self, r1, r2):
+        self.cc = _compare(_signed(self.registers[r1]), _signed(self.registers[r2]))
+
+    def __clear(self, r1, r2):
+        self.registers[r1] = 0.0 if r1 == 6 else 0
+
+    def __rmo(self, r1, r2):
+        self.registers[r2] = self.registers[r1]
+
+    def __tixr(self, r1, r2):
+        self.registers[1] = (self.registers[1] + 1) & 0xFFFFFF
+        self.cc = _compare(_signed(self.registers[1]), _signed(self.registers[r1]))
+
+    def __shiftl(self, r1, r2): # 循環左移 r2 + 1 bits
+        count = (r2 + 1) % 24
+        value = self.registers[r1]
+        self.registers[r1] = ((value << count) | (value >> (24 - count))) & 0xFFFFFF
+
+    def __shiftr(self, r1, r2): # 右移 r2 + 1 bits，左邊補符號位元
+        self.registers[r1] = (_signed(self.registers[r1]) >> (r2 + 1)) & 0xFFFFFF
+
+    def __fix(self, r1, r2):
+        self.registers[0] = int(self.registers[6]) & 0xFFFFFF
+
+    def __float(self, r1, r2):
+        self.registers[6] = float(_signed(self.registers[0]))
+
+    def __tio(self, r1, r2):
+        self.cc = -1
+
+    def __nop(self, r1, r2):
+        pass
+
+# 運算式 : EQU、WORD 的 operand 可以用 + - * / 與括號組合，term 為十進位數字、symbol 或 * (現在位址)
+# 每個 operand 字串只解析一次成 AST (tuple)，存在 EXPRESSION_CACHE 重複使用 :
+#   ('num', 值) 、 ('sym', 名稱) 、 ('loc',) 、 ('neg', 子運算式) 、 (運算子, 左, 右)
+EXPRESSION_TOKEN = re.compile(r'\s*([-+*/()]|[^\s\-+*/()]+)')
+EXPRESSION_CACHE = {} # operand 字串 => AST (解析失敗時為 ExpressionError)
+EXPRESSION_CACHE_LIMIT = 1 << 16 # 超過這個數量就清空 (daemon / 監看模式長時間執行時不會一直變大)
+
+# code 為報錯代碼 (E104 運算式錯誤，找不到 symbol 為 E200)
+class ExpressionError(Exception):
+    def __init__(self, message, code='E104'):
+        super().__init__(message)
+        self.code = code
+
+def parse_expression(text):
+    node = EXPRESSION_CACHE.get(text)
+    if node == None:
+        try:
+            node = _ExpressionParser(text).parse()
+        except ExpressionError as e:
+            node = e
+        if len(EXPRESSION_CACHE) >= EXPRESSION_CACHE_LIMIT:
+            EXPRESSION_CACHE.clear()
+        EXPRESSION_CACHE[text] = node
+    if isinstance(node, ExpressionError):
+        raise node
+    return node
+
+# 遞迴下降 : expression := term {(+|-) term} ; term := factor {(*|/) factor} ; factor := (+|-) factor | ( expression ) | 數字 | symbol | *
+class _ExpressionParser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            matched = EXPRESSION_TOKEN.match(text, position)
+            self.tokens.append(matched.group(1))
+            position = matched.end()
+        self.index = 0
+
+    def __peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def __fail(self):
+        raise ExpressionError(f"expression syntax error in '{self.text}'")
+
+    def parse(self):
+        node = self.__expression()
+        if self.__peek() != None:
+            self.__fail()
+        return node
+
+    def __expression(self):
+        node = self.__term()
+        while self.__peek() in ('+', '-'):
+            operator = self.tokens[self.index]
+            self.index += 1
+            node = (operator, node, self.__term())
+        return node
+
+    def __term(self):
+        node = self.__factor()
+        while self.__peek() in ('*', '/'):
+            operator = self.tokens[self.index]
+            self.index += 1
+            node = (operator, node, self.__factor())
+        return node
+
+    def __factor(self):
+        token = self.__peek()
+        if token == None or token in (')', '/'):
+            self.__fail()
+        self.index += 1
+        if token == '-':
+            return ('neg', self.__factor())
+        if token == '+':
+            return self.__factor()
+        if token == '*': # 在 term 的位置是現在位址
+            return ('loc',)
+        if token == '(':
+            node = self.__expression()
+            if self.__peek() != ')':
+                self.__fail()
+            self.index += 1
+            return node
+        if token.isdigit():
+            return ('num', int(token))
+        return ('sym', token)
+
+# AST 裡用到的 symbol 名稱，依照出現順序不重複 (建立 EQU 的相依圖用)
+def expression_symbols(node, symbols=None) -> list:
+    if symbols == None:
+        symbols = []
+    if node[0] == 'sym':
+        if node[1] not in symbols:
+            symbols.append(node[1])
+    else:
+        for child in node[1:]:
+            if isinstance(child, tuple):
+                expression_symbols(child, symbols)
+    return symbols
+
+# 計算運算式，resolve(名稱) 回傳該 symbol 的 (值, relative 數, 外部引用)
+# 回傳 (值, relative 數, 外部引用) : relative 數為 relative term 的正負個數相加 (0 是 absolute、1 是 relative)，
+# 外部引用為 (正負號, EXTREF symbol) 的 tuple，要各產生一筆 M record
+def evaluate_expression(node, resolve, location=None) -> tuple:
+    kind = node[0]
+    if kind == 'num':
+        return node[1], 0, ()
+    if kind == 'sym':
+        return resolve(node[1])
+    if kind == 'loc':
+        if location == None:
+            raise ExpressionError("'*' has no location in this expression")
+        return location, 1, ()
+    if kind == 'neg':
+        value, relative, externals = evaluate_expression(node[1], resolve, location)
+        return -value, -relative, _negate_externals(externals)
+    left, left_relative, left_externals = evaluate_expression(node[1], resolve, location)
+    right, right_relative, right_externals = evaluate_expression(node[2], resolve, location)
+    if kind == '+':
+        return left + right, left_relative + right_relative, left_externals + right_externals
+    if kind == '-':
+        return left - right, left_relative - right_relative, left_externals + _negate_externals(right_externals)
+    # * 、 / 只能用在 absolute term
+    if left_relative or right_relative or left_externals or right_externals:
+        raise ExpressionError("relative term can't be multiplied or divided in expression")
+    if kind == '*':
+        return left * right, 0, ()
+    if right == 0:
+        raise ExpressionError('division by zero in expression')
+    quotient = abs(left) // abs(right) # 與 SIC/XE 的 DIV 一樣向 0 取整數
+    return (quotient if (left < 0) == (right < 0) else -quotient), 0, ()
+
+def _negate_externals(externals) -> tuple:
+    return tuple(('-' if sign == '+' else '+', symbol) for sign, symbol in externals)
+
+# 建立 evaluate_expression 用的 resolve : 在 symbols 找不到而在 extref 裡的 symbol 值為 0，記成外部引用
+def symbol_resolver(symbols, absolute, extref):
+    def resolve(name):
+        value = symbols.get(name)
+        if value != None:
+            return value, 0 if name in absolute else 1, ()
+        if name in extref:
+            return 0, 0, (('+', name),)
+        raise ExpressionError(f'{name} is undefined (reference?)', 'E200')
+    return resolve
+
+# 巨集 (在 scanner 之前展開) :
+#   NAME    MACRO   &A,&B=預設值        定義，到 MEND 之間是巨集本體 (可以再定義或呼叫其他巨集)
+#           ...     &A                   本體裡的 &A 換成參數 (X'&A' 這種接在字串中間的也可以)
+#   $LOOP   ...                          $ 開頭的名稱每次展開都換成不重複的名稱 ($AALOOP、$ABLOOP ...)
+#           MEND
+#   LABEL   NAME    值,B=值              呼叫 : 依位置或 參數名稱=值 給參數，LABEL 變成 LABEL EQU *
+# 同一個巨集用同樣的參數再展開時，直接使用第一次展開並 lex 過的 token list
+MACRO_PARAMETER = re.compile(r'&[A-Za-z_]\w*')
+MACRO_KEYWORD = re.compile(r'([A-Za-z_]\w*)=(.*)$')
+MACRO_LOCAL_LABEL = re.compile(r'\$(?=\w)')
+MACRO_MAX_DEPTH = 64 # 巨集呼叫巨集的最大層數 (避免無窮遞迴)
+
+class Macro:
+    __slots__ = ('name', 'parameters', 'defaults', 'body', 'line_num')
+
+    def __init__(self, name, parameters, defaults, body, line_num):
+        self.name = name
+        self.parameters = parameters # ['&A', '&B', ...]
+        self.defaults = defaults     # '&B' => 預設值
+        self.body = body             # 本體每一行的原始碼 (已經去掉註解)
+        self.line_num = line_num
+
+# 巨集處理器 : expand(lines) 是放在 scanner 前面的 generator，沒有巨集的行原封不動地產生；
+# 定義或展開過巨集之後，每一行改成產生 (原始碼的 index, 原始碼字串或展開後的 token list)
+# 展開出來的敘述都算在呼叫的那一行 (報錯的行號、增量組譯切區塊都以原始碼為準)
+# lex 為 Assembler 的 lexer ((index, 一行) => token list 或 None)，is_mnemonic 用來檢查巨集名稱
+class MacroProcessor:
+    def __init__(self, lex, error, is_mnemonic):
+        self.lex = lex
+        self.error = error
+        self.is_mnemonic = is_mnemonic
+        self.memoize = True # False 時每次呼叫都重新展開 (benchmark 比較用)
+        self.reset()
+
+    def reset(self) -> None:
+        self.macros = {}            # 名稱 => Macro
+        self.expansions = {}        # (名稱, 參數 tuple, 定義的版本) => (token lists, 含有 $ 名稱的 {行: [token 位置]})
+        self.version = 0            # 每定義一個巨集就加一，之前的展開結果不再使用
+        self.serial = 0             # 產生不重複名稱用的流水號
+        self.signature = ''         # 所有巨集定義的 hash (增量組譯的 cache key 要包含)
+        self.expanded_lines = set() # 有呼叫巨集的原始碼行號
+        self.stats = {'definitions': 0, 'expansions': 0, 'reused': 0, 'statements': 0, 'seconds': 0.0}
+
+    def expand(self, lines):
+        shifted = False # 定義或展開過巨集之後，後面的行都要帶 index
+        defining = None # 正在定義的巨集 : [名稱, 參數, 預設值, 本體, 行號, 巢狀的 MACRO 層數]
+        lines = enumerate(lines)
+        if len(self.macros) == 0: # 還沒有巨集時，只要找 MACRO / MEND (大部分的程式整個檔案都走這裡)
+            for index, line in lines:
+                if 'MACRO' in line or 'MEND' in line:
+                    lines = itertools.chain([(index, line)], lines)
+                    break
+                yield line
+            else:
+                return
+        for index, line in lines:
+            code = line.partition('.')[0]
+            if defining != None:
+                if self.__collect(defining, code):
+                    self.__define(*defining[:5])
+                    defining = None
+                if not shifted:
+                    yield '' # 定義巨集的行沒有敘述，用空行讓後面的行號不變
+            elif ('MACRO' in code or 'MEND' in code or len(self.macros) != 0) and self.__is_macro_line(code):
+                start = time.perf_counter()
+                statements = []
+                defining = self.__statement(index, code, statements, 0)
+                self.stats['statements'] += len(statements)
+                self.stats['seconds'] += time.perf_counter() - start
+                if len(statements) != 0:
+                    shifted = True
+                    for tokens in statements:
+                        yield (index, tokens)
+                elif not shifted:
+                    yield ''
+            else:
+                yield (index, line) if shifted else line
+        if defining != None:
+            self.error(f"line {defining[4]} : MACRO {defining[0]} has no MEND", 'E140')
+
+    def __is_macro_line(self, code) -> bool:
+        tokens = code.split(None, 2)
+        return len(tokens) != 0 and ('MACRO' in tokens[:2] or 'MEND' in tokens[:2] or tokens[0] in self.macros
+                                     or (len(tokens) > 1 and tokens[1] in self.macros))
+
+    # 處理一行 : 開始定義巨集時回傳定義中的狀態 (見 expand)；呼叫巨集時把展開的 token list 加到 statements，
+    # 其他的敘述 (只會在 depth > 0 的巨集本體裡) lex 之後加到 statements
+    def __statement(self, index, code, statements, depth):
+        tokens = code.split()
+        if len(tokens) == 0:
+            return None
+        if tokens[0] == 'MACRO':
+            self.error(f"line {index + 1} : MACRO must have a name", 'E140')
+        elif len(tokens) > 1 and tokens[1] == 'MACRO':
+            return self.__start_definition(index, tokens)
+        elif 'MEND' in tokens[:2]:
+            self.error(f"line {index + 1} : MEND without MACRO", 'E140')
+        elif tokens[0] in self.macros:
+            self.__call(index, self.macros[tokens[0]], code.split(None, 1)[1] if len(tokens) > 1 else '', statements, depth)
+        elif len(tokens) > 1 and tokens[1] in self.macros:
+            statements.append([tokens[0], 'EQU', '*'])
+            self.__call(index, self.macros[tokens[1]], code.split(None, 2)[2] if len(tokens) > 2 else '', statements, depth)
+        else:
+            tokens = self.lex(index, code)
+            if tokens != None and len(tokens) != 0:
+                statements.append(tokens)
+        return None
+
+    def __start_definition(self, index, tokens):
+        name = tokens[0]
+        if self.is_mnemonic(name):
+            self.error(f"line {index + 1} : macro name {name} 不能與保留字同名", 'E140')
+        parameters = []
+        defaults = {}
+        for parameter in ''.join(tokens[2:]).split(',') if len(tokens) > 2 else ():
+            parameter, equal, default = parameter.partition('=')
+            if MACRO_PARAMETER.fullmatch(parameter) == None or parameter in parameters:
+                self.error(f"line {index + 1} : MACRO {name} parameter format error ({parameter})", 'E140')
+                continue
+            parameters.append(parameter)
+            if equal:
+                defaults[parameter] = default
+        return [name, parameters, defaults, [], index + 1, 0]
+
+    # 定義中的一行 : 回傳 True 表示遇到對應的 MEND (本體裡定義的巨集有自己的 MEND)
+    def __collect(self, defining, code) -> bool:
+        tokens = code.split(None, 2)
+        if 'MEND' in tokens[:2]:
+            if defining[5] == 0:
+                return True
+            defining[5] -= 1
+        elif len(tokens) > 1 and tokens[1] == 'MACRO':
+            defining[5] += 1
+        defining[3].append(code)
+        return False
+
+    def __define(self, name, parameters, defaults, body, line_num) -> None:
+        if self.is_mnemonic(name): # 已經報錯，不能蓋掉指令
+            return
+        self.macros[name] = Macro(name, parameters, defaults, body, line_num)
+        self.version += 1
+        self.stats['definitions'] += 1
+        self.signature = hashlib.sha256((self.signature + repr((name, parameters, defaults, body))).encode()).hexdigest()
+
+    # 展開一次巨集呼叫 (index 為最外層的呼叫所在的行)，展開的 token list 加到 statements
+    def __call(self, index, macro, argument_text, statements, depth):
+        if depth >= MACRO_MAX_DEPTH:
+            self.error(f"line {index + 1} : macro expansion too deep ({macro.name})", 'E140')
+            return
+        values = self.__bind(index, macro, argument_text)
+        if values == None:
+            return
+        self.expanded_lines.add(index + 1)
+        self.stats['expansions'] += 1
+        key = (macro.name, tuple(values.values()), self.version)
+        cached = self.expansions.get(key) if self.memoize else None
+        if cached != None:
+            self.stats['reused'] += 1
+            body, local_labels = cached
+        else:
+            version = self.version
+            body = []
+            defining = None
+            for code in macro.body:
+                code = MACRO_PARAMETER.sub(lambda matched: values.get(matched.group(0), matched.group(0)), code)
+                if defining != None: # 巨集本體裡定義的巨集，展開時才定義
+                    if self.__collect(defining, code):
+                        self.__define(*defining[:5])
+                        defining = None
+                else:
+                    defining = self.__statement(index, code, body, depth + 1)
+            if defining != None:
+                self.error(f"line {index + 1} : MACRO {defining[0]} has no MEND (in macro {macro.name})", 'E140')
+            local_labels = {}
+            for row, tokens in enumerate(body):
+                columns = [column for column, token in enumerate(tokens) if '$' in token]
+                if len(columns) != 0:
+                    local_labels[row] = columns
+            if self.version == version: # 展開時定義了巨集的不能重複使用 (下次還要再定義一次)
+                self.expansions[key] = (body, local_labels)
+        if len(local_labels) != 0: # $ 名稱換成這次呼叫專用的名稱 (巨集裡呼叫的巨集的名稱也會再加上一層)
+            body = body.copy()
+            unique = '$' + self.__unique_name()
+            for row, columns in local_labels.items():
+                tokens = body[row].copy() # cache 裡的 token list 不能改
+                for column in columns:
+                    tokens[column] = MACRO_LOCAL_LABEL.sub(unique, tokens[column])
+                body[row] = tokens
+        statements += body
+
+    # 參數 : 依位置或 名稱=值 給，沒給的用預設值，回傳 &參數 => 值 (依照定義的順序，有錯時回傳 None)
+    def __bind(self, index, macro, argument_text):
+        values = {}
+        position = 0
+        for argument in argument_text.split(',') if argument_text.strip() != '' else ():
+            argument = argument.strip()
+            keyword = MACRO_KEYWORD.match(argument)
+            if keyword != None and '&' + keyword.group(1) in macro.parameters:
+                values['&' + keyword.group(1)] = keyword.group(2).strip()
+            elif position < len(macro.parameters):
+                values[macro.parameters[position]] = argument
+                position += 1
+            else:
+                self.error(f"line {index + 1} : too many arguments for macro {macro.name}", 'E140')
+                return None
+        for parameter in macro.parameters:
+            if parameter not in values:
+                if parameter not in macro.defaults:
+                    self.error(f"line {index + 1} : macro {macro.name} missing argument {parameter}", 'E140')
+                    return None
+                values[parameter] = macro.defaults[parameter]
+        return {parameter: values[parameter] for parameter in macro.parameters}
+
+    def __unique_name(self) -> str: # AA、AB ... ZZ、AAA ...
+        serial = self.serial
+        self.serial += 1
+        length = 2
+        while serial >= 26 ** length:
+            serial -= 26 ** length
+            length += 1
+        name = ''
+        for _ in range(length):
+            serial, digit = divmod(serial, 26)
+            name = chr(ord('A') + digit) + name
+        return name
+
+# 全域 symbol index : symbol => (程式區塊, 位址, 種類, 是否 EXTDEF)，種類為 'section' (區塊名稱) / 'relative' / 'absolute'
+# 同名的 symbol 先出現的 EXTDEF 或區塊名稱為準 (重複的 EXTDEF 另外報錯)，其他以後面的區塊為準 (與原本 END 的查法相同)
+def index_section_symbols(index, block, symbols, extdef, absolute) -> None:
+    for name, address in symbols.items():
+        if name[0] == '=': # literal 不放進 index
+            continue
+        old = index.get(name)
+        if old != None and (old[3] or old[2] == 'section'):
+            continue
+        kind = 'section' if name == block else 'absolute' if name in absolute else 'relative'
+        index[name] = (block, address, kind, extdef.get(name) != None)
+
+# 增量組譯時，單獨組譯一個程式區塊所用的哨兵名稱 (不會與程式裡的 symbol 重複)
+SECTION_SENTINEL = '\x00SECTION'
+SECTION_BASE_SENTINEL = '\x00BASE'
+SECTION_CACHE_VERSION = 6 # 區塊組譯的結果格式或規則改變時要加一，舊的 cache 就不會被用到
 
 class Assembler:
-    def __init__(self) : # init
+    # optable : opCode.txt 的路徑 (預設 OPCODE_FILE) 或已經載入的 OpcodeTable
+    def __init__(self, optable=None) : # init
         # 前面加上 __ 就是封裝，可定義私有變數或副程式
-        self.__opcode = {} # 裏頭存放 opcode 的對應 format 跟 hex value
-        self.instruction = [] # 儲存所有被 Scanner 分類過的指令集(指令集以 dict 表示)
-        self.__pseudo_code_list = [ # 虛指令列表
-            'START',
-            'END',
-            'BYTE',
-            'WORD',
-            'RESW',
-            'RESB',
-            'BASE',
-            'CSECT',
-            'EXTDEF',
-            'EXTREF',
-            'LTORG',
-            'EQU',
-        ]
+        self.optable = optable if isinstance(optable, OpcodeTable) else load_optable(optable) # 所有 instance 共用
+        self.__opcode = self.optable.formats # 助記憶碼 => 格式 (整數)
+        self.__opcode_value = self.optable.codes # mnemonic (含格式四的 +XXX) => opcode 整數值，建立指令物件時使用
+        for mnemonic in self.__opcode_value: # optable 的指令登記到 mnemonic 編碼表 (已經登記過的不會重複)
+            mnemonic_code(mnemonic)
+        self.instruction = [] # scanner() 分類好的指令集 (Instruction 物件)，pass_one() 沒給指令集時從這裡讀，讀完就清掉
+        self.__spilled = None # pass one 的結果 : 二進位中間檔的路徑或暫存檔 (file object)，pass two 從這裡依序讀回來 (見 pass_one)
+        self.__instruction_count = 0 # pass one 處理的指令數 (統計用)
+        self.__literal_count = 0 # pass one 放置的 literal 數 (統計用)
+        self.__blocks = {} # pass two 收集的程式區塊 => {length, start, objcode (T records)}，gen_object_program 使用
+        self.__end = None # pass two 遇到的 END 指令
+        self.__pseudo_code_list = list(PSEUDO_MNEMONICS) # 虛指令列表
         self.__extdef_table = {} # 指明哪些 symbols 在本 Control Section 中被定義，可供其他 section 引用
         self.__extref_table = {} # 指明哪些 symbols 在指明那些symbols 在本 section 會被引用，但是其他 section 中定義
         self.__symbol_table = {} # 存放多個程式區塊的 symbol table 
+        self.__absolute_symbols = {} # 程式區塊 => 值為 absolute 的 symbol (EQU 定義的常數，不需要 M record)
+        self.symbol_index = {} # 所有程式區塊的 symbol => (程式區塊, 位址, 種類, 是否 EXTDEF)，見 index_section_symbols
         self.__modified_record = {} # 存放多個程式區塊的 modified record 
-        self.__literal_table = [] # 存放各種字面常數
-        self.__init_optable() # 初始化 optable
+        self.__literal_table = {} # 存放目前 literal pool 裡的字面常數 (dict 去除重複並保持順序) => 解析結果
+        self.__literal_cache = {} # literal 字串 => (類型, 內容, object code list)，一次組譯裡每個 literal 只解析一次
         self.__error_flag = False # 紀錄程式有無報錯
+        self.errors = [] # 紀錄所有報錯訊息
+        self.diagnostics = [] # 與 errors 對應的 Diagnostic (代碼、行、欄、嚴重程度、訊息)
+        self.max_errors = None # 報錯數達到這個數量時停止組譯 (None 表示不限制)
+        self.echo = True # 是否將報錯訊息印到 stdout (assemble() 會關掉)
+        self.memory_image = False # write_object_program 時同時寫出每個程式區塊的記憶體映像 (輸出檔名_區塊名稱.img)
+        self.relocatable = False  # write_object_program 時同時寫出二進位可重定位 object 檔 (輸出檔名.obj)
+        self.listing_file = None  # execute() 時同時寫出組譯列表的檔名 (見 ListingWriter，None 表示不寫)
+        self.__listing = None     # 組譯中的 ListingWriter (pass two 與 write_object_program 寫入)
+        self.cache_stats = {'sections': 0, 'reused': 0} # 上一次 assemble_incremental 的區塊數與使用 cache 的區塊數
+        self.collect_stats = False # execute() / assemble() 時收集各階段的時間、記憶體與數量統計 (見 __start_stats)
+        self.stats = None # 上一次收集的統計 (dict，可以直接轉成 JSON)
+        self.__tracing = False # 統計用的 tracemalloc 是否由自己啟動
+        self.__section_assembler = None # assemble_incremental 單獨組譯區塊用的 Assembler (需要時才建立)
+        self.macro_processor = MacroProcessor(self.__lex, self.error, self.__check_mnemonic) # scanner 前面的巨集處理器
+        self.relaxation = {'passes': 0, 'promoted': 0} # 上一次 pass one 分配位址的輪數與自動改成格式 4 的指令數
+        self.__location_errors = [] # pass one 這一輪 EQU 計算的報錯在 self.errors 的 index (會因位址改變)
 
-    # 印出報錯資訊
-    def error(self, reason):  
-        if self.__error_flag == False:
-            print("\n====================== Error Occur =====================\n")
+    # 清除上一次組譯留下來的狀態，讓同一個 instance 可以重複使用 (optable 不需重讀)
+    def reset(self) -> None:
+        self.instruction = []
+        self.__release_spill()
+        self.__instruction_count = 0
+        self.__literal_count = 0
+        self.__blocks = {}
+        self.__end = None
+        self.__extdef_table = {}
+        self.__extref_table = {}
+        self.__symbol_table = {}
+        self.__absolute_symbols = {}
+        self.symbol_index = {}
+        self.__modified_record = {}
+        self.__literal_table = {}
+        self.__literal_cache = {} # 只在一次組譯裡共用，不然重複使用的 instance (daemon、watch、批次) 會一直變大
+        self.__error_flag = False
+        self.errors = []
+        self.diagnostics = []
+        self.macro_processor.reset()
+        self.relaxation = {'passes': 0, 'promoted': 0}
+
+    # 印出報錯資訊，並記錄成 Diagnostic (code 見 DIAGNOSTIC_CODES，column 只有 scanner 知道，見 error_column)
+    # 報錯數達到 max_errors 時再記錄一筆 E900 並 raise AssemblerError 停止組譯
+    def error(self, reason, code, severity='error', column=None):  
+        if self.echo:
+            self.__print_errors([reason], self.__error_flag == False)
         self.__error_flag = True # 紀錄程式已經有報錯
-        print(f"{reason}")
+        self.errors.append(reason)
+        self.diagnostics.append(make_diagnostic(reason, code, severity, column))
+        if severity != 'fatal' and self.max_errors != None and len(self.diagnostics) >= self.max_errors:
+            self.error(f'ERROR: too many errors ({len(self.diagnostics)}), stop', 'E900', 'fatal')
+            raise AssemblerError('too many errors')
+
+    # 印出報錯訊息，第一個報錯之前先印標題
+    def __print_errors(self, reasons, first) -> None:
+        if first:
+            print("\n====================== Error Occur =====================\n")
+        for reason in reasons:
+            print(f"{reason}")
+
+    # 無法預期的錯誤 (assembler 的 bug 或沒有檢查到的輸入)，記錄成 E999，不讓整個 process 結束
+    # 行號從發生錯誤的 frame 裡正在處理的指令 (instr) 或 scanner 的 index 找 (只有出錯時才需要)
+    def __internal_error(self, e) -> None:
+        line = None
+        traceback = e.__traceback__
+        while traceback != None:
+            local = traceback.tb_frame.f_locals
+            if isinstance(local.get('instr'), Instruction) and local['instr'].line_num != None:
+                line = local['instr'].line_num
+            elif traceback.tb_frame.f_code.co_name == 'scan' and isinstance(local.get('index'), int):
+                line = local['index'] + 1
+            traceback = traceback.tb_next
+        prefix = f'line {line} : ' if line != None else 'ERROR: '
+        self.error(f'{prefix}internal error ({type(e).__name__}: {e})', 'E999', 'fatal')
     
     # 看 optable 或 pseudo_code_list 裡頭有無該 mnemonic
     def __check_mnemonic(self, mnemonic) -> bool:
@@ -47,820 +1674,912 @@ class Assembler:
         else:
             return (self.__opcode.get(mnemonic) != None) or (mnemonic in self.__pseudo_code_list)
 
-    # 初始化 opcode table
-    def __init_optable(self) :
-        with open("./opCode.txt", mode="r") as f:
-            for line in f.readlines(): # 一次讀一行
-                opcode_arr = list(filter(None, line.split(" "))) # filter() 函數是用於過濾掉在 line.split(" ") 中可能出現的空字串
-                self.__opcode[opcode_arr[0]] = {
-                    "format": opcode_arr[1].split('/'),
-                    "code": int(opcode_arr[2].replace("\n", ""), base=16) # 將十六進位轉為十進位整數
-                }
-    #  (在 pass 2 的時候) generate object code list
-    # type 就是看 n 、p 的十進位值 
+    # 建立指令物件，順便查好 opcode (格式四 +XXX 與 XXX 的 opcode 相同)
+    def __new_instruction(self, mnemonic, symbol=None, operand=None) -> Instruction:
+        return Instruction(mnemonic, symbol, operand, self.__opcode_value.get(mnemonic, -1))
+
+    #  (在 pass 2 的時候) generate object code (bytes)
+    # opcode 就是指令物件的 opcode 整數值
+    # type 就是看 n 、p 的十進位值
     # format 就是看 x、b、p、e 的十進位值
     # offset 就是相對於 PC 或 BASE 偏移量
-    def __gen_code_list(self, opcode, type, format, offset) -> list:
+    def __gen_code_list(self, opcode, type, format, offset) -> bytes:
         # format 4
         if format & 1 == 1: # 如果 format 的最低位為1，執行相應的操作
-            return [
-                self.__opcode[opcode]['code'] + type,          # 第一個 byte 
-                format << 4 | ((offset & 0xf0000) >> 16),      # 第二個 byte 
-                (offset & 0xff00) >> 8,                        # 第三個 byte 
-                offset & 0xff,                                 # 第四個 byte 
-            ]
+            return bytes((
+                opcode + type,                                 # 第一個 byte
+                format << 4 | ((offset & 0xf0000) >> 16),      # 第二個 byte
+                (offset & 0xff00) >> 8,                        # 第三個 byte
+                offset & 0xff,                                 # 第四個 byte
+            ))
         # format 3
         else:
-            return [
-                self.__opcode[opcode]['code'] + type,          # 第一個 byte 
-                format << 4 | ((offset & 0xf00) >> 8),         # 第二個 byte 
-                offset & 0xff,                                 # 第三個 byte 
-            ]
+            return bytes((
+                opcode + type,                                 # 第一個 byte
+                format << 4 | ((offset & 0xf00) >> 8),         # 第二個 byte
+                offset & 0xff,                                 # 第三個 byte
+            ))
 
-    # Scanner 讀檔並且辨別 symbol、mnemonic、operand
+    # Scanner 讀檔並且辨別 symbol、mnemonic、operand (一次把整個程式存進 self.instruction，給 pass_one() 使用)
     def scanner(self, source_program) -> None:
+        try: 
+            self.instruction.extend(self.scan(read_source(source_program)))
+        except IOError:
+            self.error('ERROR: can not found ' + source_program, 'E001', severity='fatal')
+        except UnicodeDecodeError:
+            self.error('ERROR: 文件中有無法解碼的字元', 'E001', severity='fatal')
+
+    # 解析 literal (=C'..' / =X'..')，回傳 (類型, 引號內的內容, object code list)
+    # 結果存在 __literal_cache，同一個 literal 不論出現幾次都只解析一次
+    def __parse_literal(self, literal) -> tuple:
+        parsed = self.__literal_cache.get(literal)
+        if parsed == None:
+            kind = literal[1]
+            data = literal[3:].split('\'')[0] # \' 字串中表示一个單引號字元， =C'HELLO' => HELLO
+            objcode = []
+            if kind == 'C':
+                objcode = [ord(c) & 0xff for c in data] # 將 charactor 取得 ASCII 碼後放入 object code list
+            elif kind == 'X':
+                for i in range(0, len(data), 2): # 兩個兩個一組
+                    try:
+                        value = int(data[i : i + 2], base=16) # 字串轉成十六進位整數存入 object code list
+                    except ValueError:
+                        break
+                    if value < 0: # 例如 '-1' 也不是合法的十六進位 byte
+                        break
+                    objcode.append(value)
+            parsed = (kind, data, bytes(objcode))
+            self.__literal_cache[literal] = parsed
+        return parsed
+
+    # 依照位址順序取出 pass one 處理過的指令集 (從 pass one 暫存的中間檔依序讀回來，LTORG / END 之後放置的 literal 接在該行後面)
+    # 每次只建立一個指令物件，不會把整個程式留在記憶體裡
+    def located_instructions(self):
+        if self.__spilled != None:
+            yield from self.__read_spill(self.__spilled, True)
+
+    # 讀取 pass one 暫存的中間檔 (路徑或暫存檔)，依序產生指令物件 ; literals 為 False 時不產生放置的 literal
+    def __read_spill(self, spilled, literals=False):
+        opcode_value = self.__opcode_value
+        for record in read_intermediate(spilled):
+            if record[0] == 'I':
+                yield Instruction(record[1], record[2], record[3], opcode_value.get(record[1], -1), record[4], record[5])
+            elif record[0] == 'L':
+                if literals:
+                    yield Instruction(record[1], '*', location=record[2])
+            else: # 最後一筆是各個 table
+                return
+
+    # Lexer : 用 TOKEN_PATTERN 一次把一行切成 token，再依 token 組成 [symbol, mnemonic, operand...]
+    # 回傳 None 表示該行有錯誤並且要跳過 (錯誤訊息已經報過)
+    def __lex(self, index, line):
+        if '\'' not in line and ',' not in line and '=' not in line: # 沒有字串常數、逗號、等號，只要用空白切開
+            tokens = line.split()
+            if 'BYTE' not in tokens and 'EXTDEF' not in tokens and 'EXTREF' not in tokens:
+                return tokens
+        else:
+            tokens = TOKEN_PATTERN.findall(line)
+        if len(tokens) == 0:
+            return tokens
+        # BYTE : LABEL BYTE C'...' / LABEL BYTE X'...'
+        if len(tokens) > 1 and tokens[1] == 'BYTE':
+            operand = tokens[2] if len(tokens) > 2 else ' '
+            if operand[0] == 'C':
+                prefix = f'line {index + 1}: Charactor format'
+                empty_msg = f'line {index+1}: Charartor can not be empty'
+            elif operand[0] == 'X':
+                prefix = f'line {index + 1}:BYTE hex format'
+                empty_msg = f'line {index+1}:BYTE hex format can not be empty'
+            else:
+                self.error(f'line {index+1}: BYTE format error', 'E120', column=error_column(line, *tokens[:3]))
+                return None
+            if not tokens[-1].endswith('\''):
+                self.error(f'{prefix} 需要單引號結尾', 'E120', column=error_column(line, *tokens))
+            if line.count('\'') != 2:
+                self.error(f'{prefix} 單引號過多(只能用兩個單引號將內容包住)', 'E120', column=error_column(line, *tokens[:3]))
+            if '\'' not in operand: # 單引號前面不是剛好 LABEL BYTE C
+                self.error(f'{prefix} error', 'E120', column=error_column(line, *tokens[:3]))
+                return tokens
+            quote_pos = operand.index('\'')
+            if operand[quote_pos + 1:quote_pos + 2] in ('', '\''):
+                self.error(empty_msg, 'E120', column=error_column(line, *tokens[:3]))
+            elif operand[0] == 'X' and (' ' in operand or '\t' in operand): # 不能有空白
+                self.error(f"line {index+1}:BYTE hex content can't have space or tab charactor", 'E120', column=error_column(line, *tokens[:3]))
+            return [tokens[0], tokens[1], operand[0] + operand[quote_pos:]]
+        # literal : =C'...' / =X'...'
+        literal = None
+        if '=' in line and '\'' in line:
+            for pos, token in enumerate(tokens):
+                if token[0] == '=' and '\'' in token:
+                    literal = token
+                    break
+        if literal != None:
+            quote_pos = literal.index('\'')
+            if 'C' in literal[:quote_pos]: # literal charactor
+                if not tokens[-1].endswith('\''):
+                    self.error(f'line {index + 1}: Literal charactor format 需要單引號結尾', 'E110', column=error_column(line, *tokens))
+                if line.count('\'') != 2:
+                    self.error(f'line {index + 1}: Literal charactor format 單引號過多(只能用兩個單引號將內容包住)', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                if '=' in ''.join(tokens[:pos]) or pos > 2 or pos == 0:
+                    self.error(f'line {index + 1}: Literal charactor format error', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                if literal[quote_pos + 1:quote_pos + 2] in ('', '\''):
+                    self.error(f'line {index+1}: literal charartor format can not be empty', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                return tokens[:pos] + ['=C' + literal[quote_pos:]]
+            else: # literal hex format
+                if not tokens[-1].endswith('\''):
+                    self.error(f"line {index + 1}: Literal hex format 需要單引號框住所有十六進制數字", 'E110', column=error_column(line, *tokens))
+                if line.count('\'') != 2:
+                    self.error(f'line {index + 1}: Literal hex format 單引號過多(只能用兩個單引號將內容包住)', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                if '=' in ''.join(tokens[:pos]):
+                    self.error(f'line {index + 1}: literal 格式有誤', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                if pos > 2 or pos == 0:
+                    self.error(f'line {index + 1}: Literal hex format error', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                if literal[quote_pos + 1:quote_pos + 2] in ('', '\''):
+                    self.error(f'line {index+1}: literal X format can not be empty', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                elif ' ' in literal[quote_pos:] or '\t' in literal[quote_pos:]: # 不能有空白
+                    self.error(f'line {index+1}: literal X format can not have space', 'E110', column=error_column(line, *tokens[:pos + 1]))
+                return tokens[:pos] + ['=X' + literal[quote_pos:]]
+        # EXTDEF / EXTREF : EXTDEF A,B,C
+        if 'EXTDEF' in tokens or 'EXTREF' in tokens:
+            if '\'' in line or '=' in line: # symbol 含有引號或等號，只用逗號和空白切開
+                tokens = line.replace(',', ' , ').split()
+            if (tokens[0] != 'EXTDEF' and tokens[0] != 'EXTREF') or len(tokens) % 2 != 0 \
+                or tokens[2::2] != [','] * (len(tokens) // 2 - 1) or ',' in tokens[1::2]:
+                self.error(f'line {index+1}: format error', 'E131', column=error_column(line))
+                return None
+            return [tokens[0]] + tokens[1::2]
+        # 格式二也會有","的出現，要額外處理
+        if not FORMAT2_SCAN_SET.isdisjoint(tokens):
+            if line.count(',') > 1:
+                self.error(f'line {index + 1}: format 2 error', 'E102', column=error_column(line))
+            return [token for token in tokens if token != ',']
+        # 索引定址 : BUFFER,X
+        if ',' in tokens:
+            for comma_pos in range(len(tokens) - 1):
+                if tokens[comma_pos] == ',' and tokens[comma_pos + 1][0] == 'X':
+                    break
+            else:
+                comma_pos = -1
+            if comma_pos >= 0:
+                if tokens[-2:] != [',', 'X'] or tokens.count(',') != 1 or '\'' in line:
+                    self.error(f'line {index + 1}: index addressing format error', 'E102', column=error_column(line, *tokens[:comma_pos + 1]))
+                else:
+                    return tokens[:-2] + [',X']
+        if ',' in line or '\'' in line or '=' in line: # token 本身含有逗號、引號或等號，只用空白切開
+            return line.split()
+        return tokens
+
+    # Scanner 主體 : 接受任何可迭代的 source lines (檔案、list、字串切行)
+    # 以 generator 一行一行產生分類好的指令集，pass_one 邊讀邊分配位址，原始碼本身不會整個留在記憶體裡
+    # (分類好的指令由 pass one 寫進中間檔，pass two 再依序讀回來，見 pass_one)
+    def scan(self, lines):
         # 一個 Byte 格式的指令列表
         format1_list = ['FIX', 'FLOAT', 'HIO', 'NORM', 'SIO', 'TIO', 'CSECT', 'LTORG'] 
         # 兩個 Byte 格式的指令列表
         format2_list = ['ADDR', 'COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR'] 
-        try: 
-            with open(source_program, mode="r") as f:
-                start_flag = False # 找到 START 旗幟
-                end_flag = False # 找到 END 旗幟
-                for index, line in enumerate(f.readlines()): # 可同時輸出索引與值
-                    byte_flag = False
-                    if '.' in line : # 如果此行有【.】，filter comment 
-                        line = line[0:line.index('.')]# 刪除點以後的文字
-                    if 'BYTE' in line and len(list(filter(None,line.replace("\t", " ").split(" ")))) > 2: # 判斷是 BYTE
-                        line_list = list(filter(None,line.replace("\t", " ").split(" ")))
-                        if line_list[1] == 'BYTE':
-                            byte_flag = True
-                        else:
-                            byte_flag = False
-                    if byte_flag :
-                        if line_list[2][0] == 'C':
-                            line_str = line.replace(" ", "").replace("\t", "").replace("\n", "")
-                            if line_str[-1] != '\'':
-                                self.error(f'line {index + 1}: Charactor format 需要單引號結尾')
-                            if line_str.count('\'') != 2:
-                                self.error(f'line {index + 1}: Charactor format 單引號過多(只能用兩個單引號將內容包住)')
-                            start_pos = line.index('\'') # 會是第一個引號的位置
-                            line_symbol_mnemonic = line[0:start_pos]
-                            instruction_arr = list(filter(None, line_symbol_mnemonic.replace("\t", " ").split(" ")))
-                            if len(instruction_arr) != 3 or instruction_arr[2] != 'C':
-                                self.error(f'line {index + 1}: Charactor format error')
-                            content_pos = line.index('\'') + 1
-                            if line[content_pos] == '\'':
-                                self.error(f'line {index+1}: Charartor can not be empty')
-                            line_operand = '\'' + line[content_pos:].replace("\n", "")
-                            instruction_arr[2] += line_operand
-                        elif line_list[2][0] == 'X':
-                            line_str = line.replace(" ", "").replace("\t", "").replace("\n", "")
-                            if line_str[-1] != '\'':
-                                self.error(f'line {index + 1}:BYTE hex format 需要單引號結尾')
-                            if line_str.count('\'') != 2:
-                                self.error(f'line {index + 1}:BYTE hex format 單引號過多(只能用兩個單引號將內容包住)')
-                            start_pos = line.index('\'')
-                            line_symbol_mnemonic = line[0:start_pos]
-                            instruction_arr = list(filter(None, line_symbol_mnemonic.replace("\t", " ").split(" ")))
-                            if len(instruction_arr) != 3 or instruction_arr[2] != 'X':
-                                self.error(f'line {index + 1}:BYTE hex format error')
-                            content_pos = line.index('\'') + 1
-                            if line[content_pos] == '\'':
-                                self.error(f'line {index+1}:BYTE hex format can not be empty')
-                            # 不能有空白
-                            line_operand = '\'' + line[content_pos:].replace("\n", "")
-                            if " " in list(line_operand[1:].split('\''))[0] or "/t" in list(line_operand[1:].split('\''))[0]:
-                                self.error(f"line {index+1}:BYTE hex content can't have space or tab charactor")
-                            instruction_arr[2] += line_operand
-                        else:
-                            self.error(f'line {index+1}: BYTE format error')
-                    elif '=C\'' in line.replace(" ", "").replace("\t", "") : # literal charactor 
-                        line_str = line.replace(" ", "").replace("\t", "").replace("\n", "")
-                        try:
-                            if line_str[-1] != '\'':
-                                self.error(f'line {index + 1}: Literal charactor format 需要單引號結尾')
-                            if line_str.count('\'') != 2:
-                                self.error(f'line {index + 1}: Literal charactor format 單引號過多(只能用兩個單引號將內容包住)')
-                            if line_str.index('=C\'') != line_str.index('='):
-                                self.error(f'line {index + 1}: Literal charactor format error')
-                            start_pos = line.index('=')
-                            line_symbol_mnemonic = line[0:start_pos]
-                            instruction_arr = list(filter(None, line_symbol_mnemonic.replace("\t", " ").split(" ")))
-                            if len(instruction_arr) > 2 or len(instruction_arr) == 0:
-                                self.error(f'line {index + 1}: Literal charactor format error')
-                            content_pos = line.index('\'') + 1
-                            if line[content_pos] == '\'':
-                                self.error(f'line {index+1}: literal charartor format can not be empty')
-                            line_operand = '=C\'' + line[content_pos:].replace("\n", "")
-                            instruction_arr.append(line_operand)
-                        except ValueError :
-                            self.error(f'line {index + 1}: Charactor format error')
-                            continue
-                    # literal hex format
-                    elif  '=X\'' in line.replace(" ", "").replace("\t", "") :
-                        line_str = line.replace(" ", "").replace("\t", "").replace("\n", "")
-                        if line_str[-1] != '\'':
-                            self.error(f"line {index + 1}: Literal hex format 需要單引號框住所有十六進制數字")
-                        if line_str.count('\'') != 2:
-                            self.error(f'line {index + 1}: Literal hex format 單引號過多(只能用兩個單引號將內容包住)')
-                        if line_str.index('=')  != line_str.index('=X\''): 
-                            self.error(f'line {index + 1}: literal 格式有誤')
-                        start_pos = line.index('=')
-                        line_symbol_mnemonic = line[0:start_pos]
-                        instruction_arr = list(filter(None, line_symbol_mnemonic.replace("\t", " ").split(" ")))
-                        if len(instruction_arr) > 2 or len(instruction_arr) == 0:
-                            self.error(f'line {index + 1}: Literal hex format error')
-                        content_pos = line.index('\'') + 1
-                        if line[content_pos] == '\'':
-                            self.error(f'line {index+1}: literal X format can not be empty')
-                        # 不能有空白
-                        line_operand = '=X\'' + line[content_pos:].replace("\n", "")
-                        if " " in list(line_operand[3:].split('\''))[0] or "/t" in list(line_operand[3:].split('\''))[0]:
-                            self.error(f'line {index+1}: literal X format can not have space')
-                        instruction_arr.append(line_operand)        
-                    elif 'EXTDEF' in line or 'EXTREF' in line: 
-                        e_flag = False
-                        line_str = line.split(",")
-                        line_menmonic = list(filter(None,line_str[0].replace("\t"," ").replace("\n"," ").split(" ")))
-                        instruction_arr = []
-                        if len(line_menmonic) != 2 : # 長度一定要為二
-                            self.error(f'line {index+1}: format error')
-                            e_flag = True
-                        else:
-                            instruction_arr = line_menmonic
-                        if len(instruction_arr) > 0:
-                            if instruction_arr[0] != 'EXTDEF' and instruction_arr[0] != 'EXTREF':
-                                self.error(f'line {index+1}: format error')
-                                e_flag = True
-                        if e_flag == False and len(line_str) > 1: #表示 operand 有逗號
-                            for i , value in enumerate(line_str[1:]):
-                                value_str = value.replace("\t","").replace(" ","")
-                                if i == len(line_str[1:])-1: # 當執行到 operand 最後一個
-                                    value_list = list(filter(None,value.replace("\t"," ").replace("\n"," ").split(" ")))
-                                    if len(value_list) != 1:
-                                        self.error(f'line {index+1}: format error')
-                                        e_flag = True
-                                        break
-                                    else:
-                                        instruction_arr.append(value_list[0])
-                                elif value_str == "" or len(list(filter(None,value.replace("\t"," ").split(" ")))) > 1:
-                                    self.error(f'line {index+1}: format error')
-                                    e_flag = True
-                                    break
-                                else:
-                                    instruction_arr.append(value.replace("\t","").replace(" ",""))
-                        if e_flag == True:
-                            continue
+        start_flag = False # 找到 START 旗幟
+        end_flag = False # 找到 END 旗幟
+        for index, line in enumerate(self.macro_processor.expand(lines)): # 可同時輸出索引與值 (先經過巨集處理器)
+            if type(line) is tuple: # 巨集處理過的行 : (原始碼的 index, 原始碼或巨集展開後的 token list)
+                index, line = line
+            if type(line) is list: # 巨集展開的敘述已經 lex 過
+                instruction_arr = line
+            else:
+                instruction_arr = self.__lex(index, line.partition('.')[0]) # 刪除點以後的文字 (comment) 再切 token
+            if instruction_arr == None: # 該行格式錯誤且已報錯
+                continue
+            instruct_set = None   # 定義 instruction format
+
+            if instruction_arr == [] or len(instruction_arr) == 0: # 如果該行空了就跳過
+                continue
+            # 一般指令 (沒有下面要檢查格式的虛指令，第一個 token 也不是 *) 可以跳過這些檢查
+            keyword_flag = '*' == instruction_arr[0] or not SCAN_KEYWORD_SET.isdisjoint(instruction_arr)
+            # 先檢查 START 行，是否有錯誤
+            if keyword_flag and 'START' in instruction_arr:
+                if instruction_arr.index('START') != 1 or len(instruction_arr) != 3: 
+                    self.error(f'line {index + 1}: START format error ', 'E130', column=error_column(line))
+                    continue
+                elif len(instruction_arr[0]) > 6:
+                    self.error(f'line {index + 1}: "Program name must less than 6 charactors !"', 'E130', column=error_column(line, instruction_arr[0]))
+                start_flag = True
+            if start_flag == False :
+                continue
+            elif keyword_flag == False:
+                pass
+            elif 'END' in instruction_arr :
+                end_flag = True
+                if instruction_arr.index('END') != 0 or len(instruction_arr) != 2: 
+                    self.error(f"line {index + 1}: END format error", 'E130', severity='fatal', column=error_column(line))
+                    raise AssemblerError("END format error")
+            elif '*' == instruction_arr[0] : # 後面會拿此當作 literal 在 instruction set 裡面的保留字
+                 self.error(f"line {index + 1}: Symbol name can't be * (Reserved word) ", 'E201', column=error_column(line, instruction_arr[0]))
+                 continue
+            elif 'RSUB' in instruction_arr:
+                if len(instruction_arr) > 2: # RSUB 那行只有自己一個 token
+                    self.error(f'line {index + 1}: RSUB format error', 'E102', column=error_column(line))
+                    continue
+            elif 'WORD' in instruction_arr:
+                if instruction_arr[1] != 'WORD' or len(instruction_arr) != 3 :
+                    self.error(f"line {index + 1}: WORD format error", 'E120', column=error_column(line))
+                    continue
+            elif 'BYTE' in instruction_arr: # 檢查 BYTE 格式錯誤
+                if instruction_arr[1] == 'BYTE':
+                    if (instruction_arr[2][0] == 'X') and (len(instruction_arr[2]) > 63) :
+                        self.error(f"line {index + 1}: BTYE X operand's length must less than 60", 'E120', column=error_column(line, *instruction_arr[:3]))   
+                else:
+                    self.error(f"line {index + 1}: BTYE format error", 'E120', column=error_column(line))
+                    continue
+            elif 'RESW' in instruction_arr :
+                if instruction_arr.index('RESW') != 1 or len(instruction_arr) != 3 :
+                    self.error(f"line {index + 1}: RESW format error", 'E120', column=error_column(line))
+            elif 'RESB' in instruction_arr: 
+                if instruction_arr.index('RESB') != 1 or len(instruction_arr) != 3: 
+                    self.error(f"line {index + 1}: RESB format error", 'E120', column=error_column(line))
+            #  EXTDEF 用來指明哪些 symbols 在本 Control Section 中被 define
+            if keyword_flag and 'EXTDEF' in instruction_arr:
+                if len(instruction_arr) < 2:
+                    self.error(f'line {index + 1}: EXTDEF must have operand', 'E131', column=error_column(line, *instruction_arr))
+                    continue
+                elif instruction_arr.index('EXTDEF') != 0: # 如果 EXTDEF 不是排在第一個就報錯
+                    self.error(f'line {index + 1}: EXTDEF can not have symbol', 'E131', column=error_column(line, instruction_arr[0]))
+                    continue
+                else:
+                    instruct_set = self.__new_instruction(instruction_arr[0], operand=instruction_arr[1:])
+            # special process EXTREF
+            elif keyword_flag and 'EXTREF' in instruction_arr:
+                if instruction_arr.index('EXTREF') != 0: # 如果 EXTREF 不是排在第一個就報錯
+                    self.error(f'line {index + 1}: EXTREF can not have symbol', 'E131', column=error_column(line, instruction_arr[0]))
+                    continue
+                elif len(instruction_arr) <= 1:
+                    self.error(f'line {index + 1}: EXTREF must have operand', 'E131', column=error_column(line, *instruction_arr))
+                    continue
+                else:
+                    instruct_set = self.__new_instruction(instruction_arr[0], operand=instruction_arr[1:])
+            # process length = 4 (如果這一行有 4 個 token 的情況)
+            elif len(instruction_arr) == 4:
+                if self.__check_mnemonic(instruction_arr[1]) :
+                    if instruction_arr[1] == 'EQU' :
+                        self.error(f"line {index + 1}: EQU's operand format error", 'E132', column=error_column(line, *instruction_arr[:3]))
+                        instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0], instruction_arr[2])
+                    elif instruction_arr[2][0] == '=' : # 如果 operand 開頭是 "="，表示 literal 是有空白 
+                        self.error(f"line {index + 1}: literal's operand format error", 'E110', column=error_column(line, *instruction_arr[:3]))
+                        instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0], instruction_arr[2])
                     else:
-                        arr_flag = False
-                        for mnemonic in format2_list : # 如果他是格式二也會有","的出現，要額外處理
-                            if mnemonic in line:
-                                if line.count(',') > 1:
-                                    self.error(f'line {index + 1}: format 2 error')
-                                line = line.replace(",", " ").replace("\t", " ").replace("\n", "")
-                                instruction_arr = list(filter(None, line.split(" ")))
-                                arr_flag = True
-                        if arr_flag == False and ',X' in line.replace("\t", "").replace(" ", ""): # 索引定址
-                            # 真正是索引定址
-                            line_str = line.replace("\t", "").replace("\n", "").replace(" ", "")
-                            if line_str[len(line_str)-2:] != ',X':
-                                self.error(f'line {index + 1}: index addressing format error')
-                            elif line_str.count(',') != 1:
-                                self.error(f'line {index + 1}: index addressing format error')
-                            else:
-                                index_pos = line.index(',')
-                                line_memo = line[0:index_pos]
-                                instruction_arr = list(filter(None,line_memo.replace("\t", " ").split(" ")))
-                                instruction_arr.append(',X')
-                                arr_flag = True
-                        if arr_flag == False:
-                            instruction_arr = list(filter(None, line.replace("\t", " ").replace("\n", "").split(" ")))                 
-                    instruct_set = {}   # 定義 instruction format
-
-                    if instruction_arr == [] or len(instruction_arr) == 0: # 如果該行空了就跳過
-                        continue
-                    # 先檢查 START 行，是否有錯誤
-                    if 'START' in instruction_arr:
-                        if instruction_arr.index('START') != 1 or len(instruction_arr) != 3: 
-                            self.error(f'line {index + 1}: START format error ')
-                            continue
-                        elif len(instruction_arr[0]) > 6:
-                            self.error(f'line {index + 1}: "Program name must less than 6 charactors !"')
-                        start_flag = True
-                    if start_flag == False :
-                        continue
-                    elif 'END' in instruction_arr :
-                        end_flag = True
-                        if instruction_arr.index('END') != 0 or len(instruction_arr) != 2: 
-                            self.error(f"line {index + 1}: END format error")
-                            exit(1)
-                    elif '*' == instruction_arr[0] : # 後面會拿此當作 literal 在 instruction set 裡面的保留字
-                         self.error(f"line {index + 1}: Symbol name can't be * (Reserved word) ")
-                         continue
-                    elif 'RSUB' in instruction_arr:
-                        if len(instruction_arr) > 2: # RSUB 那行只有自己一個 token
-                            self.error(f'line {index + 1}: RSUB format error')
-                            continue
-                    elif 'WORD' in instruction_arr:
-                        if instruction_arr[1] != 'WORD' or len(instruction_arr) != 3 :
-                            self.error(f"line {index + 1}: WORD format error")
-                            continue
-                    elif 'BYTE' in instruction_arr: # 檢查 BYTE 格式錯誤
-                        if instruction_arr[1] == 'BYTE':
-                            if (instruction_arr[2][0] == 'X') and (len(instruction_arr[2]) > 63) :
-                                self.error(f"line {index + 1}: BTYE X operand's length must less than 60")   
-                        else:
-                            self.error(f"line {index + 1}: BTYE format error")
-                            continue
-                    elif 'RESW' in instruction_arr :
-                        if instruction_arr.index('RESW') != 1 or len(instruction_arr) != 3 :
-                            self.error(f"line {index + 1}: RESW format error")
-                    elif 'RESB' in instruction_arr: 
-                        if instruction_arr.index('RESB') != 1 or len(instruction_arr) != 3: 
-                            self.error(f"line {index + 1}: RESB format error")
-                    #  EXTDEF 用來指明哪些 symbols 在本 Control Section 中被 define
-                    if 'EXTDEF' in instruction_arr:
-                        if len(instruction_arr) < 2:
-                            self.error(f'line {index + 1}: EXTDEF must have operand')
-                            continue
-                        elif instruction_arr.index('EXTDEF') != 0: # 如果 EXTDEF 不是排在第一個就報錯
-                            self.error(f'line {index + 1}: EXTDEF can not have symbol')
-                            continue
-                        else:
-                            instruct_set = {
-                                'mnemonic': instruction_arr[0],
-                                'operand': instruction_arr[1:],
-                            }
-                    # special process EXTREF
-                    elif 'EXTREF' in instruction_arr:
-                        if instruction_arr.index('EXTREF') != 0: # 如果 EXTREF 不是排在第一個就報錯
-                            self.error(f'line {index + 1}: EXTREF can not have symbol')
-                            continue
-                        elif len(instruction_arr) <= 1:
-                            self.error(f'line {index + 1}: EXTREF must have operand')
-                            continue
-                        else:
-                            instruct_set = {
-                                'mnemonic': instruction_arr[0],
-                                'operand': instruction_arr[1:],
-                            }
-                    # process length = 4 (如果這一行有 4 個 token 的情況)
-                    elif len(instruction_arr) == 4:
-                        if self.__check_mnemonic(instruction_arr[1]) :
-                            if instruction_arr[1] == 'EQU' :
-                                self.error(f"line {index + 1}: EQU's operand format error")
-                                instruct_set = {
-                                    'symbol': instruction_arr[0],
-                                    'mnemonic': instruction_arr[1],
-                                    'operand': instruction_arr[2], 
-                                }
-                            elif instruction_arr[2][0] == '=' : # 如果 operand 開頭是 "="，表示 literal 是有空白 
-                                self.error(f"line {index + 1}: literal's operand format error")
-                                instruct_set = {
-                                    'symbol': instruction_arr[0],
-                                    'mnemonic': instruction_arr[1],
-                                    'operand': instruction_arr[2], 
-                                }
+                        instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0], instruction_arr[2:])
+                else:
+                    self.error(f'line {index + 1}: nonexistent mnemonic or Operand format error', 'E101', column=error_column(line, *instruction_arr[:2]))
+                    continue
+            # process length = 3 (如果這一行有 3 個 token 的情況)
+            elif len(instruction_arr) == 3:
+                if not FORMAT2_SCAN_SET.isdisjoint(instruction_arr): # 先用 set 快速判斷有沒有需要檢查的 mnemonic
+                    for mnemonic in format2_list: # 有可能是指令格式2 (2 個 byte 長度)
+                        if mnemonic in instruction_arr:
+                            if instruction_arr.index(mnemonic) == 0: # 該 mnemonic 前面沒有 label
+                                instruct_set = self.__new_instruction(instruction_arr[0], operand=instruction_arr[1:])
+                                break
                             else:
-                                instruct_set = {
-                                    'symbol': instruction_arr[0],
-                                    'mnemonic': instruction_arr[1],
-                                    'operand': instruction_arr[2:], 
-                                }
-                        else:
-                            self.error(f'line {index + 1}: nonexistent mnemonic or Operand format error')
-                            continue
-                    # process length = 3 (如果這一行有 3 個 token 的情況)
-                    elif len(instruction_arr) == 3:
-                        for mnemonic in format2_list: # 有可能是指令格式2 (2 個 byte 長度)
-                            if mnemonic in instruction_arr:
-                                if instruction_arr.index(mnemonic) == 0: # 該 mnemonic 前面沒有 label
-                                    instruct_set = {
-                                        'mnemonic': instruction_arr[0],
-                                        'operand': instruction_arr[1:],
-                                    }
-                                    break
-                                else:
-                                    self.error(f'line {index + 1}: format error')
-                                    continue
-                        # instruct has set and continue
-                        if len(instruct_set):
-                            instruct_set['lineNum'] = index + 1
-                            self.instruction.append(instruct_set)
-                            continue
+                                self.error(f'line {index + 1}: format error', 'E100', column=error_column(line, mnemonic))
+                                continue
+                # instruct has set and continue
+                if instruct_set != None:
+                    instruct_set.line_num = index + 1
+                    yield instruct_set
+                    continue
 
-                        if ',X' in instruction_arr: # (index address mode)
-                            if self.__check_mnemonic(instruction_arr[0]): # 如果第一個是助記憶碼
-                                instruct_set = {
-                                    'mnemonic': instruction_arr[0],
-                                    'operand': instruction_arr[1:],
-                                }
+                if ',X' in instruction_arr: # (index address mode)
+                    if self.__check_mnemonic(instruction_arr[0]): # 如果第一個是助記憶碼
+                        instruct_set = self.__new_instruction(instruction_arr[0], operand=instruction_arr[1:])
 
-                        if len(instruct_set):
-                            instruct_set['lineNum'] = index + 1
-                            self.instruction.append(instruct_set)
-                            continue
+                if instruct_set != None:
+                    instruct_set.line_num = index + 1
+                    yield instruct_set
+                    continue
                     
-                        for mnemonic in format1_list: # 如果在長度三查到 format 1
-                            if mnemonic in instruction_arr:
-                                if instruction_arr.index(mnemonic) == 2:
-                                    self.error(f"line {index + 1}: format 1 can't have two symbol")
-                                else:
-                                     self.error(f"line {index + 1}: format 1 can't have operand ")
+                if not FORMAT1_SCAN_SET.isdisjoint(instruction_arr):
+                    for mnemonic in format1_list: # 如果在長度三查到 format 1
+                        if mnemonic in instruction_arr:
+                            if instruction_arr.index(mnemonic) == 2:
+                                self.error(f"line {index + 1}: format 1 can't have two symbol", 'E102', column=error_column(line, *instruction_arr))
+                            else:
+                                 self.error(f"line {index + 1}: format 1 can't have operand ", 'E102', column=error_column(line, *instruction_arr))
                                    
-                        if self.__check_mnemonic(instruction_arr[1]):# 如果第二個是助記憶碼
-                            instruct_set = {
-                                'symbol': instruction_arr[0],
-                                'mnemonic': instruction_arr[1],
-                                'operand': instruction_arr[2],
-                            }
-                        else:
-                            self.error(f'line {index + 1}: Nonexistent mnemonic or Operand format error')
-                            continue
-                    # process length = 2 (如果這一行有 2 個 token 的情況)
-                    elif len(instruction_arr) == 2:
+                if self.__check_mnemonic(instruction_arr[1]):# 如果第二個是助記憶碼
+                    instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0], instruction_arr[2])
+                else:
+                    self.error(f'line {index + 1}: Nonexistent mnemonic or Operand format error', 'E101', column=error_column(line, *instruction_arr[:2]))
+                    continue
+            # process length = 2 (如果這一行有 2 個 token 的情況)
+            elif len(instruction_arr) == 2:
+                if not FORMAT1_SCAN_SET.isdisjoint(instruction_arr):
+                    for mnemonic in format1_list: # 有可能是指令格式1 (1 個 byte 長度)
+                        if mnemonic in instruction_arr:
+                            if instruction_arr.index(mnemonic) == 1:
+                                instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0])
+                                break
+                            else:
+                                self.error(f'line {index + 1}: format 1 must not have operand', 'E102', column=error_column(line, *instruction_arr))
+                                continue
+                if 'RSUB' in instruction_arr :
+                    if instruction_arr.index('RSUB') != 1:
+                        self.error(f'line {index + 1}: RSUB must not have operand', 'E102', column=error_column(line, *instruction_arr))
+                        continue
+                    else:
+                        instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0])
+                # instruct has set and continue
+                if instruct_set != None:
+                    instruct_set.line_num = index + 1
+                    yield instruct_set
+                    continue
+                if instruction_arr[0] == 'EQU':
+                    self.error(f'line {index + 1}: EQU must have symbol', 'E132', column=error_column(line))
+                    continue
+                elif self.__check_mnemonic(instruction_arr[0]): #助記憶碼在第一個參數
+                    instruct_set = self.__new_instruction(instruction_arr[0], operand=instruction_arr[1])
+                elif self.__check_mnemonic(instruction_arr[1]): #助記憶碼在第二個參數
+                    self.error(f'line {index + 1}: Operand not found', 'E102', column=error_column(line, *instruction_arr))
+                    instruct_set = self.__new_instruction(instruction_arr[1], instruction_arr[0], '1')
+                else:
+                    self.error(f'line {index + 1}: nonexistent mnemonic', 'E101', column=error_column(line))
+                    continue
+            # process length = 1 (如果這一行有 1 個 token 的情況)
+            else: 
+                if len(instruction_arr) > 4:
+                    self.error(f'line {index + 1}: 程式碼無法化成三欄式', 'E100', column=error_column(line))
+                    continue
+                elif self.__check_mnemonic(instruction_arr[0]):
+                    if not FORMAT1_SCAN_SET.isdisjoint(instruction_arr):
                         for mnemonic in format1_list: # 有可能是指令格式1 (1 個 byte 長度)
                             if mnemonic in instruction_arr:
-                                if instruction_arr.index(mnemonic) == 1:
-                                    instruct_set = {
-                                        'symbol': instruction_arr[0],
-                                        'mnemonic': instruction_arr[1],
-                                    }
-                                    break
-                                else:
-                                    self.error(f'line {index + 1}: format 1 must not have operand')
-                                    continue
-                        if 'RSUB' in instruction_arr :
-                            if instruction_arr.index('RSUB') != 1:
-                                self.error(f'line {index + 1}: RSUB must not have operand')
-                                continue
-                            else:
-                                instruct_set = {
-                                    'symbol': instruction_arr[0],
-                                    'mnemonic': instruction_arr[1],
-                                }
-                        # instruct has set and continue
-                        if len(instruct_set):
-                            instruct_set['lineNum'] = index + 1
-                            self.instruction.append(instruct_set)
-                            continue
-                        if instruction_arr[0] == 'EQU':
-                            self.error(f'line {index + 1}: EQU must have symbol')
-                            continue
-                        elif self.__check_mnemonic(instruction_arr[0]): #助記憶碼在第一個參數
-                            instruct_set = {
-                                'mnemonic': instruction_arr[0],
-                                'operand': instruction_arr[1],
-                            }
-                        elif self.__check_mnemonic(instruction_arr[1]): #助記憶碼在第二個參數
-                            self.error(f'line {index + 1}: Operand not found')
-                            instruct_set = {
-                                'symbol': instruction_arr[0],
-                                'mnemonic': instruction_arr[1],
-                                'operand' : '1'
-                            }
-                        else:
-                            self.error(f'line {index + 1}: nonexistent mnemonic')
-                            continue
-                    # process length = 1 (如果這一行有 1 個 token 的情況)
+                                instruct_set = self.__new_instruction(instruction_arr[0])
+                    if instruct_set != None:
+                        instruct_set.line_num = index + 1
+                        yield instruct_set
+                        continue
+                    if instruction_arr[0] == "RSUB":
+                        instruct_set = self.__new_instruction(instruction_arr[0])
                     else: 
-                        if len(instruction_arr) > 4:
-                            self.error(f'line {index + 1}: 程式碼無法化成三欄式')
-                            continue
-                        elif self.__check_mnemonic(instruction_arr[0]):
-                            for mnemonic in format1_list: # 有可能是指令格式1 (1 個 byte 長度)
-                                if mnemonic in instruction_arr:
-                                    instruct_set['lineNum'] = index + 1
-                                    instruct_set = {
-                                    'mnemonic': instruction_arr[0],
-                                    }
-                            if len(instruct_set):
-                                instruct_set['lineNum'] = index + 1
-                                self.instruction.append(instruct_set)
-                                continue
-                            if instruction_arr[0] == "RSUB":
-                                instruct_set = {
-                                    'mnemonic': instruction_arr[0],
-                                }
-                            else: 
-                                self.error(f'line {index + 1}: operand not found')
-                                continue
-                        else:
-                            self.error(f'line {index + 1}: Nonexistent mnemonic')
-                            continue
-                    instruct_set['lineNum'] = index + 1
-                    self.instruction.append(instruct_set)
-                if start_flag == False:
-                    self.error("Error: Cannot find START instruction")
-                elif end_flag  == False :
-                    self.error("Error: Cannot find END instruction")
-                    exit(1)
-        except IOError:
-            self.error('ERROR: can not found ' + source_program)
-        except UnicodeDecodeError:
-            self.error('ERROR: 文件中有無法解碼的字元' )
+                        self.error(f'line {index + 1}: operand not found', 'E102', column=error_column(line, instruction_arr[0]))
+                        continue
+                else:
+                    self.error(f'line {index + 1}: Nonexistent mnemonic', 'E101', column=error_column(line, instruction_arr[0]))
+                    continue
+            instruct_set.line_num = index + 1
+            yield instruct_set
+        if start_flag == False:
+            self.error("Error: Cannot find START instruction", 'E130')
+        elif end_flag  == False :
+            self.error("Error: Cannot find END instruction", 'E130', severity='fatal')
+            raise AssemblerError("Cannot find END instruction")
     
-    def pass_one(self , inter_file) :
+    # pass one 每一輪都把有 location 的指令集寫進二進位中間檔 (spill)，之後各輪與 pass two 都從中間檔依序讀回來，
+    # 不把所有指令物件留在記憶體裡 : 有給 inter_file 時寫在 inter_file，為 None 時寫在記憶體裡 (bytes，不讀寫檔案)
+    # instructions 可以是 scan() 產生的 generator (邊掃描邊處理)，沒給就使用 scanner() 存好的 self.instruction (讀完就清掉)
+    # pass one : 沒有 + 的格式 3/4 指令先都當成 3 bytes 分配位址 (__assign_locations)，再找出 operand 用 PC / BASE
+    # 相對定址都到不了的指令 (__find_promotions)，改成格式 4 (+) 後重新分配位址，直到沒有指令需要再改為止
+    # (只會從格式 3 改成 4，所以一定會停)；報錯先收起來，最後一輪結束再印出
+    # 第一輪的報錯包含 scanner 的報錯 (generator 在第一輪才被讀完)，之後各輪只重新分配位址，
+    # 只有 EQU 的計算結果 (__resolve_equ，記錄在 __location_errors) 會因為位址改變，所以只換掉這部分
+    def pass_one(self , inter_file=None, instructions=None) :
+        self.relaxation = {'passes': 0, 'promoted': 0}
+        echo, max_errors = self.echo, self.max_errors
+        error_count, diagnostic_count, error_flag = len(self.errors), len(self.diagnostics), self.__error_flag
+        kept = None # 第一輪與位址無關的 (報錯, Diagnostic)
+        if instructions == None:
+            instructions, self.instruction = self.instruction, []
+        self.__release_spill()
+        self.echo = False
+        try:
+            while True:
+                self.relaxation['passes'] += 1
+                self.__location_errors = []
+                self.__spill(inter_file, instructions)
+                if kept != None:
+                    located = [(self.errors[i], self.diagnostics[i - error_count + diagnostic_count]) for i in self.__location_errors]
+                    del self.errors[error_count:]
+                    del self.diagnostics[diagnostic_count:]
+                    for reason, diagnostic in kept + located:
+                        self.errors.append(reason)
+                        self.diagnostics.append(diagnostic)
+                    self.__error_flag = error_flag or len(self.errors) > error_count
+                promoted = self.__find_promotions()
+                if len(promoted) == 0:
+                    break
+                self.relaxation['promoted'] += len(promoted)
+                instructions = self.__promote(self.__spilled, promoted) # 之後各輪從上一輪的中間檔讀
+                if kept == None:
+                    location_errors = set(self.__location_errors)
+                    kept = [(self.errors[i], self.diagnostics[i - error_count + diagnostic_count])
+                            for i in range(error_count, len(self.errors)) if i not in location_errors]
+                    self.max_errors = None # 之後各輪的報錯會重複，數量以第一輪為準
+                del self.errors[error_count:]
+                del self.diagnostics[diagnostic_count:]
+                self.__error_flag = error_flag
+        finally:
+            self.echo, self.max_errors = echo, max_errors
+            if echo and len(self.errors) > error_count:
+                self.__print_errors(self.errors[error_count:], error_flag == False)
+
+    # pass one 的一輪 : 分配 location 並寫出中間檔，結果放在 self.__spilled
+    # inter_file 為 None 時寫在沒有檔名的暫存檔 (tempfile.TemporaryFile，關掉就消失)，不放在記憶體裡 :
+    # 保持開啟到下一次 pass one 或 reset() (pass two 與 located_instructions() 還要讀)
+    # 寫檔時先寫到暫存檔再換掉 inter_file (這一輪可能正在讀上一輪寫的 inter_file)
+    def __spill(self, inter_file, instructions) -> None:
+        if inter_file == None:
+            spill = tempfile.TemporaryFile(prefix='sicxe-', suffix='.bin')
+            try:
+                self.__assign_locations(spill, instructions)
+                spill.flush()
+            except BaseException:
+                spill.close()
+                raise
+            self.__release_spill() # 上一輪的暫存檔已經讀完
+            self.__spilled = spill
+            return
+        temp_file = f'{inter_file}.{os.getpid()}.tmp'
+        try:
+            with open(temp_file, mode='wb') as in_file:
+                self.__assign_locations(in_file, instructions)
+            os.replace(temp_file, inter_file)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+        self.__release_spill()
+        self.__spilled = inter_file
+
+    # 關掉 pass one 的暫存檔 (寫在 inter_file 時只是不再使用)
+    def __release_spill(self) -> None:
+        if self.__spilled != None and not isinstance(self.__spilled, str):
+            self.__spilled.close()
+        self.__spilled = None
+
+    # 上一輪的指令集 (從中間檔讀回來)，promoted 裡的指令 (依序的編號) 改成格式 4
+    def __promote(self, spilled, promoted):
+        for index, instr in enumerate(self.__read_spill(spilled)):
+            if index in promoted:
+                instr.code = MNEMONIC_CODES['+' + instr.mnemonic] # opcode 與格式 3 相同
+            yield instr
+
+    # 分配 location、建立 symbol / literal / extdef / extref table，依序把指令集寫進中間檔 in_file (見 INTERMEDIATE_MAGIC)
+    def __assign_locations(self, in_file, instructions) :
         cur_block = None        # 紀錄現在程式區塊
         cur_location = None     # 紀錄記憶體位址
         cur_symbol_table = {}   # 紀錄現在的 symbol table
         cur_extref_table = []   # 紀錄現在的 extref table
+        pending_equ = {}        # 這個程式區塊還沒計算的 EQU : symbol => (指令, 當時的 location counter)
         start_block_name = ""
-        in_file = open(inter_file , mode="w") 
-        for index, instr in enumerate(self.instruction): # 把指令集依序拿出來
-            if 'symbol' in instr and 'operand' in instr: # 檢查 Symbol 不能與 Operand 撞名
-                if isinstance(instr['operand'], list) :
-                    for oper in instr['operand']:
-                        if oper == instr['symbol']:
-                            self.error(f"line {instr['lineNum']} : Symbol 不能與 Operand 撞名")
+        in_file.write(INTERMEDIATE_MAGIC)
+        self.__instruction_count = 0
+        self.__literal_count = 0
+        for instr in instructions: # 把指令集依序拿出來
+            self.__instruction_count += 1
+            mnemonic = instr.mnemonic
+            placed = [] # 這一行 (LTORG / END) 之後放置的 literal : (literal, location)
+            if instr.symbol != None and instr.operand != None: # 檢查 Symbol 不能與 Operand 撞名
+                if isinstance(instr.operand, list) :
+                    for oper in instr.operand:
+                        if oper == instr.symbol:
+                            self.error(f"line {instr.line_num} : Symbol 不能與 Operand 撞名", 'E201')
                 else:
-                    if instr['operand'] == instr['symbol']:
-                            self.error(f"line {instr['lineNum']} : Symbol 不能與 Operand 撞名")
+                    if instr.operand == instr.symbol:
+                            self.error(f"line {instr.line_num} : Symbol 不能與 Operand 撞名", 'E201')
             # 字面常數 : 如果該行有 operand 並且第一個 operand 是 "=" 開頭
-            if 'operand' in instr and instr['operand'][0] == '=': 
+            if instr.operand != None and instr.operand[0] == '=': 
                 # 如果該 literal 沒有出現在 literal table (過濾重複的 literal)
-                if instr['operand'] not in self.__literal_table: 
-                    self.__literal_table.append(instr['operand']) # 將該 operand 加入 literabl table
+                if instr.operand not in self.__literal_table: 
+                    self.__literal_table[instr.operand] = self.__parse_literal(instr.operand) # 將該 operand 加入 literabl table
             
             #_pseudo_code operation 找到 START 虛指令
-            if instr['mnemonic'] == 'START': 
-                start_block_name = instr['symbol']
-                cur_block = instr['symbol']     # 更新現在位於的程式區塊
+            if mnemonic == 'START': 
+                start_block_name = instr.symbol
+                cur_block = instr.symbol     # 更新現在位於的程式區塊
                 cur_symbol_table.clear()        # reset symbol table
                 cur_extref_table.clear()        # reset extref table
                 self.__literal_table.clear()    # reset literal table
                 self.__extdef_table.clear()     # reset extdef table
                 self.__extref_table.clear()     # reset extref table
+                self.__absolute_symbols.clear() # reset absolute symbols
+                self.symbol_index.clear()       # reset global symbol index
                 try : 
-                    cur_location = int(instr['operand'], base=16) # 將十六進位換成十進位 (location 先用十進位運算)
+                    cur_location = int(instr.operand, base=16) # 將十六進位換成十進位 (location 先用十進位運算)
                 except ValueError:
-                    self.error(f"line {instr['lineNum']} : START's operand must be hex")
-                    exit(1)
-                instr['location'] = cur_location
+                    self.error(f"line {instr.line_num} : START's operand must be hex", 'E130', severity='fatal')
+                    raise AssemblerError("START's operand must be hex")
+                instr.location = cur_location
                 self.__extdef_table[cur_block] = {} # 初始化 __extdef_table 先記錄現在位於的程式區塊
+                self.__absolute_symbols[cur_block] = set()
             # add extdef symbol
-            elif instr['mnemonic'] == 'EXTDEF': # 虛指令不算記憶體位置
-                for ext_def in instr['operand']: # 將 external defination's operand 都拿出來
+            elif mnemonic == 'EXTDEF': # 虛指令不算記憶體位置
+                for ext_def in instr.operand: # 將 external defination's operand 都拿出來
                     self.__extdef_table[cur_block][ext_def] = None # 初始化這些定義給外部使用的參數
             # add extref symbol
-            elif instr['mnemonic'] == 'EXTREF': # 虛指令不算記憶體位置
-                cur_extref_table += instr['operand'] # list 相加
+            elif mnemonic == 'EXTREF': # 虛指令不算記憶體位置
+                cur_extref_table += instr.operand # list 相加
             # declare variable
-            elif instr['mnemonic'] == 'RESW':
+            elif mnemonic == 'RESW':
                 # 先紀錄該指令行的 location counter
-                instr['location'] = cur_location 
+                instr.location = cur_location 
                 try : 
-                    cur_location += int(instr['operand']) * 3 # location counter 加上 operand 值乘 3
+                    cur_location += int(instr.operand) * 3 # location counter 加上 operand 值乘 3
                 except(ValueError,TypeError):
-                    self.error(f"line {instr['lineNum']} : RESW's operand has wrong data type ")
+                    self.error(f"line {instr.line_num} : RESW's operand has wrong data type ", 'E120')
                 except KeyError:
-                    self.error(f"line {instr['lineNum']}")
-            elif instr['mnemonic'] == 'RESB': 
+                    self.error(f"line {instr.line_num}", 'E120')
+            elif mnemonic == 'RESB': 
                 # 先紀錄該指令行的 location counter
-                instr['location'] = cur_location 
+                instr.location = cur_location 
                 try : 
-                    cur_location += int(instr['operand']) # location counter 加上 operand
+                    cur_location += int(instr.operand) # location counter 加上 operand
                 except(ValueError,TypeError):
-                    self.error(f"line {instr['lineNum']} : RESB's operand has wrong data type ")
+                    self.error(f"line {instr.line_num} : RESB's operand has wrong data type ", 'E120')
                 except KeyError:
                     pass
             # clear literal
-            elif instr['mnemonic'] == 'LTORG' or instr['mnemonic'] == 'END': # 當遇到 LTORG 語句或程式結束
-                it = index  # 是目前的索引值 ，紀錄下一個 literal position
-                for literal in self.__literal_table:
-                    it += 1
+            elif mnemonic == 'LTORG' or mnemonic == 'END': # 當遇到 LTORG 語句或程式結束
+                for literal, (kind, data, objcode) in self.__literal_table.items():
                     # 將 literal 加入 symbol table
                     cur_symbol_table[literal] = cur_location 
-                    # add new instruction at next one
-                    self.instruction.insert(it, {
-                        'symbol': '*',
-                        'mnemonic': literal,
-                        'location': cur_location
-                    })
+                    # 放在這一行 (LTORG / END) 之後，在中間檔裡接在該行後面
+                    placed.append((literal, cur_location))
                     # compute memory displacement
-                    if literal[1] == 'C': 
-                        # charactor =C'HELLO'
-                        # \' 字串中表示一个單引號字元， list() => [ 'HELLO' , '']
-                        if len(list(literal[3:].split('\''))[0]) > 30 :
-                            self.error(f"line {instr['lineNum']} :literal C format must less than 30 charactors")
+                    if kind == 'C': # charactor =C'HELLO'
+                        if len(data) > 30 :
+                            self.error(f"line {instr.line_num} :literal C format must less than 30 charactors", 'E110')
                         else:
-                            cur_location += len(list(literal[3:].split('\''))[0]) 
-                    elif literal[1] == 'X':  # hex =X'1F'
-                        if len(list(literal[3:].split('\''))[0]) % 2 != 0 :
-                            self.error(f"line {instr['lineNum']} : literal X format content must be even")
-                        elif len(list(literal[3:].split('\''))[0]) == 0 :
-                            self.error(f"line {instr['lineNum']} : literal X format content can't be empty")
-                        elif len(list(literal[3:].split('\''))[0]) > 60:
-                            self.error(f"line {instr['lineNum']} : literal X format operand length must less than 60")
+                            cur_location += len(data)
+                    elif kind == 'X':  # hex =X'1F'
+                        if len(data) % 2 != 0 :
+                            self.error(f"line {instr.line_num} : literal X format content must be even", 'E110')
+                        elif len(data) == 0 :
+                            self.error(f"line {instr.line_num} : literal X format content can't be empty", 'E110')
+                        elif len(data) > 60:
+                            self.error(f"line {instr.line_num} : literal X format operand length must less than 60", 'E110')
                         else:
                             # // 除 2 向下取整數，因為十六進位是兩個數代表一個 Byte
-                            cur_location += len(list(literal[3:].split('\''))[0]) // 2
+                            cur_location += len(data) // 2
                     else:
-                        self.error(f"line {instr['lineNum']} : literal format error")
+                        self.error(f"line {instr.line_num} : literal format error", 'E110')
                 self.__literal_table.clear()
                 # update symbol table 、 extref_table
-                if instr['mnemonic'] == 'END':
+                if mnemonic == 'END':
+                    self.__resolve_equ(pending_equ, cur_symbol_table, cur_extref_table, cur_block)
                     # [notice]: must use copy before reset
                     self.__symbol_table[cur_block] = cur_symbol_table.copy() # 將此 symbol table 放入該控制區塊的 symbol table
                     self.__extref_table[cur_block] = cur_extref_table.copy() # 將此 extref table 放入該控制區塊的 extref table
+                    index_section_symbols(self.symbol_index, cur_block, self.__symbol_table[cur_block],
+                                          self.__extdef_table[cur_block], self.__absolute_symbols[cur_block])
                     cur_symbol_table.clear()
                     cur_extref_table.clear()
                     self.__literal_table.clear()
-                    if instr['operand'] not in self.__symbol_table[start_block_name] :
-                        self.error(f"line {instr['lineNum']} : END's operand is undefined in symbol table ")
+                    if instr.operand not in self.__symbol_table[start_block_name] :
+                        self.error(f"line {instr.line_num} : END's operand is undefined in symbol table ", 'E200')
             # reset and use new block
-            elif instr['mnemonic'] == 'CSECT': # 遇到 control section 虛指令 
+            elif mnemonic == 'CSECT': # 遇到 control section 虛指令 
                 cur_location = 0 # location counter 重新計算
-                instr['location'] = cur_location
+                instr.location = cur_location
+                self.__resolve_equ(pending_equ, cur_symbol_table, cur_extref_table, cur_block)
                 # [notice]: must use copy before reset
                 self.__symbol_table[cur_block] = cur_symbol_table.copy()
                 self.__extref_table[cur_block] = cur_extref_table.copy()
-                try:
-                    cur_block = instr['symbol'] # 將現在的控制區塊換成該 symbol 名稱
-                    self.__extdef_table[cur_block] = {}
-                    self.__extref_table[cur_block] = []
-                except KeyError : # 可能找不到 symbol 
-                    self.error(f"line {instr['lineNum']} : CSECT must have a symbol")
-                    exit(1) # 暫停
+                index_section_symbols(self.symbol_index, cur_block, self.__symbol_table[cur_block],
+                                      self.__extdef_table[cur_block], self.__absolute_symbols[cur_block])
+                if instr.symbol == None: # 可能找不到 symbol
+                    self.error(f"line {instr.line_num} : CSECT must have a symbol", 'E131', severity='fatal')
+                    raise AssemblerError("CSECT must have a symbol") # 暫停
+                cur_block = instr.symbol # 將現在的控制區塊換成該 symbol 名稱
+                self.__extdef_table[cur_block] = {}
+                self.__extref_table[cur_block] = []
+                self.__absolute_symbols[cur_block] = set()
                 cur_symbol_table.clear()
                 cur_extref_table.clear()
             # define memory position
-            elif instr['mnemonic'] == 'EQU':
-                if instr['operand'] == '*': # 如果 operand 是給星號
-                    instr['location'] = cur_location # 就是紀錄現在位址
+            elif mnemonic == 'EQU':
+                if instr.operand == '*': # 如果 operand 是給星號
+                    instr.location = cur_location # 就是紀錄現在位址
                 
-            elif instr['mnemonic'] == 'BYTE':
-                instr['location'] = cur_location
+            elif mnemonic == 'BYTE':
+                instr.location = cur_location
                 # uncertain the number of byte, must be calculated first
-                if instr['operand'][0] == 'X': # hex : X'1F'，兩個是一個 Byte
-                    cur_location += len(list(instr['operand'][2:].split('\''))[0]) // 2
-                elif instr['operand'][0] == 'C': # charactor : C'HELLO'
-                    if len(list(instr['operand'][2:].split('\''))[0]) > 30 :
-                        self.error(f"line {instr['lineNum']} : BYTE's C format must less than 30 charactors")
+                if instr.operand[0] == 'X': # hex : X'1F'，兩個是一個 Byte
+                    cur_location += len(list(instr.operand[2:].split('\''))[0]) // 2
+                elif instr.operand[0] == 'C': # charactor : C'HELLO'
+                    if len(list(instr.operand[2:].split('\''))[0]) > 30 :
+                        self.error(f"line {instr.line_num} : BYTE's C format must less than 30 charactors", 'E120')
                     else:
-                        cur_location += len(list(instr['operand'][2:].split('\''))[0])
+                        cur_location += len(list(instr.operand[2:].split('\''))[0])
                 else:
-                    self.error(f"line {instr['lineNum']} : BYTE's operand format error")
-            elif instr['mnemonic'] == 'WORD':
-                instr['location'] = cur_location
+                    self.error(f"line {instr.line_num} : BYTE's operand format error", 'E120')
+            elif mnemonic == 'WORD':
+                instr.location = cur_location
                 cur_location += 3 # WORD length must be equal to 3
             # 格式 4 ( 4 個 bytes )
-            elif instr['mnemonic'][0] == '+': 
-                instr['location'] = cur_location
+            elif mnemonic[0] == '+': 
+                instr.location = cur_location
                 cur_location += 4 # 位置要加 4 
             else:
                 # skip added literal instruction and BASE
-                if 'symbol' in instr and instr['symbol'] == '*' or instr['mnemonic'] == 'BASE':
+                if instr.symbol == '*' or mnemonic == 'BASE':
                     pass
                 else:
-                    instr['location'] = cur_location
+                    instr.location = cur_location
                     # 取 opcode 值時，如果有 + 在前頭就要忽略
-                    opcode = instr['mnemonic'][1:] if instr['mnemonic'][0] == '+' else instr['mnemonic']
+                    opcode = mnemonic[1:] if mnemonic[0] == '+' else mnemonic
                     # 查 opcode table 看自己是格式多少，就加上多少長度 
                     # format 1
-                    if self.__opcode[opcode]['format'][0] == '1':
+                    if self.__opcode[opcode] == 1:
                         cur_location += 1
                     # format 2
-                    elif self.__opcode[opcode]['format'][0] == '2':
+                    elif self.__opcode[opcode] == 2:
                         cur_location += 2
                     # Format 3
                     else:
                         cur_location += 3
             
-            # calculate EQU with symbol
-            if instr['mnemonic'] == 'EQU':
-                # add literal in symbol table
-                if instr['operand'] == '*': # 如果 value 是 *
-                    cur_symbol_table[instr['symbol']] = instr['location'] # 就直接將該 symbol 對應 現在的位置
-                elif (len(re.split(r'[+-]' , instr['operand'])) >= 3):
-                    self.error(f"line {instr['lineNum']} : This assembler's expressions can't calculate three operand")
-                    continue
-                elif '-' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('-') # 用"-"分開兩個 symbol
-                    try:
-                        cur_symbol_table[instr['symbol']] = cur_symbol_table[symbol_1] - cur_symbol_table[symbol_2]
-                    except KeyError:
-                        self.error(f"line {instr['lineNum']} : Operand's symbol is undefined")
-                elif '+' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('+') # 用"+"分開兩個 symbol
-                    try:
-                        cur_symbol_table[instr['symbol']] = cur_symbol_table[symbol_1] + cur_symbol_table[symbol_2]
-                    except KeyError:
-                        self.error(f"line {instr['lineNum']} : Operand's symbol is undefined")
+            # EQU 先解析 operand，等程式區塊結束 (所有 label 都有位址) 時再依照相依順序計算 (見 __resolve_equ)
+            if mnemonic == 'EQU':
+                if instr.symbol in cur_symbol_table or instr.symbol in pending_equ:
+                    self.error(f"line {instr.line_num} : duplicate symbol", 'E201')
                 else:
-                    try : # EQU 相等於十進位數字
-                        cur_symbol_table[instr['symbol']] = int(instr['operand'])
-                    except ValueError: # EQU 相等於單一個 symbol
-                        location = cur_symbol_table[instr['operand']] if instr['operand'] in cur_symbol_table else 0
-                        if location == 0:
-                            self.error(f"line {instr['lineNum']} : EQU's operand is undefined (no forward reference)")
+                    try:
+                        parse_expression(instr.operand)
+                        pending_equ[instr.symbol] = (instr, cur_location)
+                    except ExpressionError as e:
+                        self.error(f"line {instr.line_num} : {e}", e.code)
             # add other symbol in symbol table
-            elif 'symbol' in instr and instr['symbol'] != '*':
-                if cur_symbol_table.get(instr['symbol']) == None:
-                    if self.__check_mnemonic(instr['symbol']):
-                        self.error(f"line {instr['lineNum']} : symbol 不能與保留字同名")
-                    cur_symbol_table[instr['symbol']] = instr['location']
+            elif instr.symbol != None and instr.symbol != '*':
+                if cur_symbol_table.get(instr.symbol) == None and instr.symbol not in pending_equ:
+                    if self.__check_mnemonic(instr.symbol):
+                        self.error(f"line {instr.line_num} : symbol 不能與保留字同名", 'E201')
+                    cur_symbol_table[instr.symbol] = instr.location
                 else:
-                    self.error(f"line {instr['lineNum']} : duplicate symbol")
-            if 'symbol' in instr:
-                if instr['symbol'] in self.__extdef_table[cur_block]: # 如果該 symbol 有出現在 external defination table
-                    try:
-                        self.__extdef_table[cur_block][instr['symbol']] = instr['location']
-                    except KeyError:
-                        self.error(f"line {instr['lineNum']} : {instr['symbol']} 找不到 location ")
+                    self.error(f"line {instr.line_num} : duplicate symbol", 'E201')
+            if instr.symbol != None and mnemonic != 'EQU': # EQU 的值在 __resolve_equ 填入
+                if instr.symbol in self.__extdef_table[cur_block]: # 如果該 symbol 有出現在 external defination table
+                    if instr.location == None:
+                        self.error(f"line {instr.line_num} : {instr.symbol} 找不到 location ", 'E200')
+                    else:
+                        self.__extdef_table[cur_block][instr.symbol] = instr.location
             # 將該行指令集寫入中間檔
-            in_file.write(json.dumps(self.instruction[index]) + '\n')     
-        in_file.close()     
+            in_file.write(pack_record(('I', mnemonic, instr.symbol, instr.operand, instr.line_num, instr.location)))
+            for literal, location in placed: # 剛放置的 literal 接在後面
+                in_file.write(pack_record(('L', literal, location)))
+            self.__literal_count += len(placed)
+        in_file.write(pack_record(('T', self.__symbol_table, self.__extdef_table, self.__extref_table, self.__absolute_symbols)))
+
+    # 找出要改成格式 4 的格式 3 指令 : operand 的位址用 PC 相對 (-2048 ~ 2047) 與 BASE 相對 (0 ~ 4095) 都放不下、
+    # 引用 EXTREF 的 symbol，或立即值 / absolute symbol 的值超過 4095 (BASE 的追蹤方式與 pass two 相同)
+    # 沒有定義的 symbol 不改，留給 pass two 報錯 ; 從這一輪的中間檔依序讀，回傳要改的指令的編號 (set)
+    def __find_promotions(self) -> set:
+        promoted = set()
+        cur_block = None
+        b_loc = None
+        symbols = {}
+        absolute = ()
+        extref = ()
+        # 直接讀中間檔的 record ('I', mnemonic, symbol, operand, lineNum, location)，不建立指令物件
+        # (+ 開頭的 mnemonic 與虛指令不是格式 3)
+        format3 = {name for name, format in self.__opcode.items() if format == 3}
+        index = -1 # 指令的編號 (不算 literal)
+        for record in read_intermediate(self.__spilled):
+            kind, mnemonic = record[0], record[1]
+            if kind != 'I':
+                if kind == 'T':
+                    break
+                continue
+            index += 1
+            if mnemonic in format3:
+                target = record[3]
+                if target == None:
+                    continue
+                if type(target) is list: # 索引定址 [symbol, ',X']
+                    target = target[0]
+                prefix = target[0]
+                if prefix == '#':
+                    token = target[1:]
+                    if token not in symbols or token in absolute: # 立即值 : 數字或 absolute symbol
+                        try:
+                            value = symbols[token] if token in symbols else int(token)
+                        except ValueError:
+                            continue
+                        if value > 4095:
+                            promoted.add(index)
+                        continue
+                    address = symbols[token]
+                else:
+                    token = target[1:] if prefix == '@' else target
+                    address = symbols.get(token)
+                    if address == None and prefix != '@' and token in extref:
+                        promoted.add(index)
+                        continue
+                    if address != None and token in absolute: # absolute symbol : 直接放值 (b = p = 0)，要放得進 displacement
+                        if not 0 <= address <= 4095:
+                            promoted.add(index)
+                        continue
+                location = record[5]
+                if address == None or location == None:
+                    continue
+                offset = address - location - 3
+                if -2048 <= offset <= 2047 or (b_loc != None and 0 <= address - b_loc <= 4095):
+                    continue
+                promoted.add(index)
+            elif mnemonic == 'START' or mnemonic == 'CSECT':
+                cur_block = record[2]
+                symbols = self.__symbol_table.get(cur_block, {})
+                absolute = self.__absolute_symbols.get(cur_block, ())
+                extref = self.__extref_table.get(cur_block, ())
+            elif mnemonic == 'BASE':
+                b_loc = symbols.get(record[3], b_loc)
+        return promoted
+
+    # 計算一個程式區塊裡的 EQU : 依照 EQU 之間的相依關係做拓撲排序，被引用的先算 (所以可以向後引用)
+    # 排不進去的就是循環定義；算出的值放進 symbol table，absolute 的另外記在 __absolute_symbols
+    def __resolve_equ(self, pending, symbol_table, extref, block):
+        if len(pending) == 0:
+            return
+        absolute = self.__absolute_symbols.setdefault(block, set())
+        needs = {}        # symbol => 它引用的、還沒計算的 EQU symbol
+        dependents = {symbol: [] for symbol in pending}
+        for symbol, (instr, _) in pending.items():
+            needs[symbol] = [need for need in expression_symbols(parse_expression(instr.operand)) if need in pending]
+            for need in needs[symbol]:
+                dependents[need].append(symbol)
+        waiting = {symbol: len(needs[symbol]) for symbol in pending}
+        order = [symbol for symbol in pending if waiting[symbol] == 0]
+        for symbol in order: # Kahn's algorithm，算得出來的依序接在後面
+            for dependent in dependents[symbol]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    order.append(dependent)
+        first_error = len(self.errors)
+        resolve = symbol_resolver(symbol_table, absolute, extref)
+        for symbol in order:
+            instr, location = pending[symbol]
+            try:
+                value, relative, externals = evaluate_expression(parse_expression(instr.operand), resolve, location)
+            except ExpressionError as e:
+                self.error(f"line {instr.line_num} : {e}", e.code)
+                continue
+            if len(externals) != 0:
+                self.error(f"line {instr.line_num} : EQU's operand can't use external reference {externals[0][1]}", 'E132')
+            elif relative != 0 and relative != 1:
+                self.error(f"line {instr.line_num} : expression '{instr.operand}' must be absolute or relative", 'E104')
+            else:
+                symbol_table[symbol] = value
+                if relative == 0:
+                    absolute.add(symbol)
+                if symbol in self.__extdef_table[block]:
+                    self.__extdef_table[block][symbol] = value
+        # 循環定義 : 從還沒算的 symbol 沿著還沒算的引用走，走回走過的 symbol 就是一個循環
+        reported = set()
+        for symbol in pending:
+            if waiting[symbol] == 0 or symbol in reported:
+                continue
+            path = [symbol]
+            while path.count(path[-1]) == 1:
+                path.append(next(need for need in needs[path[-1]] if waiting[need] != 0))
+            cycle = path[path.index(path[-1]):]
+            if reported.isdisjoint(cycle):
+                self.error(f"line {pending[cycle[0]][0].line_num} : circular definition : {' -> '.join(cycle)}", 'E104')
+            reported.update(path)
+        self.__location_errors.extend(range(first_error, len(self.errors)))
+        pending.clear()
        
     # pass two
-    def pass_two(self):
+    # check_extref 為 False 時不檢查 EXTREF (增量組譯單獨組譯一個區塊時，改在合併時檢查)
+    def pass_two(self, check_extref=True):
         b_loc = None            # 紀錄 register BASE
         cur_block = None        # 標示現在的程式區塊
         cur_modified_list = []  # 紀錄現在程式區塊的 M records
         skip_instr = [ 'LTORG', 'RESW', 'RESB', 'EQU',] # 虛指令沒有 object code
         start_location = 0
-        for index, instr in enumerate(self.instruction): # 把指令集依序拿出來
-            if instr['mnemonic'] in skip_instr: # 如果是在虛指令列表，直接跳過
+        listing = self.__listing
+        instructions = self.__collect_object_code(self.located_instructions())
+        if listing != None:
+            instructions = listing.follow(instructions)
+        for index, instr in enumerate(instructions): # 把指令集依序拿出來
+            mnemonic = instr.mnemonic
+            if mnemonic in skip_instr: # 如果是在虛指令列表，直接跳過
                 continue
-            elif instr['mnemonic'] == 'EXTDEF': # 檢查 EXTDEF
+            elif mnemonic == 'EXTDEF': # 檢查 EXTDEF
                 if self.__extdef_table[cur_block] != {}:
                     for label, value in self.__extdef_table[cur_block].items():
                         if value == None:
-                            self.error(f"line {instr['lineNum']} : {cur_block} 程式區塊中 EXTDEF 找不到 {label} 的 location") 
-            elif instr['mnemonic'] == 'EXTREF': # 檢查 EXTREF
-                for ref_symbol in self.__extref_table[cur_block]:
-                    find_it = False
-                    if self.__extdef_table.get(ref_symbol) != None:
-                        find_it = True
-                    else:
-                        for block_name , dict in self.__extdef_table.items():
-                            if dict.get(ref_symbol) != None and block_name != cur_block:
-                                find_it = True
-                                break
-                    if find_it == False:
-                        self.error(f"line {instr['lineNum']} : EXTREF have an {ref_symbol} undefined symbol")
+                            self.error(f"line {instr.line_num} : {cur_block} 程式區塊中 EXTDEF 找不到 {label} 的 location", 'E200') 
+                        else: # 其他區塊已經 EXTDEF 同名的 symbol (index 裡是先定義的區塊)
+                            entry = self.symbol_index.get(label)
+                            if entry != None and entry[3] and entry[0] != cur_block:
+                                self.error(f"line {instr.line_num} : duplicate EXTDEF {label} (already defined in {entry[0]})", 'E201')
+            elif mnemonic == 'EXTREF': # 檢查 EXTREF : 要是其他區塊 EXTDEF 的 symbol 或是區塊名稱
+                for ref_symbol in (self.__extref_table[cur_block] if check_extref else ()):
+                    entry = self.symbol_index.get(ref_symbol)
+                    if entry == None or not (entry[2] == 'section' or (entry[3] and entry[0] != cur_block)):
+                        self.error(f"line {instr.line_num} : EXTREF have an {ref_symbol} undefined symbol", 'E200')
 
-            elif instr['mnemonic'] == 'START':
+            elif mnemonic == 'START':
                 # 更新現在的程式區塊
-                cur_block = instr['symbol']  
+                cur_block = instr.symbol  
                 # 初始化現在的 modified_list
                 cur_modified_list = [] 
-                start_block_name = instr['symbol']  
-                start_location = instr['location']  
-            elif instr['mnemonic'] == 'END':
+                start_block_name = instr.symbol  
+                start_location = instr.location  
+            elif mnemonic == 'END':
                 # 將現在的 modified_list 紀錄到 modified_record 
                 self.__modified_record[cur_block] = cur_modified_list.copy() 
                 # 清掉現在 modified_list
                 cur_modified_list.clear() 
-            elif instr['mnemonic'] == 'CSECT': # control section
+            elif mnemonic == 'CSECT': # control section
+                if listing != None: # 前一個程式區塊結束
+                    listing.symbols(cur_block, self.__symbol_table.get(cur_block, {}), self.__absolute_symbols.get(cur_block, ()))
                 # 將現在的 modified_list 紀錄到 modified_record 
                 self.__modified_record[cur_block] = cur_modified_list.copy()
                 # 清掉現在 modified_list
                 cur_modified_list.clear()
                 # 更新現在的程式區塊
-                cur_block = instr['symbol']
+                cur_block = instr.symbol
             # update B register content
-            elif instr['mnemonic'] == 'BASE':
-                try:
-                    base_operand = instr['operand']
-                except KeyError:
-                    self.error(f"line {instr['lineNum']} : BASE must have a operand")
+            elif mnemonic == 'BASE':
+                base_operand = instr.operand
+                if base_operand == None:
+                    self.error(f"line {instr.line_num} : BASE must have a operand", 'E132')
                 try:
                     b_loc = self.__symbol_table[cur_block][base_operand]
                 except KeyError:
-                    self.error(f"line {instr['lineNum']} : BASE's operand is not defined in symbol table")
+                    self.error(f"line {instr.line_num} : BASE's operand is not defined in symbol table", 'E200')
 
             # literal instruction
-            elif instr['mnemonic'][0] == '=': 
-                data = list(instr['mnemonic'][3:].split('\''))[0]
-                if instr['mnemonic'][1] == 'C':
-                    objcode = []
-                    for c in data:
-                        objcode.append(ord(c)) # 將 charactor 取得 ASCII 碼後放入 object code list
-                    instr['objcode'] = objcode 
-                elif instr['mnemonic'][1] == 'X':
-                    
-                    objcode = []
-                    for i in range(0, len(data), 2): # 兩個兩個一組
-                        try:
-                            objcode.append(int(data[i : i + 2], base=16)) # 字串轉成十六進位整數存入 object code list
-                        except ValueError:
-                            self.error(f"line {index + 1} : invalid literal with base 16 ")
-                            break
-                    instr['objcode'] = objcode
-            elif instr['mnemonic'] == 'WORD':
-                if (len(re.split(r'[+-]' , instr['operand'])) >= 3):
-                    self.error(f"line {instr['lineNum']} : This assembler's expressions can't calculate three operand")
+            elif mnemonic[0] == '=': 
+                kind, data, objcode = self.__parse_literal(mnemonic) # pass one 已經解析過
+                if kind == 'X' and len(objcode) * 2 < len(data):
+                    self.error(f"line {index + 1} : invalid literal with base 16 ", 'E110')
+                if kind == 'C' or kind == 'X':
+                    instr.objcode = objcode
+            elif mnemonic == 'WORD':
+                resolve = symbol_resolver(self.__symbol_table[cur_block], self.__absolute_symbols.get(cur_block, ()),
+                                          self.__extref_table[cur_block])
+                try:
+                    value, relative, externals = evaluate_expression(parse_expression(instr.operand), resolve, instr.location)
+                except ExpressionError as e:
+                    self.error(f"line {instr.line_num} : {e}", e.code)
                     continue
-                if '-' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('-')
-                    # 查看 symbol table 有沒有該 symbol1 的 location ， 如果有就取出，如果沒有先回傳 0
-                    location_1 = self.__symbol_table[cur_block][symbol_1] \
-                        if symbol_1 in self.__symbol_table[cur_block] else 0
-                    if location_1 == 0: # 如果該位置是 0，表示此 symbol 還沒有定義在 symbol table 中
-                        if symbol_1 in self.__extref_table[cur_block] :
-                            # 寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte
-                            cur_modified_list.append({
-                                'location': instr['location'] - start_location,
-                                'byte': 6,
-                                'offset': '+' + symbol_1,
-                            })
-                        else:
-                            self.error(f"line {instr['lineNum']} : {symbol_1} is undefined (reference?)")
-                    # 查看 symbol table 有沒有該 symbol2 的 location ， 如果有就取出，如果沒有先回傳 0
-                    location_2 = self.__symbol_table[cur_block][symbol_2] \
-                        if symbol_2 in self.__symbol_table[cur_block] else 0
-                    if location_2 == 0:
-                        if symbol_2 in self.__extref_table[cur_block] :
-                            # 寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte，注意要用減號
-                            cur_modified_list.append({
-                                'location': instr['location'] - start_location,
-                                'byte': 6,
-                                'offset': '-' + symbol_2,
-                            })
-                        else:
-                            self.error(f"line {instr['lineNum']} : {symbol_2} is undefined (reference?)")
-                    # 計算 word 的 object code
-                    instr['objcode'] = [
-                        ((location_1 - location_2) & (0xff << i)) >> i
-                        for i in range(16, -1, -8)
-                    ]
-                elif '+' in instr['operand']:
-                    symbol_1, symbol_2 = instr['operand'].split('+')
-                    # 查看 symbol table 有沒有該 symbol1 的 location ， 如果有就取出，如果沒有先回傳 0
-                    location_1 = self.__symbol_table[cur_block][symbol_1] \
-                        if symbol_1 in self.__symbol_table[cur_block] else 0
-                    if location_1 == 0:
-                        if symbol_1 in self.__extref_table[cur_block] :
-                            # 寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte
-                            cur_modified_list.append({
-                                'location': instr['location'] - start_location,
-                                'byte': 6,
-                                'offset': '+' + symbol_1,
-                            })
-                        else:
-                            self.error(f"line {instr['lineNum']} : {symbol_1} is undefined (reference?)")
-                    # 查看 symbol table 有沒有該 symbol2 的 location ， 如果有就取出，如果沒有先回傳 0
-                    location_2 = self.__symbol_table[cur_block][symbol_2] \
-                        if symbol_2 in self.__symbol_table[cur_block] else 0
-                    if location_2 == 0:
-                        if symbol_2 in self.__extref_table[cur_block] :
-                            # 寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte
-                            cur_modified_list.append({
-                                'location': instr['location'] - start_location,
-                                'byte': 6,
-                                'offset': '+' + symbol_2,
-                            })
-                        else:
-                            self.error(f"line {instr['lineNum']} : {symbol_2} is undefined (reference?)")
-                    instr['objcode'] = [
-                        ((location_1 + location_2) & (0xff << i)) >> i
-                        for i in range(16, -1, -8)
-                    ]
-                else: 
-                    try :
-                        if int(instr['operand']) > 16777215 : 
-                            self.error(f"line {index + 1} : DATA's operand exceed 0xFFFFFF")
-                        # 處理 operand 是普通十進位整數的情形
-                        # 以下是為了後續將 list 中的每一個元素(十進位數字)當成一個 btye (十六進位) 去處理
-                        instr['objcode'] = [ (int(instr['operand']) & (0xff << i)) >> i
-                            for i in range(16, -1, -8) ]
-                    except ValueError: # 處理單一 symbol 
-                        symbol_1 = instr['operand']
-                        location = self.__symbol_table[cur_block][symbol_1] if symbol_1 in self.__symbol_table[cur_block] else 0
-                        if location == 0:
-                            if symbol_1 in self.__extref_table[cur_block] :
-                                # 寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte
-                                cur_modified_list.append({
-                                    'location': instr['location'] - start_location,
-                                    'byte': 6,
-                                    'offset': '+' + symbol_1,
-                                })
-                            else:
-                                self.error(f"line {instr['lineNum']} : {symbol_1} is undefined (reference?)")
-                        instr['objcode'] = [
-                            ((location) & (0xff << i)) >> i
-                            for i in range(16, -1, -8)
-                        ]   
-            elif instr['mnemonic'] == 'BYTE':
-                data = list(instr['operand'][2:].split('\''))[0]
-                if instr['operand'][0] == 'C':
+                if value > 16777215 or value < -8388608:
+                    self.error(f"line {index + 1} : DATA's operand exceed 0xFFFFFF", 'E120')
+                if relative == 1: # 相對於本程式區塊的位址，載入時要加上區塊的起始位址
+                    cur_modified_list.append({
+                        'location': instr.location - start_location,
+                        'byte': 6,
+                        'offset': '',
+                    })
+                elif relative != 0:
+                    self.error(f"line {instr.line_num} : expression '{instr.operand}' must be absolute or relative", 'E104')
+                for sign, symbol in externals:
+                    # 每個外部引用寫一個 M records ，紀錄該指令位址，word 是 6 個 half Byte，正負號照運算式
+                    cur_modified_list.append({
+                        'location': instr.location - start_location,
+                        'byte': 6,
+                        'offset': sign + symbol,
+                    })
+                instr.objcode = (value & 0xFFFFFF).to_bytes(3, 'big')
+            elif mnemonic == 'BYTE':
+                data = list(instr.operand[2:].split('\''))[0]
+                if instr.operand[0] == 'C':
                     objcode = []
                     for c in data:
-                        objcode.append(ord(c))
-                    instr['objcode'] = objcode
-                elif instr['operand'][0] == 'X':
+                        objcode.append(ord(c) & 0xff)
+                    instr.objcode = bytes(objcode)
+                elif instr.operand[0] == 'X':
                     if (len(data) % 2) != 0:
-                        self.error(f"line {instr['lineNum']} : BYTE's X format must be even")
+                        self.error(f"line {instr.line_num} : BYTE's X format must be even", 'E120')
                     objcode = []
                     for i in range(0, len(data), 2):
                         try:
-                            objcode.append(int(data[i : i + 2], base=16)) # 十六進位轉十進位
+                            value = int(data[i : i + 2], base=16) # 十六進位轉十進位
+                            if value < 0:
+                                raise ValueError
+                            objcode.append(value)
                         except ValueError:
-                            self.error(f"line {index + 1} : BYTE's X operand must be base 16")
+                            self.error(f"line {index + 1} : BYTE's X operand must be base 16", 'E120')
                             break
-                    instr['objcode'] = objcode
+                    instr.objcode = bytes(objcode)
             else:
                 # register coresponding code
                 register_cord = {'A': 0, 'X': 1, 'L': 2, 'B': 3, 'S': 4, 'T': 5, 'F': 6,}
@@ -868,124 +2587,147 @@ class Assembler:
                 format2_list = ['ADDR', 'CLEAR', 'COMPR', 'DIVR', 'MULR', 'RMO','SHIFTL', 'SHIFTR', 'SVC', 'TIXR']
                 format2_oper_1_list = ['ADDR', 'CLEAR', 'SVC', 'TIXR']
                 format2_oper_2_list = ['COMPR', 'DIVR', 'MULR', 'RMO', 'SHIFTL', 'SHIFTR',]
-                for mnemonic in format2_list:
-                    if instr['mnemonic'] == mnemonic:
-                        if len(instr['operand']) == 2: # 2 個 operand
-                            if instr['mnemonic'] in format2_oper_1_list:
-                                self.error(f"line  {instr['lineNum']} : This format2 instruction must be one operand")
-                                instr['objcode'] = [self.__opcode[mnemonic]['code'],-1]
-                            elif instr['mnemonic'] == 'SHIFTL' or instr['mnemonic'] == 'SHIFTR':
-                                if register_cord.get(instr['operand'][0])== None:
-                                    self.error(f"lin {instr['lineNum']} : undefined register coresponding code")
-                                    instr['objcode'] = [self.__opcode[mnemonic]['code'],-1]
-                                else:
-                                    instr['objcode'] = [
-                                        self.__opcode[mnemonic]['code'],    # 第一個 Byte
-                                        register_cord[instr['operand'][0]] << 4  # 第二個 Byte 
-                                    ]
-                            elif(register_cord.get(instr['operand'][0])== None) or (register_cord.get(instr['operand'][1]) == None) :
-                                self.error(f"line {instr['lineNum']} : undefined register coresponding code")
-                                instr['objcode'] = [self.__opcode[mnemonic]['code'],-1]
+                if mnemonic in format2_list:
+                    # 報錯時第二個 byte 先填 0xFF (有報錯就不會輸出 object program)
+                    if len(instr.operand) == 2: # 2 個 operand
+                        if mnemonic in format2_oper_1_list:
+                            self.error(f"line  {instr.line_num} : This format2 instruction must be one operand", 'E102')
+                            instr.objcode = bytes((instr.opcode, 0xff))
+                        elif mnemonic == 'SHIFTL' or mnemonic == 'SHIFTR':
+                            if register_cord.get(instr.operand[0])== None:
+                                self.error(f"lin {instr.line_num} : undefined register coresponding code", 'E103')
+                                instr.objcode = bytes((instr.opcode, 0xff))
                             else:
-                                # << 4 也可以說是 十進位 乘 16 
-                                instr['objcode'] = [
-                                    self.__opcode[mnemonic]['code'],    # 第一個 Byte
-                                    register_cord[instr['operand'][0]] << 4 | register_cord[instr['operand'][1]] # 第二個 Byte 
-                                ]
-                        elif len(instr['operand']) == 1: # 1 個 operand
-                            if instr['mnemonic'] in format2_oper_2_list:
-                                self.error(f"line {instr['lineNum']} : This format2 instruction must have two operands")
-                                instr['objcode'] = [self.__opcode[mnemonic]['code'],-1]
-                            elif register_cord.get(instr['operand'][0])== None :
-                                self.error(f"line {instr['lineNum']} : undefined register coresponding code")
-                                instr['objcode'] = [self.__opcode[mnemonic]['code'],-1]
-                            else: 
-                                instr['objcode'] = [
-                                    self.__opcode[mnemonic]['code'],          # 第一個 Byte 
-                                    register_cord[instr['operand'][0]] << 4   # 第二個 Byte 
-                                ]
-                if 'objcode' in instr: # 如果已經有 object code 就可以往下一個 instruction 走
+                                instr.objcode = bytes((
+                                    instr.opcode,                        # 第一個 Byte
+                                    register_cord[instr.operand[0]] << 4 # 第二個 Byte
+                                ))
+                        elif(register_cord.get(instr.operand[0])== None) or (register_cord.get(instr.operand[1]) == None) :
+                            self.error(f"line {instr.line_num} : undefined register coresponding code", 'E103')
+                            instr.objcode = bytes((instr.opcode, 0xff))
+                        else:
+                            # << 4 也可以說是 十進位 乘 16
+                            instr.objcode = bytes((
+                                instr.opcode,                        # 第一個 Byte
+                                register_cord[instr.operand[0]] << 4 | register_cord[instr.operand[1]] # 第二個 Byte
+                            ))
+                    elif len(instr.operand) == 1: # 1 個 operand
+                        if mnemonic in format2_oper_2_list:
+                            self.error(f"line {instr.line_num} : This format2 instruction must have two operands", 'E102')
+                            instr.objcode = bytes((instr.opcode, 0xff))
+                        elif register_cord.get(instr.operand[0])== None :
+                            self.error(f"line {instr.line_num} : undefined register coresponding code", 'E103')
+                            instr.objcode = bytes((instr.opcode, 0xff))
+                        else:
+                            instr.objcode = bytes((
+                                instr.opcode,                        # 第一個 Byte
+                                register_cord[instr.operand[0]] << 4 # 第二個 Byte
+                            ))
+                if instr.objcode != None: # 如果已經有 object code 就可以往下一個 instruction 走
                     continue
-                elif instr['mnemonic'] == 'RSUB':
+                # format 1 : 只有 opcode 一個 byte，不能有 operand
+                elif self.__opcode.get(mnemonic) == 1:
+                    if instr.operand != None:
+                        self.error(f"line {instr.line_num} : format 1 instruction can't have operand", 'E102')
+                    instr.objcode = bytes((instr.opcode,))
+                elif mnemonic == 'RSUB':
                     # type = 3 因為 n = 1，p = 1 的關係
-                    instr['objcode'] = self.__gen_code_list('RSUB', 3, 0, 0)
+                    instr.objcode = self.__gen_code_list(instr.opcode, 3, 0, 0)
                 else:
                     # < immediate format (n: 0, i: 1) 立即定址 >==================================================
-                    if instr['operand'][0] == '#':  # 不需要 modification record
-                        token = instr['operand'][1:]
-                        # 當 operand is symbol
-                        if token in self.__symbol_table[cur_block]: 
+                    if instr.operand[0] == '#':  # 不需要 modification record
+                        token = instr.operand[1:]
+                        # 當 operand is symbol (absolute symbol 是常數，與數字一樣處理)
+                        if token in self.__symbol_table[cur_block] and token not in self.__absolute_symbols.get(cur_block, ()):
                             symbol_loc = self.__symbol_table[cur_block][token]
-                            offset = symbol_loc - instr['location'] - 3 # 減三是因為要減掉 program counter
+                            offset = symbol_loc - instr.location - 3 # 減三是因為要減掉 program counter
+                            # format 4 (+)，type = 1，format = 1 : 直接放位址，載入時要加上區塊起始位址 (M record)
+                            if mnemonic[0] == '+':
+                                instr.objcode = self.__gen_code_list(instr.opcode, 1, 1, symbol_loc)
+                                cur_modified_list.append({
+                                    'location': instr.location + 1 - start_location,
+                                    'byte': 5,
+                                    'offset': '',
+                                })
                             # format 3 (先用 PC 檢查是否超過)
-                            if offset >= -2048 and offset <= 2047:
+                            elif offset >= -2048 and offset <= 2047:
                                 # type = 1 因為 n = 0，i = 1 的關係，format = 2，原因是 x = 0 b = 0 p = 1 e= 0 的關係
-                                instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 1, 2, offset)
+                                instr.objcode = self.__gen_code_list(instr.opcode, 1, 2, offset)
                             else: # 不再該範圍就需要用到 base register 
                                 offset = symbol_loc - b_loc
                                 # format 3 
                                 if offset >= 0 and offset <= 4095:
                                     # type = 1 因為 n = 0，i = 1的關係，format = 4，原因是 x = 0 b = 1 p = 0 e= 0 的關係
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 1, 4, offset)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 1, 4, offset)
                                 # format 4
                                 else:
                                     # type = 1 因為 n = 0，i = 1 的關係，format = 4，原因是 x = 0 b = 0 p = 0 e= 1 的關係，直接放 location 位址
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'][1:], 1, 1, symbol_loc)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 1, 1, symbol_loc)
                         # 當 operand is number
                         else:
                             # this does not memory, so do not consider PC and B
-                            offset = int(token)
+                            offset = self.__symbol_table[cur_block][token] if token in self.__symbol_table[cur_block] else int(token)
                             # format 4 ， type = 1 因為 n = 0，i = 1 的關係，format = 1，原因是 x = 0 b = 0 p = 0 e= 1 的關係
-                            if offset > 4095:
-                                instr['objcode'] = self.__gen_code_list(instr['mnemonic'][1:], 1, 1, offset)
+                            if offset > 4095 or mnemonic[0] == '+':
+                                instr.objcode = self.__gen_code_list(instr.opcode, 1, 1, offset)
                             # format 3，type = 1 因為 n = 0，i = 1 的關係，format = 1，原因是 x = 0 b = 0 p = 0 e= 0 的關係
                             else:
-                                instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 1, 0, offset)
+                                instr.objcode = self.__gen_code_list(instr.opcode, 1, 0, offset)
                     # < indirect format (n: 1, i: 0) 間接定址 > ===================================================
-                    elif instr['operand'][0] == '@':
-                        symbol = instr['operand'][1:]
+                    elif instr.operand[0] == '@':
+                        symbol = instr.operand[1:]
                         # 查找 symbol table 中該 symbol 的 location，如果沒有就回傳 None 
                         symbol_loc = self.__symbol_table[cur_block][symbol] \
                             if symbol in self.__symbol_table[cur_block] else None
                         # symbol not defined
                         if symbol_loc == None:
-                            self.error(f"line {instr['lineNum']}: symbol hasn't been defined")
+                            self.error(f"line {instr.line_num}: symbol hasn't been defined", 'E200')
+                        # absolute symbol 是常數 : 直接放值 (b = p = 0)，不需要 M record
+                        elif symbol in self.__absolute_symbols.get(cur_block, ()):
+                            instr.objcode = self.__gen_code_list(instr.opcode, 2, 1 if mnemonic[0] == '+' else 0, symbol_loc)
                         else:
                             # calculate offset
-                            offset = symbol_loc - instr['location'] - 3 # 減三是因為要減掉 program counter
+                            offset = symbol_loc - instr.location - 3 # 減三是因為要減掉 program counter
+                            # format 4 (+)，type = 2，format = 1 : 直接放位址 (M record)
+                            if mnemonic[0] == '+':
+                                instr.objcode = self.__gen_code_list(instr.opcode, 2, 1, symbol_loc)
+                                cur_modified_list.append({
+                                    'location': instr.location + 1 - start_location,
+                                    'byte': 5,
+                                    'offset': '',
+                                })
                             # format 3 (PC) ， type = 2 因為 n = 1，i = 0 的關係，format = 2，原因是 x = 0 b = 0 p = 1 e= 0 的關係
-                            if offset >= -2048 and offset <= 2047:
-                                instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 2, 2, offset)
+                            elif offset >= -2048 and offset <= 2047:
+                                instr.objcode = self.__gen_code_list(instr.opcode, 2, 2, offset)
                             else:
                                 offset = symbol_loc - b_loc
                                 # format 3 (Base)，type = 2 因為 n = 1，i = 0 的關係，format = 4，原因是 x = 0 b = 1 p = 0 e= 0 的關係
                                 if offset >= 0 and offset <= 4095:
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 2, 4, offset)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 2, 4, offset)
                                 # format 4，type = 2 因為 n = 1，i = 0 的關係，format = 1，原因是 x = 0 b = 0 p = 0 e= 1 的關係，直接放 location 位址
                                 else:
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 2, 1, symbol_loc)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 2, 1, symbol_loc)
                     # < direct format (n: 1, i: 1) 直接地址 > =================================================
                     # 需要寫 M record
                     else:
                         format_num = 0  # x, b, p, e 加起來的十進位數字
                         # 如果 operand 是一個 list 型態，並且其中有 X 存在
-                        if isinstance(instr['operand'], list) and ',X' in instr['operand']: 
-                            if instr['operand'].index(',X') == 1:
+                        if isinstance(instr.operand, list) and ',X' in instr.operand: 
+                            if instr.operand.index(',X') == 1:
                                 format_num |= 8 # 表示 x = 1 所以要加 8
                             else:
-                                self.error(f"line {instr['lineNum']}: Operand format error")
+                                self.error(f"line {instr.line_num}: Operand format error", 'E102')
                         # format 4
-                        if instr['mnemonic'][0] == '+':
+                        if mnemonic[0] == '+':
                             format_num |= 1 # 表示 e = 1 所以要加 1
                             symbol_loc = None
-                            mnemonic = instr['mnemonic'][1:] # 把 + 忽略劉後面的 mnemonic
-                            if isinstance(instr['operand'], list):
+                            if isinstance(instr.operand, list):
                                 if format_num == 9:
-                                    first_element = instr['operand'][0]
+                                    first_element = instr.operand[0]
                                 else:
-                                    self.error(f"line {instr['lineNum']}: Operand format error")
+                                    self.error(f"line {instr.line_num}: Operand format error", 'E102')
                             else: 
-                                first_element = instr['operand']
+                                first_element = instr.operand
                             try: # get symbol location ， 找出第一個 operand 在 symbol table 的 location
                                 symbol_loc = self.__symbol_table[cur_block][first_element]
                             except KeyError:
@@ -994,36 +2736,37 @@ class Assembler:
                             if symbol_loc == None: # 如果在該區塊的 symbol table 找不到，有可能是外部引用或還未定義
                                 # by default, EXTREF memory reference is 0
                                 # type = 3 => 因為 n=1、i=1
-                                instr['objcode'] = self.__gen_code_list(mnemonic, 3, format_num, 0)
+                                instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, 0)
                                 if first_element in self.__extref_table[cur_block]:
                                     # 加入 M record ， location 要跳過 1 個 byte，然後修正 5 個 half-byte
                                     cur_modified_list.append({
-                                        'location': instr['location'] + 1 - start_location,
+                                        'location': instr.location + 1 - start_location,
                                         'byte': 5,
                                         'offset': '+' + first_element,
                                     })
                                 else:
-                                    self.error(f"line {instr['lineNum']} : {first_element} is undefined (reference?)")
+                                    self.error(f"line {instr.line_num} : {first_element} is undefined (reference?)", 'E200')
                             else:
                                 # type = 3 因為 n=1、i=1
-                                instr['objcode'] = self.__gen_code_list(mnemonic, 3, format_num, symbol_loc)
-                                # 加入 M record ， location 要跳過 1 個 byte，然後修正 5 個 half-byte
-                                cur_modified_list.append({
-                                    'location': instr['location'] + 1 - start_location,
-                                    'byte': 5,
-                                    'offset': '',
-                                })
+                                instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, symbol_loc)
+                                # 加入 M record ， location 要跳過 1 個 byte，然後修正 5 個 half-byte (absolute symbol 不需要)
+                                if first_element not in self.__absolute_symbols.get(cur_block, ()):
+                                    cur_modified_list.append({
+                                        'location': instr.location + 1 - start_location,
+                                        'byte': 5,
+                                        'offset': '',
+                                    })
                         # format 3
                         else: 
                             symbol_loc = None
                             # get first element
-                            if isinstance(instr['operand'], list):
+                            if isinstance(instr.operand, list):
                                 if format_num == 8:
-                                    first_element = instr['operand'][0] 
+                                    first_element = instr.operand[0] 
                                 else:
-                                    self.error(f"line {instr['lineNum']}: Operand format error")
+                                    self.error(f"line {instr.line_num}: Operand format error", 'E102')
                             else :
-                                first_element = instr['operand']
+                                first_element = instr.operand
                             # get symbol location
                             try:
                                 symbol_loc = self.__symbol_table[cur_block][first_element]
@@ -1031,28 +2774,74 @@ class Assembler:
                                 symbol_loc = None
                             # symbol nodefined (EXTREF)
                             if symbol_loc == None:
-                                instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, 0)
-                                self.error(f"line {instr['lineNum']} : Operand's symbol is undefined or Not found ")
+                                instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, 0)
+                                self.error(f"line {instr.line_num} : Operand's symbol is undefined or Not found ", 'E200')
+                            # absolute symbol 是常數 : 直接定址 (b = p = 0)，不需要 M record
+                            elif first_element in self.__absolute_symbols.get(cur_block, ()):
+                                instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, symbol_loc)
                             else:
-                                offset = symbol_loc - instr['location'] - 3 # 先相對於 PC 
+                                offset = symbol_loc - instr.location - 3 # 先相對於 PC 
                                 # format 3 (PC)
                                 if offset >= -2048 and offset <= 2047:
                                     format_num |= 2 # p = 1 ，所以要加 2
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, offset)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, offset)
                                 # format 3 (Base)
                                 else:
                                     format_num |= 4 # b = 1 ，所以要加 4
                                     offset = symbol_loc - b_loc
-                                    instr['objcode'] = self.__gen_code_list(instr['mnemonic'], 3, format_num, offset)
-        
-    def write_object_program(self, file_name) -> None :
-        # record program block length and start position
-        cur_block = {} # 紀錄現在的程式區塊
-        cur_objcode_list = [] # 紀錄現在的 object code list (每一個元素都是一行 T record 的所有 object code)
-        cur_position_list = [] # 紀錄程式區塊的起始位置與長度 (每一個元素都是一行 T record 的起始位址)
+                                    instr.objcode = self.__gen_code_list(instr.opcode, 3, format_num, offset)
+        if listing != None and cur_block != None: # 最後一個程式區塊 (包含 END 之後的 literal) 結束
+            listing.symbols(cur_block, self.__symbol_table.get(cur_block, {}), self.__absolute_symbols.get(cur_block, ()))
+
+    # pass two 依序處理的指令集 : 每個指令處理完 (有 object code) 之後，累積到所屬程式區塊的 T records 並更新區塊長度，
+    # 結果放在 self.__blocks (gen_object_program 使用)，指令物件處理完就不再保留
+    # 如果遇到 'RESW', 'RESB' 可能會有記憶體不連續，需要設定一個新的 T record ; END 之後還有放置的 literal，程式區塊在最後才結束
+    def __collect_object_code(self, instructions):
+        self.__blocks = {}
+        self.__end = None
+        block = None # 紀錄現在的程式區塊
+        text_records = TextRecordBuilder() # 紀錄現在程式區塊的 T records
+        for instr in instructions:
+            yield instr
+            mnemonic = instr.mnemonic
+            if mnemonic == 'RESW' or mnemonic == 'RESB':
+                text_records.gap(instr.location)
+            if mnemonic == 'START' or mnemonic == 'CSECT':
+                if block != None: # 前一個程式區塊結束
+                    block['objcode'] = text_records.records()
+                block = self.__blocks[instr.symbol] = {'length': 0, 'start': instr.location}
+            elif mnemonic == 'END':
+                self.__end = instr
+            elif instr.location != None and block != None: # 如果該行指令集有 location
+                length = instr.location # 長度改成現在的 location
+                if instr.objcode != None: # 如果該行指令集有 object code
+                    length += len(instr.objcode) # 加上四種不同長度格式
+                block['length'] = max(block['length'], length)
+            if instr.objcode != None: # 如果該行指令集有 object code
+                text_records.add(instr.location, instr.objcode)
+        if block != None: # 最後一個程式區塊 (包含 END 之後的 literal) 結束
+            block['objcode'] = text_records.records()
+
+    # program 沒給就用 gen_object_program() 產生
+    def write_object_program(self, file_name, program=None) -> ObjectProgram :
+        if program == None:
+            program = self.gen_object_program()
+        with open(file_name, mode = 'w') as f: # 打開輸出檔案
+            f.write(program.to_text())
+        write_binary_outputs(program, file_name, self.memory_image, self.relocatable)
+        for _, record_list in program.records():
+            print('\n' + record_list[0])
+            for record in record_list[1:]:
+                print(record)
+            print('\n')
+            if self.__listing != None:
+                self.__listing.records(record_list)
+        return program
+
+    # 產生 ObjectProgram (不寫檔、不印出) : 使用 pass two 收集的程式區塊 (見 __collect_object_code)
+    def gen_object_program(self) -> ObjectProgram :
         program_info = {} # 整體程式的資訊
         end_position = () # 以 tuple 型態儲存
-        # 如果遇到'RESW', 'RESB'可能會有記憶體不連續，需要設定一個新的 T record
 
         def gen_extref_str(ext_info: list) -> str: # R record
             ext_str = 'R '
@@ -1073,174 +2862,1129 @@ class Assembler:
                 modified_list.append(modified_str.strip())
             return modified_list
 
-        def gen_block_info(symbol_info: dict) -> dict:
+        def gen_block_info(name: str, block: dict) -> dict:
             block_info = {
-                'name': symbol_info['symbol'], # 程式區塊名稱
-                'length': 0,                   # 程式區塊總長度
-                'start': instr['location'],    # 程式區塊起始位址
+                'length': block['length'],     # 程式區塊總長度
+                'start': block['start'],       # 程式區塊起始位址
             }
-            extdef_info = self.__extdef_table[symbol_info['symbol']]
+            extdef_info = self.__extdef_table[name]
             if extdef_info: # 如果此程式區塊有外部定義的資訊
                 block_info['extdef'] = gen_extdef_str(extdef_info)
             else:
                 block_info['extdef'] = ''
 
-            extref_info = self.__extref_table[symbol_info['symbol']]
+            extref_info = self.__extref_table[name]
             if extref_info: # 如果此程式區塊有外部參考的資訊
                 block_info['extref'] = gen_extref_str(extref_info)
             else:
                 block_info['extref'] = ''
 
-            modified_info = self.__modified_record[symbol_info['symbol']]
+            modified_info = self.__modified_record[name]
             if modified_info: # 如果此程式區塊有 M record 的資訊
                 block_info['modified'] = gen_modified_list(modified_info)
             else:
                 block_info['modified'] = []
 
+            block_info['objcode'] = block['objcode'] # 這個程式區塊的 T records
             return block_info 
         # write_file 主程式 ==============================================================
-        for instr in self.instruction: # 將指令集依序取出
-            # 遇到要重新開啟另一行 T record 的虛指令
-            if instr['mnemonic'] == 'RESW' or instr['mnemonic'] == 'RESB' : 
-                if cur_objcode_list[-1] == '': # 上一個可能也是遇到不連續記憶體位址的虛指令
-                    if instr.get('location') != None:
-                        cur_position_list[-1] = instr['location']
-                else : # 上一個是連續記憶體位址指令，而這個是第一次遇到不連續記憶體位址的虛指令
-                    if instr.get('location') == None:
-                        cur_position_list.append('')
-                    else: 
-                        cur_position_list.append(instr['location'])
-                    cur_objcode_list.append('')
-            
-            if instr['mnemonic'] == 'START':
-                cur_objcode_list.clear() # 初始化 object code list 
-                cur_position_list.clear() # 初始化 存現在程式區塊每一個 t record 的起始區塊
-                cur_block = gen_block_info(instr)  
-
-            elif instr['mnemonic'] == 'CSECT': # 如果遇到 Control Section
-                name = cur_block['name'] # 程式區塊名稱
-                del cur_block['name'] # 用來刪除 cur_block 裡頭的 name 物件 (因為他已經當作 key 使用)
-                program_info[name] = cur_block # 記錄前一個程式區塊的資訊
-                
-                # merge this block object code
-                program_info[name]['objcode'] = {} 
-                for index, pos in enumerate(cur_position_list):
-                    program_info[name]['objcode'][pos] = cur_objcode_list[index]
-                
-                # define new block info
-                cur_objcode_list.clear()
-                cur_position_list.clear()
-                cur_block = gen_block_info(instr)
-            elif instr['mnemonic'] == 'END': 
-                name = cur_block['name'] # 紀錄現在程式區塊名稱
-                del cur_block['name'] # 用來刪除 cur_block 裡頭的 name 物件 (因為他要當作 key 使用)
-                program_info[name] = cur_block # 以現在程式區塊名稱作為 Key 儲存現在程式區塊的相關資訊
-
-                # merge this block object code
-                program_info[name]['objcode'] = {}
-                for index, pos in enumerate(cur_position_list):
-                    program_info[name]['objcode'][pos] = cur_objcode_list[index]
-
-                # END symbol will record start code position
-                for block in self.__symbol_table.keys(): # 遍歷程式中的所有區塊名稱
-                    if instr['operand'] in self.__symbol_table[block]: # 如果起始 symbol 名稱在該程式區塊中
-                        end_position = (block, self.__symbol_table[block][instr['operand']]) # 紀錄程式區塊名稱 以及該起始 symbol 的位址
-                if len(end_position) == 0:
-                    self.error(f"line {instr['lineNum']}: END's operand isn't defined in symbol table")
-                    exit(1)
-            elif 'location' in instr: # 如果該行指令集有 location
-                length = instr['location'] # 長度改成現在的 location
-                if 'objcode' in instr: # 如果該行指令集有 object code 
-                    length += len(instr['objcode']) # 加上四種不同長度格式
-                cur_block['length'] = max(cur_block['length'], length) # 現在的程式區塊長度 跟 新算出的 length 取最大值，成為現在新的程式區塊長度
-            if 'objcode' in instr: # 如果該行指令集有 object code
-                objcode_str = ''
-                for opc in instr['objcode']: # 將 object code list 依序輸出
-                    objcode_str += '{:02X}'.format(opc) # 以兩位的十六進制大寫字母形式進行格式化輸出
-                instr['objcode'] = objcode_str # 新格式存入 指令集 的 objcode 
-                if len(cur_objcode_list):
-                    now_obj_list = cur_objcode_list[-1].split(' ') # 去除 object code 之間的空白格，為了算長度
-                    obj_len = ''
-                    for obj_str in now_obj_list:
-                        obj_len += obj_str
-                    if len(obj_len) + len(objcode_str) > 60: # 超過 30 byte 要換一個 T record
-                        cur_position_list.append(instr['location'])
-                        cur_objcode_list.append(objcode_str+' ')
-                    else:
-                        if cur_objcode_list[-1] == '': # 如果上一個是要重新寫 T record 的虛指令
-                            cur_position_list[-1] = instr['location'] # 更新 location 為此指令當開頭
-                        cur_objcode_list[-1] += objcode_str+' '
+        for name, block in self.__blocks.items():
+            program_info[name] = gen_block_info(name, block)
+        if self.__end != None: # END symbol will record start code position
+            entry = self.symbol_index.get(self.__end.operand)
+            if entry != None:
+                end_position = (entry[0], entry[1]) # 紀錄程式區塊名稱 以及該起始 symbol 的位址
+            if len(end_position) == 0:
+                self.error(f"line {self.__end.line_num}: END's operand isn't defined in symbol table", 'E200', severity='fatal')
+                raise AssemblerError("END's operand isn't defined")
+
+        return ObjectProgram(program_info, end_position, self.errors)
+
+    # 從 pass one 寫出的二進位中間檔載入 symbol / extdef / extref table (有 location 的指令集在 pass two 時才依序讀)
+    # 之後直接呼叫 pass_two()，不需要重新 scan 與 pass one
+    def load_intermediate(self, path) -> None:
+        self.reset()
+        for record in read_intermediate(path):
+            if record[0] == 'I':
+                self.__instruction_count += 1
+            elif record[0] == 'L':
+                self.__literal_count += 1
+            elif record[0] == 'T':
+                self.__symbol_table, self.__extdef_table, self.__extref_table = record[1:4]
+                self.__absolute_symbols = record[4] if len(record) > 4 else {}
+                for block, symbols in self.__symbol_table.items():
+                    index_section_symbols(self.symbol_index, block, symbols, self.__extdef_table.get(block, {}),
+                                          self.__absolute_symbols.get(block, ()))
+                break
+        else: # 沒有讀到最後的 table，表示 pass one 沒有跑完
+            raise ValueError(f'{path} is truncated')
+        self.__spilled = path # pass two 從中間檔依序讀指令集
+
+    # 只執行 pass two : 讀取中間檔後 pass two，沒有報錯回傳 True (之後可呼叫 gen_object_program / write_object_program)
+    def pass_two_from_intermediate(self, path) -> bool:
+        try:
+            self.load_intermediate(path)
+        except IOError:
+            self.error('ERROR: can not found ' + path, 'E001', severity='fatal')
+            return False
+        except (ValueError, EOFError, TypeError) as e: # 不是這個版本寫出的中間檔
+            self.error(f'ERROR: {e}', 'E001', severity='fatal')
+            return False
+        self.pass_two()
+        return not self.__error_flag
+
+    # 執行 assembler (CLI 用)，成功回傳 True
+    # intermediate_file 為 None 時 pass one 寫在暫存檔 (結束時刪掉)，大的程式也不需要把中間檔放在記憶體裡
+    def execute(self, read_file, write_file , intermediate_file) -> bool :
+        program = None
+        if not self.__open_listing():
+            return False
+        self.__start_stats()
+        temp_file = None
+        if intermediate_file == None:
+            fd, temp_file = tempfile.mkstemp(prefix='sicxe-', suffix='.bin')
+            os.close(fd)
+        try:
+            try:
+                instructions = self.__measured_scan(read_source(read_file))
+                self.__measure('pass_one', lambda: self.pass_one(intermediate_file or temp_file, instructions))
+            except IOError:
+                self.error('ERROR: can not found ' + read_file, 'E001', severity='fatal')
+            except UnicodeDecodeError:
+                self.error('ERROR: 文件中有無法解碼的字元', 'E001', severity='fatal')
+            self.__measure('pass_two', self.pass_two)
+            if (self.__error_flag):
+                return False
+            program = self.__measure('write_object_program', lambda: self.write_object_program(write_file))
+        except AssemblerError:
+            return False
+        except Exception as e:
+            self.__internal_error(e)
+            return False
+        finally:
+            self.__finish_stats(program)
+            self.__close_listing()
+            if temp_file != None:
+                self.__release_spill()
+                os.remove(temp_file)
+        return True
+
+    # 有設定 listing_file 時開啟組譯列表，無法寫入時報錯並回傳 False
+    def __open_listing(self) -> bool:
+        if self.listing_file == None:
+            return True
+        try:
+            self.__listing = ListingWriter(self.listing_file)
+        except IOError as e:
+            self.error(f'ERROR: can not write {self.listing_file} ({e})', 'E001', severity='fatal')
+            return False
+        return True
+
+    def __close_listing(self) -> None:
+        if self.__listing != None:
+            self.__listing.close(self.errors)
+            self.__listing = None
+
+    # 統計 (collect_stats 為 True 時) -------------------------------------------------
+    # self.stats 的格式 (時間為秒、記憶體為 bytes，記憶體由 tracemalloc 量測，時間也包含 tracemalloc 的負擔) :
+    #   phases : {階段名稱: {seconds, allocated (階段結束時增加的記憶體), peak (階段中的峰值)}}，scanner 的記憶體算在 pass_one (None)
+    #   lines、instructions、literals、errors、text_records、modification_records、seconds (全部階段)
+    #   sections : {程式區塊名稱: {symbols, text_records, modification_records}}
+    def __start_stats(self) -> None:
+        self.stats = None
+        if not self.collect_stats:
+            return
+        self.stats = {'phases': {}, 'lines': 0}
+        self.__tracing = not tracemalloc.is_tracing()
+        if self.__tracing:
+            tracemalloc.start()
+
+    # 量測一個階段 (沒有收集統計時直接執行)，回傳 run() 的結果
+    # 這個階段裡讀 scanner 產生的指令集所花的時間算在 scanner，不重複算在這個階段 (見 __timed_scan)
+    def __measure(self, phase, run):
+        if self.stats == None:
+            return run()
+        scanned = self.__scanner_seconds()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start - (self.__scanner_seconds() - scanned)
+        current, peak = tracemalloc.get_traced_memory()
+        self.stats['phases'][phase] = {'seconds': elapsed, 'allocated': current - before, 'peak': peak - before}
+        return result
+
+    def __scanner_seconds(self) -> float:
+        scanner = self.stats['phases'].get('scanner')
+        return scanner['seconds'] if scanner != None else 0.0
+
+    # scanner : 收集統計時也不把指令集做成 list (不然量到的記憶體比平常多)，pass one 照樣邊讀邊分配位址
+    # 原始碼不先做成 list，一邊讀一邊數行數
+    def __measured_scan(self, source):
+        if self.stats == None:
+            return self.scan(source)
+        return self.__timed_scan(source)
+
+    # 累計每次產生下一個指令 (讀檔、巨集展開與 scanner) 的時間；scanner 與 pass one 交錯執行，
+    # 記憶體分不開，都算在 pass one (scanner 的 allocated / peak 為 None)
+    def __timed_scan(self, source):
+        phase = self.stats['phases']['scanner'] = {'seconds': 0.0, 'allocated': None, 'peak': None}
+        def counted(source):
+            for line in source:
+                self.stats['lines'] += 1
+                yield line
+        instructions = self.scan(counted(source))
+        while True:
+            start = time.perf_counter()
+            try:
+                instr = next(instructions)
+            except StopIteration:
+                return
+            finally:
+                phase['seconds'] += time.perf_counter() - start
+            yield instr
+
+    def __finish_stats(self, program) -> None:
+        if self.stats == None:
+            return
+        if self.__tracing:
+            tracemalloc.stop()
+            self.__tracing = False
+        stats = self.stats
+        stats['instructions'] = self.__instruction_count
+        stats['literals'] = self.__literal_count
+        stats['errors'] = len(self.errors)
+        stats['macros'] = dict(self.macro_processor.stats) # 巨集定義、展開 (重複使用) 次數、展開的敘述數與時間 (包含在 scanner 裡)
+        stats['relaxation'] = dict(self.relaxation) # pass one 分配位址的輪數與自動改成格式 4 的指令數
+        stats['seconds'] = sum(phase['seconds'] for phase in stats['phases'].values())
+        stats['sections'] = {name: {'symbols': len(table), 'text_records': 0, 'modification_records': 0}
+                             for name, table in self.__symbol_table.items()}
+        if program != None:
+            for name, record_list in program.records():
+                section = stats['sections'].setdefault(name, {'symbols': 0})
+                section['text_records'] = sum(1 for record in record_list if record[0] == 'T')
+                section['modification_records'] = sum(1 for record in record_list if record[0] == 'M')
+        stats['text_records'] = sum(section['text_records'] for section in stats['sections'].values())
+        stats['modification_records'] = sum(section['modification_records'] for section in stats['sections'].values())
+
+    # 增量組譯 (CLI --cache 用)，成功回傳 True (不寫中間檔)
+    def execute_incremental(self, read_file, write_file, cache) -> bool :
+        try:
+            program = self.assemble_incremental(read_source(read_file), cache)
+        except IOError:
+            self.error('ERROR: can not found ' + read_file, 'E001', severity='fatal')
+            return False
+        except UnicodeDecodeError:
+            self.error('ERROR: 文件中有無法解碼的字元', 'E001', severity='fatal')
+            return False
+        if not program.ok:
+            return False
+        self.write_object_program(write_file, program)
+        return True
+
+    # 平行組譯 (CLI --parallel 用)，成功回傳 True (不寫中間檔)
+    def execute_parallel(self, read_file, write_file, jobs=None) -> bool :
+        try:
+            program = self.assemble_parallel(read_source(read_file), jobs)
+        except IOError:
+            self.error('ERROR: can not found ' + read_file, 'E001', severity='fatal')
+            return False
+        except UnicodeDecodeError:
+            self.error('ERROR: 文件中有無法解碼的字元', 'E001', severity='fatal')
+            return False
+        if not program.ok:
+            return False
+        self.write_object_program(write_file, program)
+        return True
+
+    # 只執行 pass two (CLI --from-intermediate 用)，成功回傳 True
+    def execute_from_intermediate(self, intermediate_file, write_file) -> bool :
+        if not self.__open_listing():
+            return False
+        try:
+            if not self.pass_two_from_intermediate(intermediate_file):
+                return False
+            self.write_object_program(write_file)
+        except AssemblerError:
+            return False
+        except Exception as e:
+            self.__internal_error(e)
+            return False
+        finally:
+            self.__close_listing()
+        return True
+
+    # 在記憶體中組譯 : source 可以是整份原始碼字串或任何可迭代的 source lines
+    # 不讀寫檔案、不印出、不會 exit()，每次呼叫前都會 reset()
+    # (有給 intermediate_file 才會寫中間檔；collect_stats 為 True 時統計放在 self.stats)
+    def assemble(self, source, intermediate_file=None) -> ObjectProgram :
+        self.reset()
+        echo = self.echo
+        self.echo = False
+        program = None
+        self.__start_stats()
+        try:
+            if isinstance(source, str):
+                source = source.splitlines(keepends=True)
+            instructions = self.__measured_scan(source)
+            self.__measure('pass_one', lambda: self.pass_one(intermediate_file, instructions))
+            self.__measure('pass_two', self.pass_two)
+            if self.__error_flag:
+                return ObjectProgram(errors=self.errors)
+            program = self.__measure('gen_object_program', self.gen_object_program)
+            return program
+        except AssemblerError:
+            return ObjectProgram(errors=self.errors)
+        except Exception as e:
+            self.__internal_error(e)
+            return ObjectProgram(errors=self.errors)
+        finally:
+            self.echo = echo
+            self.__finish_stats(program)
+
+    # 增量組譯 : 以程式區塊 (START / CSECT) 為單位，把每個區塊的組譯結果存在 cache (SectionCache)
+    # key 是 opcode table、該區塊的原始碼以及會影響該區塊的起始狀態 (程式起始位址、BASE register) 的 hash
+    # 沒有改變的區塊直接使用 cache 裡的 records，只有改變的區塊會再跑 pass one / pass two
+    # 有報錯或區塊之間有牽連 (例如區塊結尾還有沒放置的 literal) 時改成完整組譯，結果與報錯訊息都與 assemble() 相同
+    # self.cache_stats 紀錄這次有幾個區塊、幾個用了 cache；報錯會依照 self.echo 印出
+    def assemble_incremental(self, source, cache) -> ObjectProgram :
+        self.reset()
+        self.cache_stats = {'sections': 0, 'reused': 0}
+        lines, instructions = self.__scan_silently(source)
+        program = None
+        if instructions != None:
+            program = self.__assemble_sections(lines, instructions, cache)
+        if program == None:
+            self.cache_stats['reused'] = 0
+            return self.__assemble_full(lines)
+        return program
+
+    # 平行組譯 : 以程式區塊 (START / CSECT) 為單位，在 process pool 上各自跑 pass one / pass two，最後合併並檢查 EXTREF / END
+    # 區塊之間只有前一個區塊留下的 BASE register 有牽連 : 前面沒有 BASE 的區塊馬上開始組譯，
+    # 前面有 BASE 的區塊等最後一個有 BASE 的區塊組譯完 (知道 BASE 的位址) 再開始
+    # 結果與 assemble() 完全相同，有報錯、只有一個區塊或區塊之間有其他牽連時改成完整組譯 (報錯訊息也相同)
+    # 只能用一個 CPU 核心 (jobs 或 CPU 核心數為 1)，或平均每個區塊不到 min_section_size 個指令時也改成完整組譯 :
+    # 區塊的工作量比傳送指令集與結果 (marshal、process 之間的傳送) 的成本小，平行反而比較慢 (見 PARALLEL_MIN_SECTION_SIZE)
+    # min_section_size 為 0 時一律平行組譯 (benchmark 量測用)
+    # pool 可以傳入已經建立好的 ProcessPoolExecutor，沒有給就建立一個 jobs 個 process 的 pool
+    def assemble_parallel(self, source, jobs=None, pool=None, min_section_size=None) -> ObjectProgram :
+        self.reset()
+        if min_section_size == None:
+            min_section_size = PARALLEL_MIN_SECTION_SIZE
+        cores = os.cpu_count() or 1
+        workers = min(jobs or cores, cores) # 實際上能同時執行的 worker 數
+        lines, instructions = self.__scan_silently(source)
+        program = None
+        if instructions != None:
+            split = self.__split_sections(lines, instructions)
+            if split != None and min_section_size != 0 and (workers == 1 or len(instructions) < min_section_size * len(split[0])):
+                return self.__assemble_full(lines, instructions) # 不值得平行 : 直接用掃描好的指令集，不重新掃描
+            if split != None and len(split[0]) > 1:
+                if pool == None:
+                    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1, initializer=_init_section_worker,
+                                             initargs=(self.optable.path,)) as pool:
+                        program = self.__assemble_sections_parallel(instructions, split[0], pool)
                 else:
-                    cur_position_list.append(instr['location'])
-                    cur_objcode_list.append(objcode_str+' ')
+                    program = self.__assemble_sections_parallel(instructions, split[0], pool)
+        if program == None:
+            return self.__assemble_full(lines)
+        return program
 
-        with open(file_name, mode = 'w') as f: # 打開輸出檔案
-            for symbol, info in program_info.items(): # item 可以遍歷所有 (鍵,值) 
-                # header
-                f.write('H {:<6s} {:06X} {:06X}\n'.format(
-                    symbol, info['start'], info['length']
-                ))
-                print('\nH {:<6s} {:06X} {:06X}'.format(
-                    symbol, info['start'], info['length']
-                ))
-
-                # external define
-                if info['extdef']:
-                    f.write(info['extdef'] + '\n')
-                    print(info['extdef'])
-                
-                # external reference
-                if info['extref']:
-                    f.write(info['extref'] + '\n')
-                    print(info['extref'])
-
-                # T record
-                for offset, content in info['objcode'].items(): # item 可以遍歷所有 (鍵,值) 
-                    # offset : 相對於起始的偏移值
-                    # content : 該行所有的 object code
-                    if (content == ''): # 因為上面為了分行 T record，可能會有 '' (空字串) 的問題
+    # 先不印出報錯地掃描一次，回傳 (source lines, 指令集)，有報錯時指令集為 None (交給完整組譯重新報錯)
+    # 切程式區塊與計算 hash 需要整份原始碼與指令集，兩個都做成 list (記憶體與行數成正比，不像 assemble() 邊讀邊處理)
+    def __scan_silently(self, source) -> tuple:
+        if isinstance(source, str):
+            source = source.splitlines(keepends=True)
+        lines = list(source)
+        echo = self.echo
+        self.echo = False
+        try:
+            instructions = list(self.scan(lines))
+        except Exception: # 包含 AssemblerError，交給完整組譯報錯
+            instructions = None
+        finally:
+            self.echo = echo
+        if self.__error_flag:
+            instructions = None
+        return lines, instructions
+
+    # 完整組譯 (增量 / 平行組譯無法使用時)，報錯會依照 self.echo 印出
+    # instructions 為 __scan_silently 沒有報錯的指令集時直接使用，不重新掃描
+    def __assemble_full(self, lines, instructions=None) -> ObjectProgram :
+        if instructions == None:
+            self.reset()
+            instructions = self.scan(lines)
+        try:
+            self.pass_one(None, instructions)
+            self.pass_two()
+            if self.__error_flag:
+                return ObjectProgram(errors=self.errors)
+            return self.gen_object_program()
+        except AssemblerError:
+            return ObjectProgram(errors=self.errors)
+        except Exception as e:
+            self.__internal_error(e)
+            return ObjectProgram(errors=self.errors)
+
+    # 依 START / CSECT 把指令集切成程式區塊，回傳 (每個區塊的指令集, 每個區塊在原始碼中的開始行)
+    # 每個區塊的原始碼 : 從該區塊 START / CSECT 那一行到下一個區塊的前一行 (第一個區塊從檔案開頭開始)
+    # 只有一個 START (在最前面)、一個 END (在最後面) 而且區塊名稱不重複時才能切開，否則回傳 None
+    def __split_sections(self, lines, instructions):
+        bounds = [index for index, instr in enumerate(instructions) if instr.mnemonic == 'START' or instr.mnemonic == 'CSECT']
+        if len(bounds) == 0 or bounds[0] != 0 or instructions[0].mnemonic != 'START' \
+            or instructions[-1].mnemonic != 'END' or [instr.mnemonic for instr in instructions].count('END') != 1:
+            return None
+        sections = [instructions[begin:end] for begin, end in zip(bounds, bounds[1:] + [len(instructions)])]
+        names = [section[0].symbol for section in sections]
+        if not self.macro_processor.expanded_lines.isdisjoint(section[0].line_num for section in sections[1:]):
+            return None # 巨集展開出來的 CSECT : 區塊的原始碼切不開
+        if None in names or len(set(names)) != len(names) or 'START' in [section[0].mnemonic for section in sections[1:]]:
+            return None
+        first_lines = [0] + [section[0].line_num - 1 for section in sections[1:]] + [len(lines)]
+        return sections, first_lines
+
+    # 依序從 cache 取出或單獨組譯每個程式區塊，最後合併；無法只用區塊的結果組出完整程式時回傳 None
+    def __assemble_sections(self, lines, instructions, cache):
+        split = self.__split_sections(lines, instructions)
+        if split == None:
+            return None
+        sections, first_lines = split
+        if self.__section_assembler == None:
+            self.__section_assembler = Assembler(self.optable)
+            self.__section_assembler.echo = False
+        start_location = None # 程式起始位址 (START 的 operand)，影響 CSECT 區塊的 M record
+        b_loc = None          # 前一個區塊留下來的 BASE register
+        entries = []
+        stored = False
+        for index, section in enumerate(sections):
+            text = ''.join(lines[first_lines[index]:first_lines[index + 1]])
+            state = (SECTION_CACHE_VERSION, self.optable.digest, index == 0, start_location, b_loc, self.macro_processor.signature)
+            key = hashlib.sha256(repr(state).encode() + text.encode('utf-8', 'surrogateescape')).hexdigest()
+            entry = cache.get(key)
+            if entry == None:
+                entry = self.__section_assembler.assemble_section(section, index == 0, start_location, b_loc)
+                if entry == None:
+                    return None
+                cache.put(key, entry)
+                stored = True
+            else:
+                self.cache_stats['reused'] += 1
+            if index == 0:
+                start_location = entry['info']['start']
+            if entry['base'] != None:
+                b_loc = entry['base']
+            entries.append(entry)
+        self.cache_stats['sections'] = len(entries)
+        if stored:
+            cache.evict()
+        return self.__merge_sections(instructions, entries)
+
+    # 把程式區塊交給 pool 裡的 worker 組譯 (見 assemble_parallel)，最後合併；無法只用區塊的結果組出完整程式時回傳 None
+    def __assemble_sections_parallel(self, instructions, sections, pool):
+        try:
+            start_location = int(instructions[0].operand, base=16)
+        except ValueError:
+            return None
+        packed = []  # 每個區塊 marshal 過的指令集 (見 _section_worker)
+        entries = [None] * len(sections)
+        b_locs = [None] * len(sections) # 每個區塊開始時的 BASE register
+        waiting = {} # 有 BASE 的區塊 => 等它組譯完才能開始的區塊
+        running = {} # future => 區塊
+        last_base = None # 到目前為止最後一個有 BASE 的區塊
+        for index, section in enumerate(sections):
+            packed.append(marshal.dumps([(instr.mnemonic, instr.symbol, instr.operand, instr.opcode, instr.line_num)
+                                         for instr in section]))
+            if last_base == None:
+                running[pool.submit(_section_worker, (packed[index], index == 0, start_location, None, self.optable.path))] = index
+            else:
+                waiting.setdefault(last_base, []).append(index)
+            if any(instr.mnemonic == 'BASE' for instr in section):
+                last_base = index
+        try:
+            while len(running):
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    entry = future.result()
+                    if entry == None:
+                        return None
+                    entry = marshal.loads(entry)
+                    entries[index] = entry
+                    b_loc = entry['base'] if entry['base'] != None else b_locs[index]
+                    for next_index in waiting.pop(index, ()):
+                        b_locs[next_index] = b_loc
+                        running[pool.submit(_section_worker, (packed[next_index], False, start_location, b_loc, self.optable.path))] = next_index
+        finally:
+            for future in running:
+                future.cancel()
+        return self.__merge_sections(instructions, entries)
+
+    # 合併程式區塊 : 建立全域 symbol index，EXTREF 要在自己的區塊以外找得到 (或是其他區塊的名稱)，
+    # EXTDEF 不能重複，END 的 operand 要定義在第一個區塊；檢查不通過時回傳 None (交給完整組譯報錯)
+    def __merge_sections(self, instructions, entries):
+        self.symbol_index = {}
+        for entry in entries:
+            index_section_symbols(self.symbol_index, entry['name'], entry['symbols'], entry['extdef'], entry['absolute'])
+        for entry in entries:
+            for label in entry['extdef']:
+                found = self.symbol_index.get(label)
+                if found != None and found[3] and found[0] != entry['name']:
+                    return None
+            for ref_symbol in entry['extref']:
+                found = self.symbol_index.get(ref_symbol)
+                if found == None or not (found[2] == 'section' or (found[3] and found[0] != entry['name'])):
+                    return None
+        end_operand = instructions[-1].operand
+        if end_operand not in entries[0]['symbols']:
+            return None
+        found = self.symbol_index[end_operand]
+        end_position = (found[0], found[1])
+        return ObjectProgram({entry['name']: entry['info'] for entry in entries}, end_position, self.errors)
+
+    # 單獨組譯一個程式區塊 (在增量組譯專用的另一個 Assembler 或平行組譯的 worker 上執行)
+    # 不是第一個區塊時，前面加上哨兵 START 區塊 : 帶入程式起始位址、前一個區塊的 BASE register，
+    # 以及 END 的 operand (讓 END 的檢查通過，真正的檢查在合併時做)
+    # 不是最後一個區塊時，最後加上哨兵 CSECT 結束這個區塊
+    # 回傳要存進 cache 的 dict，有報錯或區塊結尾還有沒放置的 literal 時回傳 None
+    def assemble_section(self, section, first, start_location, b_loc):
+        self.reset()
+        name = section[0].symbol
+        last = section[-1].mnemonic == 'END'
+        instructions = []
+        if not first:
+            instructions.append(Instruction('START', SECTION_SENTINEL, '{:X}'.format(start_location)))
+            if b_loc != None:
+                if b_loc < 0:
+                    return None
+                instructions.append(Instruction('EQU', SECTION_BASE_SENTINEL, str(b_loc)))
+                instructions.append(Instruction('BASE', operand=SECTION_BASE_SENTINEL))
+            if last:
+                instructions.append(Instruction('EQU', section[-1].operand, '0'))
+        instructions += section
+        if not last:
+            instructions.append(Instruction('CSECT', SECTION_SENTINEL + 'END', location=0))
+        try:
+            self.pass_one(None, instructions)
+            self.pass_two(check_extref=False)
+            if self.__error_flag or len(self.__literal_table) != 0:
+                return None
+            if not last: # 哨兵 CSECT 之後沒有 END，pass two 不會幫它建立 M record
+                self.__modified_record[SECTION_SENTINEL + 'END'] = []
+            program = self.gen_object_program()
+        except Exception: # 包含無法預期的錯誤，交給完整組譯報錯
+            return None
+        base = None # 這個區塊最後一個 BASE 的位址 (下一個區塊會沿用)
+        for instr in section:
+            if instr.mnemonic == 'BASE':
+                base = self.__symbol_table[name].get(instr.operand)
+        return {
+            'name': name,
+            'info': program.sections[name],           # H / D / R / T / M record 的資訊
+            'symbols': self.__symbol_table[name],     # END 的 operand 要查
+            'extdef': self.__extdef_table[name],      # 其他區塊的 EXTREF 要查
+            'extref': self.__extref_table[name],
+            'absolute': self.__absolute_symbols.get(name, set()),
+            'base': base,
+        }
+
+# 平行組譯 : 平均每個程式區塊至少要有這麼多指令才分給 worker (否則改成完整組譯)
+# 單核心上量測 (benchmark --parallel)，平行組譯的額外成本每個區塊約 0.2 ~ 0.6 ms 再加上工作量的 15% 以上，
+# 區塊只有幾十到幾百個指令 (每個指令的 pass one / pass two 約 12 us) 時，兩個 worker 也抵不過這些成本
+PARALLEL_MIN_SECTION_SIZE = 1000
+
+# 平行組譯 : 每個 worker process 只建立一次 Assembler，組譯交給它的程式區塊
+_section_assembler = None
+
+# 可以當作 pool 的 initializer 先建立 Assembler (不用也可以，第一次組譯時才建立)
+def _init_section_worker(optable=None) -> None:
+    global _section_assembler
+    _section_assembler = Assembler(optable)
+    _section_assembler.echo = False
+
+# 指令集用 marshal 過的 (mnemonic, symbol, operand, opcode, lineNum) 傳進來 (比 pickle Instruction 快很多)，
+# 結果也用 marshal 傳回去 (與 SectionCache 存的格式相同)
+# optable 是呼叫端使用的 opcode table 路徑，與 worker 現在的不同時重新建立 Assembler
+def _section_worker(task) -> bytes:
+    packed, first, start_location, b_loc, optable = task
+    if _section_assembler == None or _section_assembler.optable.path != optable:
+        _init_section_worker(optable)
+    section = [Instruction(*record) for record in marshal.loads(packed)]
+    entry = _section_assembler.assemble_section(section, first, start_location, b_loc)
+    return marshal.dumps(entry) if entry != None else None
+
+# batch mode : 每個 worker process 只建立一次 Assembler
+_batch_assembler = None
+_batch_cache = None # 有指定 cache 資料夾時使用增量組譯
+
+def _init_batch_worker(cache_dir=None, cache_size=64 * 1024 * 1024, optable=None, optable_cache=None, collect_stats=False,
+                       max_errors=None) -> None:
+    global _batch_assembler, _batch_cache
+    _batch_assembler = Assembler(load_optable(optable, optable_cache))
+    _batch_assembler.echo = False
+    _batch_assembler.collect_stats = collect_stats
+    _batch_assembler.max_errors = max_errors
+    if cache_dir != None:
+        _batch_cache = SectionCache(cache_dir, cache_size)
+
+# 依照 object program 的輸出檔名寫出二進位格式 : 例如 prog_output.txt => prog_output_區塊名稱.img、prog_output.obj
+def write_binary_outputs(program, write_file, memory_image=False, relocatable=False) -> None:
+    stem = os.path.splitext(write_file)[0]
+    if memory_image:
+        program.write_memory_images(stem)
+    if relocatable:
+        program.write_relocatable(stem + '.obj')
+
+# 由原始檔名推導輸出檔名，例如 dir/prog.txt => out_dir/prog_output.txt、out_dir/prog_intermediate.bin
+def derive_output_names(read_file, out_dir=None) -> tuple:
+    stem = os.path.splitext(read_file)[0]
+    if out_dir != None:
+        stem = os.path.join(out_dir, os.path.basename(stem))
+    return stem + '_output.txt', stem + '_intermediate.bin'
+
+# 找出會寫到同一個輸出檔的原始檔 (例如 -o 同一個資料夾時的 a/prog.txt 與 b/prog.txt，或 prog.txt 與 prog.asm)
+# 回傳 {輸出檔: [原始檔, ...]}，只包含撞名的 (沒有撞名時為空的 dict)
+def output_name_collisions(sources, out_dir=None) -> dict:
+    owners = {} # 輸出檔 (絕對路徑) => 原始檔
+    for read_file in sources:
+        owners.setdefault(os.path.normcase(os.path.abspath(derive_output_names(read_file, out_dir)[0])), []).append(read_file)
+    return {derive_output_names(files[0], out_dir)[0]: files for files in owners.values() if len(files) > 1}
+
+# 在 worker 裡組譯一個檔案，回傳 (原始檔名, 是否成功, 報錯訊息, 統計)
+# 統計只有在收集統計且不是增量組譯時才有 (見 Assembler.collect_stats)，否則為 None
+def _batch_worker(task) -> tuple:
+    read_file, write_file, intermediate_file, memory_image, relocatable = task
+    try:
+        if _batch_cache != None:
+            program = _batch_assembler.assemble_incremental(read_source(read_file), _batch_cache)
+        else:
+            program = _batch_assembler.assemble(read_source(read_file), intermediate_file)
+    except (IOError, UnicodeDecodeError) as e:
+        return read_file, False, [f'ERROR: can not read {read_file} ({e})'], None
+    except Exception as e: # 一個檔案的錯誤不能讓整個 worker (以及整批組譯) 停掉
+        return read_file, False, [f'ERROR: internal error ({type(e).__name__}: {e})'], None
+    if program.ok:
+        try:
+            with open(write_file, mode='w') as f:
+                f.write(program.to_text())
+            write_binary_outputs(program, write_file, memory_image, relocatable)
+        except IOError as e:
+            return read_file, False, [f'ERROR: can not write {write_file} ({e})'], None
+    return read_file, program.ok, program.errors, _batch_assembler.stats if _batch_cache == None else None
+
+# 把統計 ({原始檔名: Assembler.stats}) 寫成 JSON 檔，path 為 '-' 時印出
+def write_stats(stats, path) -> None:
+    text = json.dumps(stats, indent=2, ensure_ascii=False)
+    if path == '-':
+        print(text)
+    else:
+        with open(path, mode='w', encoding='utf-8') as f:
+            f.write(text + '\n')
+
+# 展開檔案列表中的 glob pattern (例如 'src/*.txt')，保持原本順序並去掉重複
+def expand_sources(patterns) -> list:
+    sources = []
+    for pattern in patterns:
+        matched = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for name in matched:
+            if name not in sources:
+                sources.append(name)
+    return sources
+
+# 用 process pool 同時組譯多個檔案，最後印出成功 / 失敗統計，全部成功才回傳 True
+# 有原始檔的輸出檔名相同 (見 output_name_collisions) 時印出報錯並回傳 False，不組譯任何檔案
+# 有給 cache_dir 時每個檔案都用增量組譯 (所有 worker 共用同一個 cache，不寫中間檔)
+# optable、optable_cache 為 opcode table 與預先編譯的 table 的路徑 (見 load_optable)
+# memory_image、relocatable 為是否同時寫出記憶體映像與二進位可重定位 object 檔 (見 write_binary_outputs)
+# stats 為 dict 時收集每個檔案的統計，放在 stats[原始檔名] (見 Assembler.collect_stats)
+# max_errors 為每個檔案報錯數的上限 (見 Assembler.max_errors)
+def assemble_batch(sources, jobs=None, out_dir=None, write_intermediate=True, cache_dir=None, cache_size=64 * 1024 * 1024,
+                   optable=None, optable_cache=None, memory_image=False, relocatable=False, stats=None, max_errors=None) -> bool:
+    collisions = output_name_collisions(sources, out_dir)
+    if len(collisions): # 撞名時一個檔案都不組譯 (不然後組譯完的會蓋掉先組譯完的)
+        for write_file, files in collisions.items():
+            print(f"ERROR: {', '.join(files)} would all write {write_file}")
+        return False
+    tasks = []
+    for read_file in sources:
+        write_file, intermediate_file = derive_output_names(read_file, out_dir)
+        tasks.append((read_file, write_file, intermediate_file if write_intermediate else None, memory_image, relocatable))
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(cache_dir, cache_size, optable, optable_cache, stats != None, max_errors)) as pool:
+        for read_file, ok, errors, file_stats in pool.map(_batch_worker, tasks, chunksize=chunksize):
+            if not ok:
+                failed.append((read_file, errors))
+            if stats != None and file_stats != None:
+                stats[read_file] = file_stats
+    for read_file, errors in failed:
+        print(f"\n[FAILED] {read_file}")
+        for reason in errors:
+            print(f"    {reason}")
+    print(f"\n{len(tasks)} files : {len(tasks) - len(failed)} succeeded, {len(failed)} failed")
+    return len(failed) == 0
+
+# watch mode ============================================================================
+# 監看檔案與資料夾的變化 : Linux 上用 inotify (透過 ctypes 呼叫 libc)，不能用時改成每 interval 秒比對 os.stat
+# 檔案是監看它所在的資料夾 (編輯器常用「寫到暫存檔再 rename」的方式存檔，直接監看檔案會漏掉)
+class FileWatcher:
+    IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x2, 0x8, 0x80, 0x100, 0x200
+    EVENT = struct.Struct('iIII') # inotify_event : wd、mask、cookie、name 長度
+
+    def __init__(self, paths, interval=0.5):
+        self.interval = interval
+        self.directories = sorted({os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path) or '.') for path in paths})
+        self.backend = 'polling'
+        self.__fd = None
+        self.__watches = {} # inotify watch descriptor => 資料夾
+        self.__snapshot = None
+        try:
+            self.__start_inotify()
+        except (OSError, AttributeError):
+            self.__fd = None
+        if self.__fd == None:
+            self.__snapshot = self.__scan()
+
+    def __start_inotify(self) -> None:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        for directory in self.directories:
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), mask)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), f'can not watch {directory}')
+            self.__watches[wd] = directory
+        self.__fd = fd
+        self.backend = 'inotify'
+
+    def __scan(self) -> dict: # polling : 路徑 => (mtime, size)
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                for dir_entry in os.scandir(directory):
+                    try:
+                        stat = dir_entry.stat()
+                    except OSError:
                         continue
-                    else:
-                        # 去除 object code 之間的空白格，為了算長度
-                        content_list = content.split(' ')
-                        content_len = ''
-                        for content_str in content_list:
-                            content_len += content_str
-                        ##########################################
-                        f.write('T {:06X} {:02X} {}\n'.format(offset, len(content_len) // 2, content))
-                        print('T {:06X} {:02X} {}'.format(offset, len(content_len) // 2, content))
-
-                # modified record
-                for modified in info['modified']:
-                    f.write(modified + '\n')
-                    print(modified)
-                
-                if len(end_position) != 0 and symbol == end_position[0] :
-                    f.write('E {:06X}\n'.format(end_position[1]))
-                    print('E {:06X}'.format(end_position[1]))
-                else:
-                    f.write('E\n')
-                    print('E')
-                f.write('\n')
-                print('\n')
-
-    def execute(self, read_file, write_file , intermediate_file) : # 執行 assembler
-        self.scanner(read_file)
-        self.pass_one(intermediate_file)
-        self.pass_two()
-        if (self.__error_flag):
-            exit(1)
+                    snapshot[dir_entry.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        return snapshot
+
+    def __read_events(self, timeout) -> set:
+        import select
+        changed = set()
+        if not select.select([self.__fd], [], [], timeout)[0]:
+            return changed
+        try:
+            data = os.read(self.__fd, 65536)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self.__watches and name:
+                changed.add(os.path.join(self.__watches[wd], os.fsdecode(name)))
+        return changed
+
+    # 等到有檔案改變 (最多 timeout 秒，None 為一直等)，回傳改變的檔案的絕對路徑 (set)
+    # 收到第一個變化之後再等 settle 秒，把同一次存檔的多個事件合併成一次
+    def changed(self, timeout=None, settle=0.05) -> set:
+        deadline = time.monotonic() + timeout if timeout != None else None
+        while True:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline != None else None
+            if self.__fd != None:
+                changed = self.__read_events(remaining)
+                if changed:
+                    while True:
+                        more = self.__read_events(settle)
+                        if not more:
+                            break
+                        changed |= more
+            else:
+                time.sleep(min(self.interval, remaining) if remaining != None else self.interval)
+                snapshot = self.__scan()
+                changed = {path for path in snapshot.keys() | self.__snapshot.keys()
+                           if snapshot.get(path) != self.__snapshot.get(path)}
+                self.__snapshot = snapshot
+            if changed or (deadline != None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self) -> None:
+        if self.__fd != None:
+            os.close(self.__fd)
+            self.__fd = None
+
+# 先寫到暫存檔再 rename，讀的人 (例如其他工具也在監看輸出檔) 不會讀到寫一半的檔案
+def write_atomic(path, text) -> None:
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, mode='w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+# watch mode 的原始檔 : 檔案與 glob pattern 同 expand_sources；資料夾為其中的 .txt / .asm 檔，
+# 不含 assembler 寫出的文字檔 (object program、組譯列表，見 WATCH_SKIPPED_SUFFIXES) 與 opcode table
+# (名稱為 opCode.txt 的檔案與 optable 路徑的檔案 ; 中間檔、記憶體映像、.obj 不是 .txt，本來就不會被選到)
+WATCH_SKIPPED_SUFFIXES = ('_output.txt', '_listing.txt')
+
+def expand_watch_sources(patterns, optable=OPCODE_FILE) -> list:
+    sources = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for name in sorted(os.listdir(pattern)):
+                path = os.path.join(pattern, name)
+                if name.endswith(('.txt', '.asm')) and not name.endswith(WATCH_SKIPPED_SUFFIXES) and name != os.path.basename(OPCODE_FILE) \
+                        and os.path.abspath(path) != os.path.abspath(optable):
+                    sources.append(path)
         else:
-            self.write_object_program(write_file)
+            sources += expand_sources([pattern])
+    return list(dict.fromkeys(sources))
+
+# watch mode : 先組譯所有原始檔，之後每次有原始檔改變就只重新組譯改變的檔案，直到 Ctrl-C (或 max_rounds 次改變之後)
+# 使用同一個 Assembler 與記憶體中的 cache (MemorySectionCache)，只有改變的程式區塊會再跑 pass one / pass two
+# 一個檔案時輸出到 write_file，多個檔案時輸出檔名同批次模式 (derive_output_names)；object program 以 write_atomic 寫出
+def watch(patterns, write_file=None, out_dir=None, optable=None, memory_image=False, relocatable=False, max_errors=None,
+          interval=0.5, max_rounds=None) -> None:
+    asm = Assembler(optable)
+    asm.echo = False
+    asm.max_errors = max_errors
+    cache = MemorySectionCache()
+    sources = expand_watch_sources(patterns, asm.optable.path)
+
+    def assemble_file(read_file):
+        output = write_file if len(sources) == 1 and write_file != None else derive_output_names(read_file, out_dir)[0]
+        start = time.perf_counter()
+        try:
+            program = asm.assemble_incremental(read_source(read_file), cache)
+        except (IOError, UnicodeDecodeError) as e:
+            print(f'{time.strftime("%H:%M:%S")} {read_file} : ERROR: can not read ({e})', flush=True)
+            return
+        if program.ok:
+            write_atomic(output, program.to_text())
+            write_binary_outputs(program, output, memory_image, relocatable)
+        elapsed = (time.perf_counter() - start) * 1000
+        if program.ok:
+            print(f'{time.strftime("%H:%M:%S")} {read_file} => {output} : {elapsed:.1f} ms '
+                  f"({asm.cache_stats['reused']} / {asm.cache_stats['sections']} control sections reused)", flush=True)
+        else:
+            print(f'{time.strftime("%H:%M:%S")} {read_file} : {len(program.errors)} errors ({elapsed:.1f} ms)', flush=True)
+            for reason in program.errors:
+                print(f'    {reason}', flush=True)
+
+    # 多個檔案時，輸出檔名相同的原始檔都不組譯 (資料夾或 glob pattern 多了新檔案時也會再檢查)
+    def without_collisions(sources):
+        if len(sources) == 1 and write_file != None:
+            return sources
+        skipped = set()
+        for output, files in output_name_collisions(sources, out_dir).items():
+            print(f"{time.strftime('%H:%M:%S')} ERROR: {', '.join(files)} would all write {output}", flush=True)
+            skipped.update(files)
+        return [read_file for read_file in sources if read_file not in skipped]
+
+    for read_file in without_collisions(sources):
+        assemble_file(read_file)
+    watcher = FileWatcher(patterns + sources, interval)
+    print(f'watching {len(sources)} files ({watcher.backend}), Ctrl-C to stop', flush=True)
+    rounds = 0
+    try:
+        while max_rounds == None or rounds < max_rounds:
+            changed = watcher.changed()
+            sources = expand_watch_sources(patterns, asm.optable.path) # 資料夾或 glob pattern 可能多了新檔案
+            affected = [read_file for read_file in sources if os.path.abspath(read_file) in changed]
+            if len(affected) == 0:
+                continue
+            rounds += 1
+            for read_file in without_collisions(sources):
+                if read_file in affected:
+                    assemble_file(read_file)
+            cache.evict()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+# daemon mode : 常駐的 process 透過 Unix domain socket 接受組譯要求，省下每次啟動 interpreter 與載入 opcode table 的時間
+# 協定為一行一個 JSON (UTF-8)，同一個連線可以送多個要求，依序回應 :
+#   要求 {"command": "assemble" (預設) / "ping" / "shutdown", "id": 任意值, "source": 原始碼字串, "stats": 是否回傳統計}
+#   回應 {"id": 同要求, "ok": bool, "object_program": object program 文字 (失敗時為 ""),
+#         "errors": [報錯訊息], "diagnostics": [Diagnostic.to_dict()], "stats": Assembler.stats (有要求時)}
+# 預設 socket 放在只有自己能存取 (0700) 的資料夾裡，不直接放在大家都能寫入的 /tmp
+DAEMON_DIR = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), f'sicxe-{os.getuid() if hasattr(os, "getuid") else 0}')
+DAEMON_SOCKET = os.path.join(DAEMON_DIR, 'daemon.sock') # 預設 socket 路徑
+DAEMON_LINE_LIMIT = 64 * 1024 * 1024 # 一個要求 (一行 JSON) 的大小上限
+
+# 在 worker 裡組譯一個要求 (與 batch mode 共用 _batch_assembler)，回傳回應的 dict
+def _daemon_worker(request) -> dict:
+    asm = _batch_assembler
+    asm.collect_stats = request.get('stats') == True
+    try:
+        program = asm.assemble(request['source'])
+    except Exception as e: # assemble() 已經接住組譯時的錯誤，這裡只剩不合法的要求 (例如 source 不是字串)
+        return {'ok': False, 'object_program': '', 'errors': [f'ERROR: bad request ({type(e).__name__}: {e})'], 'diagnostics': []}
+    response = {
+        'ok': program.ok,
+        'object_program': program.to_text() if program.ok else '',
+        'errors': list(program.errors),
+        'diagnostics': [diagnostic.to_dict() for diagnostic in asm.diagnostics],
+    }
+    if asm.stats != None:
+        response['stats'] = asm.stats
+    return response
+
+# 準備 daemon 要 listen 的路徑 : 預設資料夾 (DAEMON_DIR) 不存在時建立 (0700)，存在時要是自己的而且其他人不能存取
+# 路徑已經存在時只有它是 socket 而且沒有 daemon 回應 (上一次沒有正常結束留下的) 才刪掉，
+# 不是 socket 或已經有 daemon 在 listen 時丟出 OSError 拒絕啟動
+def prepare_daemon_socket(socket_path) -> None:
+    import socket # 只有 daemon 需要
+    import stat
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if directory == DAEMON_DIR:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise OSError(f'{directory} must be a directory owned by the current user with mode 0700')
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode):
+        raise OSError(f'{socket_path} exists and is not a socket')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        probe.settimeout(1)
+        try:
+            probe.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError): # 沒有 daemon 在 listen
+            os.remove(socket_path)
+            return
+        except socket.timeout: # 有 daemon 但是忙到沒有接受連線，也當作已經在執行
+            pass
+    raise OSError(f'another daemon is already listening on {socket_path}')
+
+# 啟動 daemon，直到收到 shutdown 要求 (或 SIGINT / SIGTERM) 才結束
+# jobs 個 worker process 組譯 (預設 CPU 核心數)，同時處理中的要求最多 max_pending 個 (預設 jobs * 4)，其他的等待
+async def serve_daemon(socket_path=DAEMON_SOCKET, jobs=None, optable=None, optable_cache=None, max_errors=None, max_pending=None) -> None:
+    import asyncio # 只有 daemon 需要，不拖慢一般組譯的啟動時間
+    import signal
+    jobs = jobs or os.cpu_count() or 1
+    pending = asyncio.Semaphore(max_pending or jobs * 4)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    async def handle(reader, writer):
+        try:
+            while not stopped.is_set():
+                try:
+                    line = await reader.readline()
+                except ValueError: # 超過 DAEMON_LINE_LIMIT
+                    response = {'ok': False, 'errors': ['ERROR: request too large']}
+                    writer.write(json.dumps(response).encode() + b'\n')
+                    break
+                if line == b'':
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                except ValueError as e:
+                    response = {'ok': False, 'errors': [f'ERROR: bad request ({e})']}
+                else:
+                    command = request.get('command', 'assemble')
+                    if command == 'ping':
+                        response = {'ok': True}
+                    elif command == 'shutdown':
+                        response = {'ok': True}
+                        stopped.set()
+                    elif command == 'assemble':
+                        async with pending:
+                            response = await loop.run_in_executor(pool, _daemon_worker, request)
+                    else:
+                        response = {'ok': False, 'errors': [f'ERROR: unknown command {command!r}']}
+                    if 'id' in request:
+                        response['id'] = request['id']
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    prepare_daemon_socket(socket_path)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker,
+                             initargs=(None, 0, optable, optable_cache, False, max_errors)) as pool:
+        server = await asyncio.start_unix_server(handle, path=socket_path, limit=DAEMON_LINE_LIMIT)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopped.set)
+        print(f'daemon : listening on {socket_path} ({jobs} workers)', flush=True)
+        try:
+            async with server:
+                await stopped.wait()
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
 
 if __name__ == "__main__":
     print("Two Pass SIC XE Assembler.")
     print("   Usage: 'python 108213053王念祖_SIC_XE.py <input_file>")
 
-    # initial class
-    asm = Assembler()
-    read_file = sys.argv[1]
-    write_file = '108213053王念祖_output.txt'
-    intermediate_file = '108213053王念祖_intermediate.txt'
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', nargs='*', help='SIC/XE source file(s) or glob pattern(s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='batch mode worker processes (default: all cores)')
+    parser.add_argument('-o', '--out-dir', default=None, help='batch mode output directory')
+    parser.add_argument('--batch', action='store_true', help='use derived output names even for a single file')
+    parser.add_argument('--no-intermediate', action='store_true', help="don't write the intermediate file(s)")
+    parser.add_argument('--from-intermediate', action='store_true', help='input is an intermediate file: run pass two only')
+    parser.add_argument('--dump-intermediate', action='store_true', help='print intermediate file(s) as JSON lines')
+    parser.add_argument('--cache', default=None, metavar='DIR', help='incremental mode: reuse unchanged control sections cached in DIR')
+    parser.add_argument('--cache-size', type=int, default=64, metavar='MB', help='cache size limit (least recently used sections are evicted)')
+    parser.add_argument('--parallel', action='store_true', help='assemble the control sections of one file on -j worker processes')
+    parser.add_argument('--image', action='store_true', help='also write a binary memory image per control section (<output>_<section>.img)')
+    parser.add_argument('--relocatable', action='store_true', help='also write a binary relocatable object file (<output>.obj)')
+    parser.add_argument('--listing', nargs='?', const='108213053王念祖_listing.txt', default=None, metavar='FILE',
+                        help='also write an assembly listing (default: 108213053王念祖_listing.txt, single file mode)')
+    parser.add_argument('--link', default=None, metavar='IMAGE', help='linking loader: inputs are object files (text or .obj), write the linked memory image')
+    parser.add_argument('--load-address', default=None, metavar='HEX', help='load address for --link / --run (hex, default: 0 / program start)')
+    parser.add_argument('--run', action='store_true', help='simulator: inputs are object files (text or .obj), load and execute them')
+    parser.add_argument('--devices', default='.', metavar='DIR', help='directory of the device files (XX.dev) for --run')
+    parser.add_argument('--max-steps', type=int, default=None, metavar='N', help='stop --run after N instructions')
+    parser.add_argument('--optable', default=None, metavar='PATH', help='opcode table (default: opCode.txt next to this script)')
+    parser.add_argument('--max-errors', type=int, default=None, metavar='N', help='stop assembling a file after N errors')
+    parser.add_argument('--stats', default=None, metavar='FILE', help="write per-phase timing / memory / count statistics as JSON ('-' for stdout)")
+    parser.add_argument('--optable-cache', default=None, metavar='FILE', help='precompiled opcode table (created / refreshed automatically)')
+    parser.add_argument('--watch', action='store_true', help='re-assemble the input files (or the sources in input directories) whenever they change')
+    parser.add_argument('--watch-interval', type=float, default=0.5, metavar='SECONDS', help='polling interval when inotify is not available')
+    parser.add_argument('--daemon', nargs='?', const=DAEMON_SOCKET, default=None, metavar='SOCKET',
+                        help=f'run as a daemon on a Unix socket (default: {DAEMON_SOCKET}), see 108213053王念祖_client.py')
+    args = parser.parse_args()
+    if len(args.input_file) == 0 and args.daemon == None:
+        parser.error('the following arguments are required: input_file')
+    # 這些模式不收集統計 / 不寫組譯列表，直接報錯而不是默默忽略 --stats / --listing
+    modes = {'--cache': args.cache != None, '--parallel': args.parallel, '--from-intermediate': args.from_intermediate,
+             '--dump-intermediate': args.dump_intermediate, '--watch': args.watch, '--daemon': args.daemon != None,
+             '--run': args.run, '--link': args.link != None}
+    for mode in ('--cache', '--parallel', '--from-intermediate', '--dump-intermediate', '--watch', '--daemon', '--run', '--link'):
+        if args.stats != None and modes[mode]:
+            parser.error(f'--stats can not be used with {mode}')
+    for mode in ('--cache', '--parallel', '--dump-intermediate', '--watch', '--daemon', '--run', '--link'):
+        if args.listing != None and modes[mode]:
+            parser.error(f'--listing can not be used with {mode}')
+
+    sources = expand_sources(args.input_file)
+    if args.listing != None and not args.from_intermediate and (len(sources) != 1 or args.batch or glob.has_magic(args.input_file[0])):
+        parser.error('--listing can only be used with a single input file')
+    try:
+        optable = load_optable(args.optable, args.optable_cache)
+    except (IOError, ValueError, IndexError) as e:
+        print(f'ERROR: can not load opcode table ({e})')
+        sys.exit(1)
+    if args.daemon != None:
+        import asyncio
+        try:
+            asyncio.run(serve_daemon(args.daemon, args.jobs, optable.path, args.optable_cache, args.max_errors))
+        except OSError as e:
+            print(f'ERROR: can not listen on {args.daemon} ({e})')
+            sys.exit(1)
+    elif args.watch:
+        single = len(sources) == 1 and not args.batch and not glob.has_magic(args.input_file[0]) and not os.path.isdir(sources[0])
+        if args.out_dir != None:
+            os.makedirs(args.out_dir, exist_ok=True)
+        watch(args.input_file, '108213053王念祖_output.txt' if single else None, args.out_dir, optable, args.image, args.relocatable,
+              args.max_errors, args.watch_interval)
+    elif args.dump_intermediate:
+        for path in sources:
+            try:
+                for line in dump_intermediate(path):
+                    print(line)
+            except (IOError, ValueError, EOFError, TypeError) as e:
+                print(f'ERROR: {e}')
+                sys.exit(1)
+    elif args.run:
+        simulator = Simulator(optable, args.devices)
+        try:
+            simulator.load([read_object_file(path) for path in sources],
+                           int(args.load_address, 16) if args.load_address != None else None)
+            start = time.perf_counter()
+            reason = simulator.run(args.max_steps)
+            elapsed = time.perf_counter() - start
+        except (IOError, ValueError, SimulatorError) as e:
+            print(f'ERROR: {e}')
+            sys.exit(1)
+        finally:
+            simulator.close()
+        print(f'stop  : {reason}')
+        print('  '.join(f'{name}={value:06X}' if name != 'F' else f'{name}={value:g}' for name, value in simulator.dump().items()))
+        print(f'{simulator.steps} instructions in {elapsed:.3f} s ({simulator.steps / max(elapsed, 1e-9):,.0f} instructions/s)')
+    elif args.link != None:
+        try:
+            programs = [read_object_file(path) for path in sources]
+            result = link_programs(programs, int(args.load_address or '0', 16))
+        except (IOError, ValueError) as e:
+            print(f'ERROR: {e}')
+            sys.exit(1)
+        # load map : 程式區塊與外部符號載入後的位址
+        section_names = set()
+        for name, address, length in result['sections']:
+            section_names.add(name)
+            print(f'{name:<8s} {"":<8s} {address:06X}  {length:06X}')
+        for symbol, address in result['estab'].items():
+            if symbol not in section_names:
+                print(f'{"":<8s} {symbol:<8s} {address:06X}')
+        if result['entry'] != None:
+            print(f"entry : {result['entry']:06X}")
+        for reason in result['errors']:
+            print(f'ERROR: {reason}')
+        if len(result['errors']):
+            sys.exit(1)
+        with open(args.link, mode='wb') as f:
+            f.write(result['image'])
+    elif args.from_intermediate:
+        asm = Assembler(optable)
+        asm.memory_image = args.image
+        asm.relocatable = args.relocatable
+        asm.listing_file = args.listing
+        if not asm.execute_from_intermediate(sources[0], '108213053王念祖_output.txt'):
+            sys.exit(1)
+    elif len(sources) != 1 or args.batch or glob.has_magic(args.input_file[0]):
+        if args.out_dir != None:
+            os.makedirs(args.out_dir, exist_ok=True)
+        stats = {} if args.stats != None else None
+        ok = assemble_batch(sources, args.jobs, args.out_dir, not args.no_intermediate, args.cache, args.cache_size * 1024 * 1024,
+                            optable.path, args.optable_cache, args.image, args.relocatable, stats, args.max_errors)
+        if stats != None:
+            write_stats(stats, args.stats)
+        if not ok:
+            sys.exit(1)
+    else:
+        # initial class
+        asm = Assembler(optable)
+        asm.memory_image = args.image
+        asm.relocatable = args.relocatable
+        asm.listing_file = args.listing
+        asm.max_errors = args.max_errors
+        read_file = sources[0]
+        write_file = '108213053王念祖_output.txt'
+        intermediate_file = '108213053王念祖_intermediate.bin' if not args.no_intermediate else None
 
-    asm.execute(read_file, write_file , intermediate_file)
\ No newline at end of file
+        if args.cache != None:
+            cache = SectionCache(args.cache, args.cache_size * 1024 * 1024)
+            if not asm.execute_incremental(read_file, write_file, cache):
+                sys.exit(1)
+            print(f"cache : {asm.cache_stats['reused']} / {asm.cache_stats['sections']} control sections reused")
+        elif args.parallel:
+            if not asm.execute_parallel(read_file, write_file, args.jobs):
+                sys.exit(1)
+        else:
+            asm.collect_stats = args.stats != None
+            ok = asm.execute(read_file, write_file , intermediate_file)
+            if asm.stats != None:
+                write_stats({read_file: asm.stats}, args.stats)
+            if not ok:
+                sys.exit(1)
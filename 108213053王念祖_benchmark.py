@@ -0,0 +1,642 @@
+########################################################################
+# SIC XE assembler benchmark
+# 用合成的 SIC/XE 程式量測 assembler 各階段的吞吐量 (lines/second)
+#########################################################################
+import os
+import re
+import sys
+import mmap
+import time
+import tracemalloc
+import random
+import tempfile
+import contextlib
+import argparse
+import importlib.util
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSEMBLER_FILE = os.path.join(BASE_DIR, '108213053王念祖_SIC_XE.py')
+COPY_FILE = os.path.join(BASE_DIR, '108213053王念祖_input.txt')
+CLIENT_FILE = os.path.join(BASE_DIR, '108213053王念祖_client.py')
+
+# 載入 assembler 模組 (檔名不是合法的 module 名稱，所以用檔案路徑載入)
+# 也可以載入其他版本的 assembler 檔案，用來做前後比較
+def load_assembler(path=ASSEMBLER_FILE, name='sic_xe'):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module # worker process 要用 module 名稱找到 _section_worker 等函式
+    spec.loader.exec_module(module)
+    return module
+
+# 產生一個約 line_count 行指令的合法 SIC/XE 程式 (list of lines)，可以完整組譯
+# 每 block_size 行切成一個 block : block 內的指令只參考同一 block 的 label、資料與 literal (都在 PC 相對定址範圍內)
+#   sections        程式區塊數 (第一個是 START，其他是 CSECT S1、S2 ...)，每個區塊 EXTDEF 自己的進入點 (FIRST、F1、F2 ...)
+#   literal_density 指令行中使用 literal 的比例 (每個 literal 內容都不同，放在該 block 結尾的 LTORG；
+#                   同一個 literal 出現在多個 literal pool 時，pass two 只會用到最後一個位址)
+#   extref_fanout   每個 CSECT 用 EXTREF 參考前面幾個區塊的進入點 (format 4 的 +JSUB 會隨機呼叫其中一個)
+#   data_share      BYTE / WORD 資料行佔全部行數的比例，byte_share 為其中 BYTE 的比例 (其餘為 WORD)
+#   format4_share   非 literal 指令行中 format 4 (+LDA、+STA、+JSUB) 的比例
+def gen_simple_program(line_count, seed=0, block_size=40, sections=1, literal_density=0.2, extref_fanout=1, data_share=0.0,
+                       byte_share=0.5, format4_share=0.1) -> list:
+    rng = random.Random(seed)
+    body = [
+        'LDA\tW{n}',
+        'STCH   B{n} , X',
+        '\tCOMPR\tA,S',
+        'CLEAR X    . clear index',
+        '\tLDA\t#3',
+        'J @R{n}',
+        '\tSTA\tR{n}',
+        'TIXR T',
+    ]
+    lines = ['BENCH\tSTART\t0\n']
+    if sections > 1:
+        lines.append('\tEXTDEF\tFIRST\n')
+    lines.append('FIRST\tCLEAR\tX\n')
+    externals = ['FIRST'] # 目前的程式區塊可以 +JSUB 的進入點 (第一個區塊只有自己的 FIRST)
+    section = 1
+    block = 0
+    literal = 0
+    while len(lines) < line_count:
+        if section < sections and len(lines) >= line_count * section // sections:
+            # 結束上一個 block (上一個 block 的 J 跳到這裡)，label 只在自己的程式區塊裡，可以重複
+            externals = ['FIRST'] + [f'F{n}' for n in range(1, section)]
+            externals = rng.sample(externals, min(extref_fanout, len(externals)))
+            lines += [f'L{block}\tRSUB\n', f'S{section}\tCSECT\n', f'\tEXTDEF\tF{section}\n']
+            if len(externals):
+                lines.append(f'\tEXTREF\t{",".join(externals)}\n')
+            lines.append(f'F{section}\tCLEAR\tX\n')
+            section += 1
+        code = [f'L{block}\tLDA\tW{block}\n']
+        data = []
+        for _ in range(block_size):
+            if rng.random() < data_share:
+                if rng.random() < byte_share:
+                    if rng.random() < 0.5:
+                        data.append(f"D{block}_{len(data)}\tBYTE\tC'{'Z' * rng.randint(1, 12)}'\n")
+                    else:
+                        data.append(f"D{block}_{len(data)}\tBYTE\tX'{'0F' * rng.randint(1, 6)}'\n")
+                else:
+                    data.append(f'D{block}_{len(data)}\tWORD\t{rng.randint(0, 4095)}\n')
+            elif rng.random() < literal_density:
+                literal += 1
+                if literal % 2:
+                    code.append(f"\tLDA\t=X'{literal:06X}'\n")
+                else:
+                    code.append(f"TD =C'L{literal}'\n")
+            elif rng.random() < format4_share:
+                target = rng.choice(externals) if len(externals) else f'L{block}' # 沒有 EXTREF 時呼叫自己的 block
+                code.append(rng.choice(['\t+LDA\tW{n}', '+STA R{n}', '\t+JSUB\t{e}']).format(n=block, e=target) + '\n')
+            else:
+                code.append(rng.choice(body).format(n=block) + '\n')
+        lines += code
+        lines += [
+            f'\tJ\tL{block + 1}\n',
+            f'W{block}\tWORD\t5\n',
+            f'B{block}\tBYTE\tC\'EOF\'\n',
+            f'R{block}\tRESW\t1\n',
+        ]
+        lines += data
+        lines.append('\tLTORG\n')
+        block += 1
+    lines += [
+        f'L{block}\tRSUB\n',
+        '\tEND\tFIRST\n',
+    ]
+    return lines
+
+# 產生一個約 line_count 行的資料表程式 (BYTE / WORD 為主，reserve_share 的比例為 RESB)，用來量測 T record 的產生
+# reserve_share = 0 時整個程式是一段沒有中斷的 T record
+def gen_data_table(line_count, seed=0, reserve_share=0.05) -> list:
+    rng = random.Random(seed)
+    lines = ['TABLE\tSTART\t0\n', 'FIRST\tLDA\t#0\n']
+    for n in range(line_count):
+        kind = rng.random()
+        if kind < 0.3:
+            lines.append(f"D{n}\tBYTE\tC'{'Z' * rng.randint(1, 12)}'\n")
+        elif kind < 0.5:
+            lines.append(f"D{n}\tBYTE\tX'{'0F' * rng.randint(1, 6)}'\n")
+        elif kind < 1 - reserve_share:
+            lines.append(f'D{n}\tWORD\t{n % 1000}\n')
+        else:
+            lines.append(f'D{n}\tRESB\t4\n')
+    lines.append('\tEND\tFIRST\n')
+    return lines
+
+# 巨集程式用的裝置讀寫迴圈 (與範例的 RDREC / WRREC 相同)，參數為裝置、緩衝區、長度
+MACRO_BODIES = {
+    'RDBUFF': ['\tCLEAR\tX\n', '\tCLEAR\tA\n', '\tCLEAR\tS\n', '\t+LDT\t#4096\n', "$LOOP\tTD\t=X'&DEV'\n",
+               '\tJEQ\t$LOOP\n', "\tRD\t=X'&DEV'\n", '\tCOMPR\tA,S\n', '\tJEQ\t$EXIT\n', '\tSTCH\t&BUF,X\n',
+               '\tTIXR\tT\n', '\tJLT\t$LOOP\n', '$EXIT\tSTX\t&LEN\n'],
+    'WRBUFF': ['\tCLEAR\tX\n', '\tLDT\t&LEN\n', "$LOOP\tTD\t=X'&DEV'\n", '\tJEQ\t$LOOP\n', '\tLDCH\t&BUF,X\n',
+               "\tWD\t=X'&DEV'\n", '\tTIXR\tT\n', '\tJLT\t$LOOP\n'],
+}
+
+# 產生 call_count 次巨集呼叫的程式 (裝置從 devices 種裡隨機選)，回傳 (使用巨集的原始碼, 手動展開的原始碼)
+def gen_macro_program(call_count, seed=0, devices=4) -> tuple:
+    rng = random.Random(seed)
+    macro_lines = ['MACROS\tSTART\t0\n']
+    for name, body in MACRO_BODIES.items():
+        macro_lines += [f'{name}\tMACRO\t&DEV,&BUF,&LEN\n'] + body + ['\tMEND\n']
+    expanded_lines = ['MACROS\tSTART\t0\n']
+    for lines in (macro_lines, expanded_lines):
+        lines += ['FIRST\tSTL\tRETADR\n', '\tLDB\t#LENGTH\n', '\tBASE\tLENGTH\n']
+    for n in range(call_count):
+        name = 'RDBUFF' if n % 2 == 0 else 'WRBUFF'
+        device = '{:02X}'.format(0xF1 + rng.randrange(devices))
+        macro_lines.append(f'\t{name}\t{device},BUFFER,LENGTH\n')
+        expanded_lines += [line.replace('&DEV', device).replace('&BUF', 'BUFFER').replace('&LEN', 'LENGTH')
+                           .replace('$', f'$M{n}') for line in MACRO_BODIES[name]]
+    for lines in (macro_lines, expanded_lines):
+        lines += ['\tJ\t@RETADR\n', '\tLTORG\n', 'RETADR\tRESW\t1\n', 'LENGTH\tRESW\t1\n', 'BUFFER\tRESB\t4096\n', '\tEND\tFIRST\n']
+    return macro_lines, expanded_lines
+
+# 產生要自動選擇格式 3/4 的程式 (list of lines) : 每一行都有 label，far_share 的指令參考約 680 行之外的 label
+# (PC 相對定址範圍的邊界附近)，其他參考 50 行以內的 label；一個指令改成格式 4 之後，跨過它的參考會變遠，
+# 可能又要再改別的指令，所以要重複分配位址好幾輪才會穩定
+# extended 為 True 時所有指令都手動加上 +，用來比較程式大小
+def gen_relax_program(line_count, seed=0, far_share=0.3, extended=False) -> list:
+    rng = random.Random(seed)
+    lines = ['RELAX\tSTART\t0\n']
+    prefix = '+' if extended else ''
+    for i in range(line_count):
+        distance = rng.randrange(670, 700) if rng.random() < far_share else rng.randrange(1, 50)
+        target = i + distance if i + distance < line_count else max(i - distance, 0)
+        lines.append(f'L{i}\t{prefix}LDA\tL{target}\n')
+    lines.append('\tEND\tL0\n')
+    return lines
+
+# 量測 pass one (包含重複分配位址直到穩定)，回傳 (秒數, 分配位址的輪數, 改成格式 4 的指令數, 程式長度 bytes)
+# 時間取 repeat 次中最快的一次
+def bench_relax(module, lines, repeat=3) -> tuple:
+    asm = module.Assembler()
+    asm.echo = False
+    best = None
+    for _ in range(repeat):
+        asm.reset()
+        instructions = list(asm.scan(lines)) # 每次重新 scan (上一次改成格式 4 的指令不能沿用)
+        start = time.perf_counter()
+        asm.pass_one(None, instructions)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    last = max((instr for instr in asm.located_instructions() if instr.location != None), key=lambda instr: instr.location)
+    size = last.location + (4 if last.mnemonic[0] == '+' else 3)
+    return best, asm.relaxation['passes'], asm.relaxation['promoted'], size
+
+# 量測巨集程式的 scanner : 使用巨集 (重複使用展開結果 / 每次重新展開) 與手動展開的原始碼，
+# 回傳 [(名稱, 秒數, 敘述數)]，以及巨集處理器的統計 (取 repeat 次中最快的一次)
+def bench_macros(module, macro_lines, expanded_lines, repeat=3) -> tuple:
+    asm = module.Assembler()
+    asm.echo = False
+    results = []
+    for label, lines, memoize in (('macro (memoized)', macro_lines, True), ('macro (re-expand)', macro_lines, False),
+                                  ('hand-expanded', expanded_lines, True)):
+        best = None
+        for _ in range(repeat):
+            asm.reset()
+            asm.macro_processor.memoize = memoize
+            start = time.perf_counter()
+            count = sum(1 for _ in asm.scan(lines))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+        if memoize and lines is macro_lines:
+            stats = dict(asm.macro_processor.stats)
+        results.append((label, best, count))
+    return results, stats
+
+# 量測 scanner (lexer) 的吞吐量，回傳 lines/second (取 repeat 次中最快的一次)
+# 還沒有 scan() 的舊版 assembler (--compare) 只有 scanner(檔名)，先把程式寫到暫存檔再量 scanner()，包含讀檔的時間
+def bench_scan(module, lines, repeat=3) -> float:
+    asm = module.Assembler()
+    asm.echo = False
+    if not hasattr(asm, 'scan'):
+        return bench_scan_file(module, lines, repeat)
+    best = None
+    for _ in range(repeat):
+        asm.reset()
+        start = time.perf_counter()
+        for _ in asm.scan(lines):
+            pass
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return len(lines) / best
+
+def bench_scan_file(module, lines, repeat=3) -> float:
+    best = None
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'source.txt')
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        for _ in range(repeat):
+            asm = module.Assembler() # 舊版沒有 reset()，每次用新的 instance
+            with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+                start = time.perf_counter()
+                asm.scanner(path)
+                elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+    return len(lines) / best
+
+# 量測產生 object program (pass two + gen_object_program，主要是 T record) 的吞吐量，回傳 lines/second (取 repeat 次中最快的一次)
+# T record 在 pass two 邊產生 object code 邊累積，所以 pass two 也要算在裡面；每次都重新 pass one (不計時)
+def bench_output(module, lines, repeat=3) -> float:
+    asm = module.Assembler()
+    asm.echo = False
+    best = None
+    for _ in range(repeat):
+        asm.reset()
+        asm.pass_one(None, asm.scan(lines))
+        start = time.perf_counter()
+        asm.pass_two()
+        asm.gen_object_program()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return len(lines) / best
+
+# 量測 linking loader : 先組譯多區塊程式，再量測 link_programs() 每秒處理的程式區塊數 (取 repeat 次中最快的一次)
+def bench_link(module, lines, repeat=3) -> tuple:
+    asm = module.Assembler()
+    asm.echo = False
+    program = asm.assemble(''.join(lines))
+    if not program.ok:
+        raise RuntimeError('synthetic program does not assemble: ' + '; '.join(program.errors[:3]))
+    sections = program.binary_sections()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = module.link_programs([sections], 0x4000)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    if len(result['errors']):
+        raise RuntimeError('link errors: ' + '; '.join(result['errors'][:3]))
+    return len(sections) / best, len(sections)
+
+# 分別量測每個階段 : scan、pass_one、pass_two、gen_object_program、write_object_program (寫到暫存檔，不印出)
+# 時間取 repeat 次中最快的一次；另外再用 tracemalloc 跑一次量測每個階段的峰值記憶體 (不影響時間)
+# 回傳 [(階段名稱, 秒數, lines/second, 峰值 bytes), ...]
+PHASES = ('scan', 'pass_one', 'pass_two', 'gen_object_program', 'write_object_program')
+
+def bench_phases(module, lines, repeat=3) -> list:
+    asm = module.Assembler()
+    asm.echo = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        output_file = os.path.join(work_dir, 'output.txt')
+        def run_phases(measure):
+            asm.reset()
+            instructions = measure('scan', lambda: list(asm.scan(lines)))
+            measure('pass_one', lambda: asm.pass_one(None, instructions))
+            measure('pass_two', asm.pass_two)
+            if len(asm.errors):
+                raise RuntimeError('synthetic program does not assemble: ' + '; '.join(asm.errors[:3]))
+            program = measure('gen_object_program', asm.gen_object_program)
+            with open(os.devnull, mode='w') as devnull, contextlib.redirect_stdout(devnull): # write_object_program 會印出 records
+                measure('write_object_program', lambda: asm.write_object_program(output_file, program))
+
+        best = {}
+        def measure_time(phase, run):
+            start = time.perf_counter()
+            result = run()
+            elapsed = time.perf_counter() - start
+            best[phase] = min(best.get(phase, elapsed), elapsed)
+            return result
+        for _ in range(repeat):
+            run_phases(measure_time)
+
+        peaks = {}
+        def measure_memory(phase, run):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            result = run()
+            peaks[phase] = tracemalloc.get_traced_memory()[1] - base
+            return result
+        tracemalloc.start()
+        try:
+            run_phases(measure_memory)
+        finally:
+            tracemalloc.stop()
+    return [(phase, best[phase], len(lines) / best[phase], peaks[phase]) for phase in PHASES]
+
+# 病態的情況 : 每個 LTORG 有很多 literal、很長的沒有中斷的 T record、大量 CSECT 與 EXTREF
+def pathological_cases(line_count, seed=0) -> list:
+    return [
+        ('literals', gen_simple_program(line_count, seed, literal_density=1.0, block_size=300)),
+        ('long-text', gen_data_table(line_count, seed, reserve_share=0)),
+        ('extref', gen_simple_program(line_count, seed, sections=max(2, line_count // 200), extref_fanout=64, format4_share=0.8)),
+    ]
+
+# 量測組譯 (scan + pass one + pass two) 之後每一行原始碼留在記憶體裡的大小
+# spill_file 是 pass one 的中間檔 (None 表示 pass one 寫在沒有檔名的暫存檔，與 asm.assemble() 相同)
+# 回傳 (保留的 bytes/line, 峰值 bytes/line)，用 tracemalloc 量測 (會比平常慢好幾倍)
+def bench_memory(module, lines, spill_file=None) -> tuple:
+    asm = module.Assembler()
+    asm.echo = False
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    try:
+        asm.pass_one(spill_file, asm.scan(lines))
+        asm.pass_two()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (current - base) / len(lines), (peak - base) / len(lines)
+
+# 把程式加上 comment 寫到 path : comment_share 的行後面接 comment，另外在前面插入同樣比例的整行 comment
+def write_commented_source(path, lines, seed=0, comment_share=0.3) -> int:
+    rng = random.Random(seed)
+    with open(path, mode='w') as f:
+        for line in lines:
+            if rng.random() < comment_share:
+                f.write('.       ' + 'read a record into the buffer and check the device status ' * 2 + '\n')
+            if rng.random() < comment_share:
+                line = line.rstrip('\n') + '\t. trailing comment about this statement\n'
+            f.write(line)
+    return os.path.getsize(path)
+
+# 比較讀取原始碼檔案的方式 : readlines()、read_source() (文字模式逐行讀取) 與三種用 mmap 讀 bytes 的方式
+# (README 裡不採用 mmap 讀檔的數字用這裡重現) :
+#   mmap lines   逐行 mm.readline()，在 bytes 上切掉 comment 再解碼 (Python 迴圈)
+#   mmap regex   一個 bytes regex 在整個 mmap 上 finditer，每行只解碼 comment 之前的部分
+#   mmap chunks  每次取約 1 MB (切在換行)，bytes regex 一次刪掉所有 comment (C 實作)，整塊解碼後再 splitlines
+# 分別量測只讀檔 (逐行走過) 與讀檔 + scanner (產生的指令物件直接丟掉) 的時間，取 repeat 次中最快的一次，
+# 峰值記憶體另外用 tracemalloc 跑一次讀檔 + scanner，
+# 以及把所有行做成 list 佔用的記憶體 (增量 / 平行組譯與 watch mode 會保留整個原始碼的 list)
+# 回傳 [(名稱, 讀檔秒數, 讀檔 + scanner 秒數, 峰值 bytes, list bytes)]
+MMAP_LINE = re.compile(rb'([^.\n]*)[^\n]*\n?')
+MMAP_COMMENT = re.compile(rb'\.[^\n]*')
+
+def bench_read(module, path, repeat=3) -> list:
+    def readlines():
+        with open(path, mode='r') as f:
+            return f.readlines()
+    def mmap_lines():
+        with open(path, mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                yield line.partition(b'.')[0].decode()
+    def mmap_regex():
+        with open(path, mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for match in MMAP_LINE.finditer(mm):
+                if match.end() == match.start(): # 檔案結尾的空字串
+                    break
+                yield match.group(1).decode()
+    def mmap_chunks(size=1024 * 1024):
+        with open(path, mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < len(mm):
+                end = mm.find(b'\n', start + size)
+                end = len(mm) if end == -1 else end + 1
+                yield from MMAP_COMMENT.sub(b'', mm[start:end]).decode().splitlines(True)
+                start = end
+    asm = module.Assembler()
+    asm.echo = False
+    def best_of(run):
+        best = None
+        for _ in range(repeat):
+            asm.reset()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+        return best
+    results = []
+    for label, source in (('readlines', readlines), ('read_source', lambda: module.read_source(path)),
+                          ('mmap lines', mmap_lines), ('mmap regex', mmap_regex), ('mmap chunks', mmap_chunks)):
+        read = best_of(lambda: sum(1 for _ in source()))
+        scan = best_of(lambda: sum(1 for _ in asm.scan(source())))
+        asm.reset()
+        tracemalloc.start()
+        try:
+            sum(1 for _ in asm.scan(source()))
+            peak = tracemalloc.get_traced_memory()[1]
+            base = tracemalloc.get_traced_memory()[0]
+            lines = list(source())
+            retained = tracemalloc.get_traced_memory()[0] - base
+            del lines
+        finally:
+            tracemalloc.stop()
+        results.append((label, read, scan, peak, retained))
+    return results
+
+# 量測寫組譯列表的負擔 : 用 execute() 完整組譯 path (寫 object program，不寫中間檔)，有 / 沒有 listing_file 各跑 repeat 次
+# 取最快的一次，回傳 (沒有列表的秒數, 有列表的秒數, 列表檔大小 bytes)；execute() 印出的 records 丟掉
+def bench_listing(module, path, repeat=3) -> tuple:
+    directory = os.path.dirname(path)
+    results = []
+    for listing_file in (None, os.path.join(directory, 'listing.txt')):
+        best = None
+        for _ in range(repeat):
+            asm = module.Assembler()
+            asm.echo = False
+            asm.listing_file = listing_file
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                ok = asm.execute(path, os.path.join(directory, 'output.txt'), None)
+            elapsed = time.perf_counter() - start
+            if not ok:
+                raise RuntimeError('synthetic program does not assemble: ' + '; '.join(asm.errors[:3]))
+            best = elapsed if best == None else min(best, elapsed)
+        results.append(best)
+    return results[0], results[1], os.path.getsize(os.path.join(directory, 'listing.txt'))
+
+# 比較同一份多區塊程式用 assemble() (依序) 與 assemble_parallel() (jobs 個 worker) 組譯的時間，
+# 回傳 (依序秒數, 平行秒數, 一律平行的秒數)；平行秒數包含區塊太小或只有一個核心時改成依序組譯的判斷 (見 PARALLEL_MIN_SECTION_SIZE)，
+# 一律平行 (min_section_size=0) 用來看 process 之間傳送的成本
+# pool 只建立一次並先暖身，不算進時間；結果必須完全相同
+def bench_parallel(module, lines, jobs=None, repeat=3) -> tuple:
+    source = ''.join(lines)
+    asm = module.Assembler()
+    asm.echo = False
+    with module.ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1, initializer=module._init_section_worker) as pool:
+        expected = asm.assemble(source)
+        if not expected.ok:
+            raise RuntimeError('synthetic program does not assemble: ' + '; '.join(expected.errors[:3]))
+        expected = expected.to_text()
+        runs = (lambda: asm.assemble(source), lambda: asm.assemble_parallel(source, jobs, pool),
+                lambda: asm.assemble_parallel(source, jobs, pool, min_section_size=0))
+        for run in runs[1:]:
+            if run().to_text() != expected:
+                raise RuntimeError('parallel output differs from the sequential output')
+        best = [None] * len(runs)
+        for _ in range(repeat):
+            for slot, run in enumerate(runs):
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                best[slot] = elapsed if best[slot] == None else min(best[slot], elapsed)
+    return tuple(best)
+
+# 用模擬器執行附的 COPY 範例 : 從裝置 F1 讀 records 次記錄 (每筆 record_size bytes，以 0 結尾)，寫到裝置 05
+# 回傳 (instructions/s, 執行的指令數)，取 repeat 次中最快的一次；輸出必須與 COPY 的行為相同
+def bench_simulator(module, records=2000, record_size=60, repeat=3) -> tuple:
+    with open(COPY_FILE, mode='r') as f:
+        source = f.read()
+    asm = module.Assembler()
+    asm.echo = False
+    program = asm.assemble(source)
+    if not program.ok:
+        raise RuntimeError('COPY sample does not assemble: ' + '; '.join(program.errors[:3]))
+    data = b''.join(bytes((65 + n % 26,)) * record_size + b'\0' for n in range(records))
+    # COPY 的 WRREC 用 LDCH BUFFER (沒有 X)，所以每筆記錄會輸出 record_size 次第一個字元，最後輸出 'EOF' 的 3 個 'E'
+    expected = b''.join(bytes((65 + n % 26,)) * record_size for n in range(records)) + b'EEE'
+    best = None
+    with tempfile.TemporaryDirectory() as device_dir:
+        for _ in range(repeat):
+            with open(os.path.join(device_dir, 'F1.dev'), mode='wb') as f:
+                f.write(data)
+            simulator = module.Simulator(device_dir=device_dir)
+            simulator.load(program)
+            start = time.perf_counter()
+            try:
+                reason = simulator.run()
+            finally:
+                simulator.close()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best == None else min(best, elapsed)
+            with open(os.path.join(device_dir, '05.dev'), mode='rb') as f:
+                if reason != 'halt' or f.read() != expected:
+                    raise RuntimeError(f'COPY sample did not run correctly (stop: {reason})')
+    return simulator.steps / best, simulator.steps
+
+# 比較用 daemon 組譯 COPY 範例與每次啟動新的 assembler process 的延遲，回傳 (daemon 每個要求的毫秒數, 每次啟動 process 的毫秒數)
+# daemon 用一個 worker 在暫存資料夾的 socket 上執行，量測完送 shutdown 結束
+def bench_daemon(requests=200, runs=10) -> tuple:
+    client = load_assembler(CLIENT_FILE, 'sic_xe_client')
+    with open(COPY_FILE, mode='r') as f:
+        source = f.read()
+    with tempfile.TemporaryDirectory() as work_dir:
+        socket_path = os.path.join(work_dir, 'daemon.sock')
+        daemon = subprocess.Popen([sys.executable, ASSEMBLER_FILE, '--daemon', socket_path, '-j', '1'], stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(100): # 等 daemon 開始 listen
+                try:
+                    client.request_daemon([{'command': 'ping'}], socket_path)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            start = time.perf_counter()
+            for response in client.request_daemon([{'source': source}] * requests, socket_path):
+                if not response['ok']:
+                    raise RuntimeError('daemon failed: ' + '; '.join(response['errors'][:3]))
+            daemon_ms = (time.perf_counter() - start) * 1000 / requests
+            client.request_daemon([{'command': 'shutdown'}], socket_path)
+            daemon.wait(timeout=30)
+        finally:
+            if daemon.poll() == None:
+                daemon.kill()
+        start = time.perf_counter()
+        for _ in range(runs):
+            subprocess.run([sys.executable, ASSEMBLER_FILE, COPY_FILE, '--no-intermediate'], cwd=work_dir,
+                           stdout=subprocess.DEVNULL, check=True)
+        process_ms = (time.perf_counter() - start) * 1000 / runs
+    return daemon_ms, process_ms
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=100000, help='synthetic program size')
+    parser.add_argument('--compare', default=None, help='another assembler file to benchmark (e.g. an older version)')
+    parser.add_argument('--memory', action='store_true', help='measure per-line memory after pass one / pass two')
+    parser.add_argument('--memory-lines', type=int, default=1000000, help='synthetic program size for --memory')
+    parser.add_argument('--output', action='store_true', help='measure object program (T record) generation on a data table')
+    parser.add_argument('--link', action='store_true', help='measure the linking loader on a program with --sections control sections')
+    parser.add_argument('--parallel', action='store_true', help='compare sequential and per-control-section parallel assembly')
+    parser.add_argument('--simulate', action='store_true', help='measure the simulator (instructions/s) on the bundled COPY sample')
+    parser.add_argument('--macros', action='store_true', help='scan a macro-heavy program (--lines macro calls) against the hand-expanded source')
+    parser.add_argument('--relax', action='store_true', help='pass one on a program whose format 3/4 choice needs several relaxation passes')
+    parser.add_argument('--read', action='store_true', help='compare reading a commented source file with readlines(), read_source() and mmap bytes readers')
+    parser.add_argument('--listing', action='store_true', help='cost of writing the assembly listing during a full assembly (execute)')
+    parser.add_argument('--daemon', action='store_true', help='compare daemon requests with starting a new assembler process (COPY sample)')
+    parser.add_argument('--phases', action='store_true', help='time scan / pass one / pass two / object program separately (with peak memory)')
+    parser.add_argument('--pathological', action='store_true', help='--phases on pathological programs (many literals per LTORG, long T records, many EXTREF)')
+    parser.add_argument('--literal-density', type=float, default=0.2, help='--phases program: share of instructions using a literal')
+    parser.add_argument('--extref-fanout', type=int, default=1, help='--phases program: EXTREF symbols per control section')
+    parser.add_argument('--data-share', type=float, default=0.1, help='--phases program: share of BYTE / WORD lines')
+    parser.add_argument('--byte-share', type=float, default=0.5, help='--phases program: share of BYTE among the data lines')
+    parser.add_argument('--format4-share', type=float, default=0.1, help='--phases program: share of format 4 instructions')
+    parser.add_argument('--sections', type=int, default=48, help='control sections in the --parallel / --link / --phases program')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes for --parallel (default: 1, 2, 4 and all cores)')
+    args = parser.parse_args()
+    compare_file = os.path.abspath(args.compare) if args.compare != None else None
+
+    os.chdir(BASE_DIR) # 舊版的 assembler (--compare) 需要在 opCode.txt 同路徑下執行
+    lines = gen_simple_program(args.lines)
+    current = load_assembler()
+    print(f'scanner  : {bench_scan(current, lines):12,.0f} lines/s  ({len(lines)} lines)')
+    other = load_assembler(compare_file, 'sic_xe_compare') if compare_file != None else None
+    if other != None:
+        print(f'compare  : {bench_scan(other, lines):12,.0f} lines/s  ({args.compare})')
+    if args.memory:
+        lines = gen_simple_program(args.memory_lines)
+        with tempfile.TemporaryDirectory() as work_dir:
+            spill_file = os.path.join(work_dir, 'intermediate.bin')
+            for label, module, spill in (('temp', current, None), ('file', current, spill_file), ('compare', other, None)):
+                if module == None:
+                    continue
+                if not hasattr(module.Assembler, 'scan'):
+                    print(f'{label:<8s} : skipped (no Assembler.scan(), needs a version with the streaming scanner)')
+                    continue
+                retained, peak = bench_memory(module, lines, spill)
+                print(f'{label:<8s} : {retained:8.1f} bytes/line retained, {peak:8.1f} bytes/line peak  ({len(lines)} lines)')
+    if args.output:
+        lines = gen_data_table(args.lines)
+        for label, module in (('output', current), ('compare', other)):
+            if module != None and not hasattr(module.Assembler, 'scan'):
+                print(f'{label:<8s} : skipped (no Assembler.scan(), needs a version with the streaming scanner)')
+            elif module != None:
+                print(f'{label:<8s} : {bench_output(module, lines):12,.0f} lines/s  (object program, {len(lines)} lines data table)')
+    if args.link:
+        rate, count = bench_link(current, gen_simple_program(args.lines, sections=args.sections))
+        print(f'link     : {rate:12,.0f} sections/s  ({count} control sections)')
+    if args.parallel:
+        lines = gen_simple_program(args.lines, sections=args.sections)
+        print(f'parallel : {args.sections} sections, {len(lines)} lines, {os.cpu_count()} cores')
+        for jobs in ([args.jobs] if args.jobs != None else sorted({1, 2, 4, os.cpu_count() or 1})):
+            sequential, parallel, forced = bench_parallel(current, lines, jobs)
+            print(f'  -j {jobs:<3d} {sequential:8.3f} s sequential, {parallel:8.3f} s parallel ({sequential / parallel:.2f}x), '
+                  f'{forced:8.3f} s always parallel ({sequential / forced:.2f}x)')
+    if args.simulate:
+        rate, steps = bench_simulator(current)
+        print(f'simulate : {rate:12,.0f} instructions/s  ({steps} instructions, COPY sample)')
+    if args.phases or args.pathological:
+        cases = []
+        if args.phases:
+            cases.append(('synthetic', gen_simple_program(args.lines, sections=args.sections, literal_density=args.literal_density,
+                                                          extref_fanout=args.extref_fanout, data_share=args.data_share,
+                                                          byte_share=args.byte_share, format4_share=args.format4_share)))
+        if args.pathological:
+            cases += pathological_cases(args.lines)
+        for label, lines in cases:
+            print(f'phases   : {label} ({len(lines)} lines)')
+            for phase, elapsed, rate, peak in bench_phases(current, lines):
+                print(f'  {phase:<20s} {elapsed:8.3f} s {rate:12,.0f} lines/s {peak / 1024 / 1024:8.1f} MB peak')
+    if args.macros:
+        macro_lines, expanded_lines = gen_macro_program(args.lines // 10)
+        results, stats = bench_macros(current, macro_lines, expanded_lines)
+        print(f"macros   : {len(macro_lines)} source lines, {len(expanded_lines)} hand-expanded lines, "
+              f"{stats['expansions']} expansions ({stats['reused']} reused)")
+        for label, elapsed, count in results:
+            print(f'  {label:<20s} {elapsed:8.3f} s {count / elapsed:12,.0f} statements/s')
+    if args.relax:
+        print(f'relax    : {args.lines} instructions')
+        for label, relax_lines in (('near only', gen_relax_program(args.lines, far_share=0)),
+                                   ('30% far', gen_relax_program(args.lines)),
+                                   ('all +', gen_relax_program(args.lines, extended=True))):
+            elapsed, passes, promoted, size = bench_relax(current, relax_lines)
+            print(f'  {label:<20s} {elapsed:8.3f} s pass one {passes:4d} passes {promoted:8d} promoted {size:10,d} bytes')
+    if args.read:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'source.txt')
+            size = write_commented_source(path, gen_simple_program(args.lines))
+            print(f'read     : {size / 1024 / 1024:.1f} MB source with comments')
+            for label, read, scan, peak, retained in bench_read(current, path):
+                print(f'  {label:<20s} {read:8.3f} s read {scan:8.3f} s read + scan {peak / 1024 / 1024:8.1f} MB peak '
+                      f'{retained / 1024 / 1024:8.1f} MB as list')
+    if args.listing:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'source.txt')
+            with open(path, mode='w') as f:
+                f.writelines(gen_simple_program(args.lines))
+            plain, listed, size = bench_listing(current, path)
+            print(f'listing  : {plain:8.3f} s without, {listed:8.3f} s with listing (+{(listed / plain - 1) * 100:.1f}%, '
+                  f'{size / 1024 / 1024:.1f} MB listing, {args.lines} lines)')
+    if args.daemon:
+        daemon_ms, process_ms = bench_daemon()
+        print(f'daemon   : {daemon_ms:8.2f} ms/request, new process {process_ms:8.2f} ms/run ({process_ms / daemon_ms:.0f}x, COPY sample)')
@@ -0,0 +1,98 @@
+########################################################################
+# SIC XE assembler client
+# 把原始碼送給常駐的 assembler daemon (108213053王念祖_SIC_XE.py --daemon) 組譯
+# 只使用 socket / json，不載入 assembler 本身，所以啟動很快 (適合編輯器或 CI 頻繁呼叫)
+#########################################################################
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+
+# 與 108213053王念祖_SIC_XE.py 的 DAEMON_SOCKET 相同 (只有自己能存取的資料夾裡)
+DAEMON_DIR = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(), f'sicxe-{os.getuid() if hasattr(os, "getuid") else 0}')
+DAEMON_SOCKET = os.path.join(DAEMON_DIR, 'daemon.sock')
+
+# 連線到 daemon，依序送出每個要求 (dict) 並等它的回應，回傳回應的 list (協定見 assembler 的 serve_daemon)
+def request_daemon(requests, socket_path=DAEMON_SOCKET, timeout=None) -> list:
+    responses = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        with connection.makefile('rb') as stream:
+            for request in requests:
+                connection.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+                line = stream.readline()
+                if line == b'':
+                    raise ConnectionError('daemon closed the connection')
+                responses.append(json.loads(line))
+    return responses
+
+# 輸出檔名與 assembler 相同 : 一個檔案時為 108213053王念祖_output.txt，多個檔案時為 <檔名>_output.txt (-o 指定資料夾)
+def output_name(read_file, single, out_dir=None) -> str:
+    if single:
+        return os.path.join(out_dir or '.', '108213053王念祖_output.txt')
+    stem = os.path.splitext(read_file)[0]
+    if out_dir != None:
+        stem = os.path.join(out_dir, os.path.basename(stem))
+    return stem + '_output.txt'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_file', nargs='*', help='SIC/XE source file(s)')
+    parser.add_argument('-s', '--socket', default=DAEMON_SOCKET, help=f'daemon socket (default: {DAEMON_SOCKET})')
+    parser.add_argument('-o', '--out-dir', default=None, help='output directory')
+    parser.add_argument('--json', action='store_true', help='print the daemon responses as JSON lines instead of writing files')
+    parser.add_argument('--stats', action='store_true', help='ask for per-phase statistics (use with --json)')
+    parser.add_argument('--ping', action='store_true', help='check that the daemon is running')
+    parser.add_argument('--shutdown', action='store_true', help='stop the daemon')
+    args = parser.parse_args()
+
+    requests = []
+    for read_file in args.input_file:
+        try:
+            with open(read_file, mode='r') as f:
+                requests.append({'id': read_file, 'source': f.read(), 'stats': args.stats})
+        except (IOError, UnicodeDecodeError) as e:
+            print(f'ERROR: can not read {read_file} ({e})')
+            sys.exit(1)
+    if args.ping:
+        requests.insert(0, {'command': 'ping'})
+    if args.shutdown:
+        requests.append({'command': 'shutdown'})
+    if len(requests) == 0:
+        parser.error('nothing to do: give input files, --ping or --shutdown')
+    if not args.json: # 輸出檔名相同的原始檔 (例如 -o 時的 a/prog.txt 與 b/prog.txt) 直接報錯，與 assembler 的批次模式相同
+        owners = {}
+        for read_file in args.input_file:
+            owners.setdefault(os.path.abspath(output_name(read_file, len(args.input_file) == 1, args.out_dir)), []).append(read_file)
+        collisions = [files for files in owners.values() if len(files) > 1]
+        for files in collisions:
+            print(f"ERROR: {', '.join(files)} would all write {output_name(files[0], False, args.out_dir)}")
+        if len(collisions):
+            sys.exit(1)
+    if args.out_dir != None and not args.json:
+        os.makedirs(args.out_dir, exist_ok=True)
+    try:
+        responses = request_daemon(requests, args.socket)
+    except (OSError, ValueError) as e:
+        print(f'ERROR: can not talk to the daemon at {args.socket} ({e})')
+        sys.exit(1)
+
+    failed = 0
+    for request, response in zip(requests, responses):
+        if args.json:
+            print(json.dumps(response, ensure_ascii=False))
+        elif 'source' not in request:
+            print(f"{request['command']} : {'ok' if response['ok'] else 'failed'}")
+        elif response['ok']:
+            with open(output_name(request['id'], len(args.input_file) == 1, args.out_dir), mode='w') as f:
+                f.write(response['object_program'])
+        else:
+            print(f"\n[FAILED] {request['id']}")
+            for reason in response['errors']:
+                print(f'    {reason}')
+        failed += not response['ok']
+    if failed:
+        sys.exit(1)
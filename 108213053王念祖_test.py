@@ -0,0 +1,776 @@
+########################################################################
+# SIC XE assembler 回歸測試
+# 執行 : python -m unittest 108213053王念祖_test.py (或 python -m pytest 108213053王念祖_test.py)
+#########################################################################
+import os
+import json
+import sys
+import socket
+import tempfile
+import unittest
+import unittest.mock
+import contextlib
+import importlib.util
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSEMBLER_FILE = os.path.join(BASE_DIR, '108213053王念祖_SIC_XE.py')
+
+# 檔名不是合法的 module 名稱，所以用檔案路徑載入
+spec = importlib.util.spec_from_file_location('sic_xe', ASSEMBLER_FILE)
+sic_xe = importlib.util.module_from_spec(spec)
+sys.modules['sic_xe'] = sic_xe
+spec.loader.exec_module(sic_xe)
+spec = importlib.util.spec_from_file_location('sic_xe_client', os.path.join(BASE_DIR, '108213053王念祖_client.py'))
+client = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(client)
+
+# LDA FAR 超出 PC / BASE 相對定址範圍，pass one 會自動改成 +LDA 重新分配位址
+FAR_REFERENCE = [
+    'COPY     START   0\n',
+    'FIRST    LDA     FAR\n',
+    'BUFFER   RESB    5000\n',
+    'FAR      WORD    1\n',
+    '         END     FIRST\n',
+]
+
+class RelaxationTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+
+    def test_promotion(self):
+        program = self.asm.assemble(FAR_REFERENCE)
+        self.assertTrue(program.ok, program.errors)
+        self.assertEqual(self.asm.relaxation['promoted'], 1)
+
+    # pass one 每一輪都寫中間檔，pass two 從中間檔讀 : 不保留指令物件，只跑 pass two 的結果相同
+    def test_promotion_spilled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'inter.bin')
+            program = self.asm.assemble(FAR_REFERENCE, path)
+            self.assertTrue(program.ok, program.errors)
+            self.assertEqual(self.asm.instruction, [])
+            self.assertEqual(os.listdir(directory), ['inter.bin'])
+            self.assertIn('+LDA', [record[1] for record in sic_xe.read_intermediate(path)])
+            again = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+            self.assertTrue(again.pass_two_from_intermediate(path), again.errors)
+            self.assertEqual(again.gen_object_program().to_text(), program.to_text())
+
+    # 沒給中間檔時寫在沒有檔名的暫存檔 (不放在記憶體裡)，pass two 之後還能讀，reset() 時關掉
+    def test_promotion_spilled_to_temp_file(self):
+        program = self.asm.assemble(FAR_REFERENCE)
+        self.assertTrue(program.ok, program.errors)
+        spilled = self.asm._Assembler__spilled
+        self.assertTrue(hasattr(spilled, 'fileno'))
+        self.assertIn('+LDA', [instr.mnemonic for instr in self.asm.located_instructions()])
+        self.asm.reset()
+        self.assertTrue(spilled.closed)
+
+    # scanner 的報錯發生在第一輪讀 generator 的時候，改成格式 4 重新分配位址後不能被丟掉
+    def test_scanner_error_with_promotion(self):
+        source = FAR_REFERENCE[:2] + ['         RESB    10\n'] + FAR_REFERENCE[2:]
+        program = self.asm.assemble(source)
+        self.assertFalse(program.ok)
+        self.assertEqual(self.asm.relaxation['promoted'], 1)
+        self.assertTrue(any(reason.startswith('line 3') for reason in program.errors), program.errors)
+
+    def test_scanner_error_with_promotion_execute(self):
+        source = FAR_REFERENCE[:2] + ['         BAE     FAR\n'] + FAR_REFERENCE[2:]
+        with tempfile.TemporaryDirectory() as directory:
+            read_file = os.path.join(directory, 'input.txt')
+            with open(read_file, 'w') as f:
+                f.writelines(source)
+            with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+                ok = self.asm.execute(read_file, os.path.join(directory, 'output.txt'), os.path.join(directory, 'inter.txt'))
+            self.assertFalse(ok)
+            self.assertTrue(any(reason.startswith('line 3') for reason in self.asm.errors), self.asm.errors)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'output.txt')))
+
+    # EQU 的報錯每一輪都會重新計算，只保留最後一輪的一份
+    def test_equ_error_with_promotion(self):
+        source = FAR_REFERENCE[:2] + ['X        EQU     UNDEF+1\n'] + FAR_REFERENCE[2:]
+        program = self.asm.assemble(source)
+        self.assertEqual(self.asm.relaxation['promoted'], 1)
+        self.assertEqual(len(program.errors), 1, program.errors)
+
+class DiagnosticTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+
+    # column 指向出錯的 token，而不是該行開頭
+    def test_code_and_column(self):
+        self.asm.assemble(FAR_REFERENCE[:2] + ['LOOP     BAE     FAR\n'] + FAR_REFERENCE[2:])
+        diagnostic = self.asm.diagnostics[0]
+        self.assertEqual((diagnostic.code, diagnostic.line, diagnostic.column), ('E101', 3, 10))
+
+    def test_undefined_symbol(self):
+        self.asm.assemble(FAR_REFERENCE[:2] + ['X        EQU     UNDEF+1\n'] + FAR_REFERENCE[2:])
+        self.assertEqual([(d.code, d.line, d.column) for d in self.asm.diagnostics], [('E200', 3, None)])
+
+    # 格式一的指令只有 opcode，不能走到格式三 / 四的 operand 處理 (以前會變成 E999)
+    def test_format1(self):
+        program = self.asm.assemble('P START 0\nFIX\nL FLOAT\nHIO\nNORM\nSIO\nTIO\nEND P\n')
+        self.assertTrue(program.ok, program.errors)
+        self.assertIn('T 000000 06 C4 C0 F4 C8 F0 F8', program.to_text())
+
+    def test_format1_operand(self):
+        program = self.asm.assemble('P START 0\nFIX A\nEND P\n')
+        self.assertFalse(program.ok)
+        self.assertEqual({(d.code, d.line) for d in self.asm.diagnostics}, {('E102', 2)})
+
+    # --max-errors : 報錯數達到上限時停止，最後只有一個 fatal 的 E900
+    def test_max_errors(self):
+        self.asm.max_errors = 3
+        program = self.asm.assemble(['P START 0\n'] + [f'        BAE{i}    X\n' for i in range(6)] + ['        END     P\n'])
+        self.assertFalse(program.ok)
+        self.assertEqual([(d.code, d.line, d.severity) for d in self.asm.diagnostics],
+                         [('E101', 2, 'error'), ('E101', 3, 'error'), ('E101', 4, 'error'), ('E900', None, 'fatal')])
+        self.assertEqual(program.errors[-1], 'ERROR: too many errors (3), stop')
+
+    # 某個階段丟出沒有預期的例外時，記錄成 E999 (行號為正在處理的指令)，不讓 process 結束
+    def test_internal_error(self):
+        with unittest.mock.patch.object(sic_xe.TextRecordBuilder, 'add', side_effect=ZeroDivisionError('boom')):
+            program = self.asm.assemble(FAR_REFERENCE)
+        self.assertFalse(program.ok)
+        self.assertEqual([(d.code, d.line, d.severity) for d in self.asm.diagnostics], [('E999', 2, 'fatal')])
+        self.assertEqual(program.errors, ['line 2 : internal error (ZeroDivisionError: boom)'])
+        self.assertTrue(self.asm.assemble(FAR_REFERENCE).ok) # 同一個 instance 之後還能正常組譯
+
+# scanner 改用 TOKEN_PATTERN 切 token 後，每一種格式錯誤的報錯訊息都要和原本的 scanner 一字不差
+SCANNER_ERRORS = [
+    ("BUF      BYTE    C'EOF", ['line 2: Charactor format 需要單引號結尾', 'line 2: Charactor format 單引號過多(只能用兩個單引號將內容包住)']),
+    ("BUF      BYTE    C'E'OF'", ['line 2: Charactor format 單引號過多(只能用兩個單引號將內容包住)']),
+    ("BUF      BYTE    C''", ['line 2: Charartor can not be empty']),
+    ("BUF      BYTE    X'F1", ['line 2:BYTE hex format 需要單引號結尾', 'line 2:BYTE hex format 單引號過多(只能用兩個單引號將內容包住)']),
+    ("BUF      BYTE    X''", ['line 2:BYTE hex format can not be empty']),
+    ("BUF      BYTE    X'F 1'", ["line 2:BYTE hex content can't have space or tab charactor"]),
+    ("BUF      BYTE    Z'F1'", ['line 2: BYTE format error']),
+    ("         LDA     =C'EOF", ['line 2: Literal charactor format 需要單引號結尾', 'line 2: Literal charactor format 單引號過多(只能用兩個單引號將內容包住)']),
+    ("         LDA     =C''", ['line 2: literal charartor format can not be empty']),
+    ("A B     LDA     =C'EOF'", ['line 2: Literal charactor format error', 'line 2: nonexistent mnemonic or Operand format error']),
+    ("         LDA     =X'05", ['line 2: Literal hex format 需要單引號框住所有十六進制數字', 'line 2: Literal hex format 單引號過多(只能用兩個單引號將內容包住)']),
+    ("         LDA     =X''", ['line 2: literal X format can not be empty']),
+    ("         LDA     =X'0 5'", ['line 2: literal X format can not have space']),
+    ("A B C    LDA     =X'05'", ['line 2: Literal hex format error', 'line 2: 程式碼無法化成三欄式']),
+    ("         EXTDEF  A,,B", ['line 2: format error']),
+    ("A        EXTREF  B", ['line 2: format error']),
+    ("         COMPR   A,S,T", ['line 2: format 2 error', 'line 2: nonexistent mnemonic or Operand format error']),
+    ("         LDA     BUF,X,X", ['line 2: index addressing format error']),
+    ("         START   0", ['line 2: START format error ']),
+    ("LONGNAME START   0", ['line 2: "Program name must less than 6 charactors !"']),
+    ("*        LDA     BUF", ["line 2: Symbol name can't be * (Reserved word) "]),
+    ("         RSUB    A B", ['line 2: RSUB format error']),
+    ("A        WORD", ['line 2: WORD format error']),
+    ("A        B       BYTE  X'1'", ['line 2: BTYE format error']),
+    ("A        RESW    1 2", ['line 2: RESW format error']),
+    ("A        RESB", ['line 2: RESB format error', 'line 2: Operand not found']),
+    ("A        EQU     B C", ["line 2: EQU's operand format error"]),
+    ("A        FOO     B C", ['line 2: nonexistent mnemonic or Operand format error']),
+    ("A        B       FIX", ["line 2: format 1 can't have two symbol", 'line 2: Nonexistent mnemonic or Operand format error']),
+    ("A        FIX     B", ["line 2: format 1 can't have operand "]),
+    ("A        FOO     B", ['line 2: Nonexistent mnemonic or Operand format error']),
+    ("FIX      A", ['line 2: format 1 must not have operand']),
+    ("         EQU     5", ['line 2: EQU must have symbol']),
+    ("A        LDA", ['line 2: Operand not found']),
+    ("A        FOO", ['line 2: nonexistent mnemonic']),
+    ("A B C D E", ['line 2: 程式碼無法化成三欄式']),
+    ("         LDA", ['line 2: operand not found']),
+    ("         FOO", ['line 2: Nonexistent mnemonic']),
+]
+
+class ScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        self.asm.echo = False
+
+    # 掃描 COPY START 0 / line / END COPY，回傳指令集 (dict)
+    def scan(self, line):
+        return [instr.to_dict() for instr in self.asm.scan(['COPY     START   0\n', line + '\n', '         END     COPY\n'])]
+
+    def test_error_messages(self):
+        for line, errors in SCANNER_ERRORS:
+            with self.subTest(line=line):
+                self.asm.reset()
+                self.scan(line)
+                self.assertEqual(self.asm.errors, errors)
+
+    def test_start_and_end(self):
+        list(self.asm.scan(['         LDA     #1\n']))
+        self.assertEqual(self.asm.errors, ['Error: Cannot find START instruction'])
+        self.asm.reset()
+        with self.assertRaises(sic_xe.AssemblerError):
+            list(self.asm.scan(['COPY     START   0\n']))
+        self.assertEqual(self.asm.errors, ['Error: Cannot find END instruction'])
+        self.asm.reset()
+        with self.assertRaises(sic_xe.AssemblerError):
+            self.scan('         END     COPY X')
+        self.assertEqual(self.asm.errors, ['line 2: END format error'])
+
+    # 行為改變 : 引號包住的 operand 不再保留後面的空白 (以前 C'EOF' 後面的空白和 tab 也算在 operand 裡)
+    def test_quoted_operand_trailing_blanks(self):
+        self.assertEqual(self.scan("BUF      BYTE    C'EOF'   \t")[1]['operand'], "C'EOF'")
+        self.assertEqual(self.scan("         LDA     =X'05'\t\t")[1]['operand'], "=X'05'")
+        self.assertEqual(self.asm.errors, [])
+
+    # 行為改變 : EXTDEF / EXTREF / 格式二的助記憶碼要是完整的 token (以前只要出現在該行的字串裡就算)
+    def test_whole_token_keywords(self):
+        self.assertEqual(self.scan('         STA     EXTREFS')[1], {'mnemonic': 'STA', 'operand': 'EXTREFS', 'lineNum': 2})
+        self.assertEqual(self.scan('NEXTDEF  LDA     #1')[1], {'symbol': 'NEXTDEF', 'mnemonic': 'LDA', 'operand': '#1', 'lineNum': 2})
+        self.assertEqual(self.scan('         LDA     ADDRESS,X')[1], {'mnemonic': 'LDA', 'operand': ['ADDRESS', ',X'], 'lineNum': 2})
+        self.assertEqual(self.asm.errors, [])
+
+# --stats 寫出的 JSON (dashboard 依照這個格式讀)
+class StatsTest(unittest.TestCase):
+    def test_schema(self):
+        asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        asm.collect_stats = True
+        source = read_sample('108213053王念祖_input2.txt')
+        program = asm.assemble(source)
+        self.assertTrue(program.ok, program.errors)
+        stats = json.loads(json.dumps(asm.stats))
+        self.assertEqual(list(stats['phases']), ['scanner', 'pass_one', 'pass_two', 'gen_object_program'])
+        for name, phase in stats['phases'].items():
+            self.assertEqual(sorted(phase), ['allocated', 'peak', 'seconds'], name)
+            self.assertGreaterEqual(phase['seconds'], 0)
+        # scanner 與 pass one 交錯執行，記憶體都算在 pass one
+        self.assertEqual((stats['phases']['scanner']['allocated'], stats['phases']['scanner']['peak']), (None, None))
+        self.assertGreater(stats['phases']['pass_one']['peak'], 0)
+        self.assertAlmostEqual(stats['seconds'], sum(phase['seconds'] for phase in stats['phases'].values()))
+        self.assertEqual((stats['lines'], stats['instructions'], stats['literals'], stats['errors']),
+                         (len(source.splitlines()), 52, 2, 0))
+        self.assertEqual(stats['relaxation'], {'passes': 1, 'promoted': 0})
+        self.assertEqual(stats['sections'], {
+            'COPY': {'symbols': 10, 'text_records': 3, 'modification_records': 3},
+            'RDREC': {'symbols': 5, 'text_records': 2, 'modification_records': 4},
+            'WRREC': {'symbols': 3, 'text_records': 1, 'modification_records': 2},
+        })
+        self.assertEqual((stats['text_records'], stats['modification_records']), (6, 9))
+        text = program.to_text()
+        self.assertEqual((text.count('\nT '), text.count('\nM ')), (6, 9))
+
+# 重複組譯 (daemon / watch / 批次模式) 時，模組層級的表不能隨著使用者的輸入變大
+class ReuseTest(unittest.TestCase):
+    def test_literals_do_not_grow_mnemonic_table(self):
+        asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        asm.assemble(FAR_REFERENCE)
+        size = len(sic_xe.MNEMONIC_NAMES)
+        for i in range(100):
+            program = asm.assemble(FAR_REFERENCE[:2] + [f"         LDA     =X'{i:06X}'\n"] + FAR_REFERENCE[2:])
+            self.assertTrue(program.ok, program.errors)
+        self.assertEqual(len(sic_xe.MNEMONIC_NAMES), size)
+
+    def test_literal_cache_is_cleared(self):
+        asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        for i in range(100):
+            asm.assemble(FAR_REFERENCE[:2] + [f"         LDA     =X'{i:06X}'\n"] + FAR_REFERENCE[2:])
+        self.assertEqual(len(asm._Assembler__literal_cache), 1)
+
+class ExpressionTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+
+    # TOTAL、HALF 向後引用 SIZE、BUFEND
+    def test_forward_reference(self):
+        program = self.asm.assemble('P START 0\n'
+                                    'TOTAL EQU SIZE*(2+1)/4\n'
+                                    'HALF EQU (BUFEND-BUFFER)/2\n'
+                                    'LDA #TOTAL\n'
+                                    'BUFFER RESB 10\n'
+                                    'BUFEND EQU *\n'
+                                    'SIZE EQU BUFEND-BUFFER\n'
+                                    'W WORD SIZE*2-(HALF+1)\n'
+                                    'END P\n')
+        self.assertTrue(program.ok, program.errors)
+        index = self.asm.symbol_index
+        self.assertEqual([index[name][1:3] for name in ('SIZE', 'TOTAL', 'HALF', 'BUFEND')],
+                         [(10, 'absolute'), (7, 'absolute'), (5, 'absolute'), (13, 'relative')])
+        self.assertIn('T 000000 03 010007', program.to_text())
+        self.assertIn('T 00000D 03 00000E', program.to_text())
+
+    def test_circular_definition(self):
+        program = self.asm.assemble('P START 0\nA EQU B\nB EQU A\nEND P\n')
+        self.assertEqual(program.errors, ['line 2 : circular definition : A -> B -> A'])
+        self.assertEqual(self.asm.diagnostics[0].code, 'E104')
+
+    def test_relative_term_multiplied(self):
+        program = self.asm.assemble('P START 0\nA EQU B*2\nB RESW 1\nEND P\n')
+        self.assertEqual(program.errors, ["line 2 : relative term can't be multiplied or divided in expression"])
+
+    # absolute symbol 是常數 : 直接放值 (不是 PC 相對)，不產生 M record，放不下時改成格式 4
+    def test_absolute_operand(self):
+        program = self.asm.assemble('P START 0\nLDA A\nLDA A,X\nLDA @A\n+LDA A\nA EQU 13\nEND P\n')
+        self.assertTrue(program.ok, program.errors)
+        self.assertIn('T 000000 0D 03000D 03800D 02000D 0310000D', program.to_text())
+        self.assertNotIn('\nM ', program.to_text())
+        program = self.asm.assemble('P START 0\nLDA A\nA EQU 5000\nEND P\n')
+        self.assertIn('T 000000 04 03101388', program.to_text())
+        self.assertEqual(self.asm.relaxation['promoted'], 1)
+
+MACRO_PROGRAM = '''P       START   0
+RDBUFF  MACRO   &INDEV,&BUFADR,&RECLTH=LENGTH
+$LOOP   TD      =X'&INDEV'
+        JEQ     $LOOP
+        STCH    &BUFADR
+        LDA     &RECLTH
+        MEND
+FIRST   RDBUFF  F1,BUFFER
+        RDBUFF  F1,BUFFER
+        RDBUFF  BUFADR=BUFFER,INDEV=05,RECLTH=OTHER
+BUFFER  RESB    10
+LENGTH  RESW    1
+OTHER   RESW    1
+        END     FIRST
+'''
+
+class MacroTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+
+    def test_parameters(self):
+        program = self.asm.assemble(MACRO_PROGRAM)
+        self.assertTrue(program.ok, program.errors)
+        text = program.to_text()
+        # 第一次呼叫 : 依位置給參數，&RECLTH 用預設值 LENGTH (032022 => 2D)；第三次 : 參數名稱=值，&RECLTH 為 OTHER (03200D => 30)
+        self.assertIn('T 000000 1E E32031 332FFA 57201B 032022', text)
+        self.assertIn('T 00001E 06 572003 03200D', text)
+        self.assertIn('T 000034 02 F1 05', text) # =X'F1' 與 =X'05' 兩個 literal
+        self.assertEqual(self.asm.symbol_index['FIRST'][1], 0) # 呼叫的 label 變成 FIRST EQU *
+
+    # 同樣參數的第二次呼叫重複使用第一次展開的結果，但 $LOOP 每次都換成不同的名稱
+    def test_local_labels_and_memo(self):
+        program = self.asm.assemble(MACRO_PROGRAM)
+        self.assertTrue(program.ok, program.errors)
+        labels = sorted(name for name in self.asm.symbol_index if name.startswith('$'))
+        self.assertEqual(labels, ['$AALOOP', '$ABLOOP', '$ACLOOP'])
+        stats = self.asm.macro_processor.stats
+        self.assertEqual((stats['definitions'], stats['expansions'], stats['reused']), (1, 3, 1))
+        self.asm.macro_processor.memoize = False
+        self.assertEqual(self.asm.assemble(MACRO_PROGRAM).to_text(), program.to_text())
+        self.assertEqual(self.asm.macro_processor.stats['reused'], 0)
+
+    def test_reserved_name(self):
+        program = self.asm.assemble('P START 0\nLDA MACRO &A\nMEND\nEND P\n')
+        self.assertEqual(program.errors, ['line 2 : macro name LDA 不能與保留字同名'])
+        self.assertEqual(self.asm.diagnostics[0].code, 'E140')
+        self.assertNotIn('LDA', self.asm.macro_processor.macros)
+
+def read_sample(name):
+    with open(os.path.join(BASE_DIR, name)) as f:
+        return f.read()
+
+class LinkerTest(unittest.TestCase):
+    def setUp(self):
+        program = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(read_sample('108213053王念祖_input2.txt'))
+        self.assertTrue(program.ok, program.errors)
+        self.sections = sic_xe.parse_object_text(program.to_text())
+
+    # COPY 與 RDREC / WRREC 當成兩個 object program 載入到 4000
+    def test_link_two_programs(self):
+        result = sic_xe.link_programs([self.sections[:1], self.sections[1:]], 0x4000)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['sections'], [('COPY', 0x4000, 0x1033), ('RDREC', 0x5033, 0x2B), ('WRREC', 0x505E, 0x1C)])
+        self.assertEqual(result['estab']['BUFFER'], 0x4033)
+        self.assertEqual(result['estab']['LENGTH'], 0x402D)
+        self.assertEqual(result['entry'], 0x4000)
+        image = result['image']
+
+        def field(address, size):
+            return image[address - 0x4000:address - 0x4000 + size].hex().upper()
+        self.assertEqual(field(0x4003, 4), '4B105033') # COPY : +JSUB RDREC
+        self.assertEqual(field(0x4010, 4), '4B10505E') # COPY : +JSUB WRREC
+        self.assertEqual(field(0x5033 + 0x17, 4), '57904033') # RDREC : +STCH BUFFER,X
+        self.assertEqual(field(0x5033 + 0x20, 4), '1310402D') # RDREC : +STX LENGTH
+        self.assertEqual(field(0x5033 + 0x28, 3), '001000') # RDREC : WORD BUFEND-BUFFER
+        self.assertEqual(field(0x505E + 0x02, 4), '7710402D') # WRREC : +LDT LENGTH
+
+    def test_undefined_extref(self):
+        result = sic_xe.link_programs([self.sections[:1]], 0x4000)
+        self.assertEqual(result['errors'], ['undefined external symbol RDREC (COPY)', 'undefined external symbol WRREC (COPY)'])
+        self.assertEqual(result['image'][3:7].hex().upper(), '4B100000') # 找不到的外部符號不修改
+
+# 四個程式區塊 : 主程式呼叫 SUB1 ~ SUB3
+FOUR_SECTIONS = ('MAIN     START   0\n'
+                 '         EXTREF  SUB1,SUB2,SUB3\n'
+                 'FIRST    +JSUB   SUB1\n'
+                 '         +JSUB   SUB2\n'
+                 '         +JSUB   SUB3\n'
+                 "         LDA     =C'EOF'\n"
+                 '         LTORG\n'
+                 'SUB1     CSECT\n'
+                 '         LDA     #1\n'
+                 '         RSUB\n'
+                 'SUB2     CSECT\n'
+                 '         LDA     #2\n'
+                 '         RSUB\n'
+                 'SUB3     CSECT\n'
+                 '         LDA     #3\n'
+                 '         RSUB\n'
+                 '         END     FIRST\n')
+
+class IncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        self.asm.echo = False
+
+    def assemble(self, source, cache):
+        program = self.asm.assemble_incremental(source, cache)
+        expected = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(source)
+        self.assertTrue(program.ok, program.errors)
+        self.assertEqual(program.to_text(), expected.to_text())
+        return dict(self.asm.cache_stats)
+
+    # 只改 SUB2 : 其他三個區塊直接用 cache，結果與 assemble() 相同
+    def test_edit_one_section(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = sic_xe.SectionCache(directory)
+            self.assertEqual(self.assemble(FOUR_SECTIONS, cache), {'sections': 4, 'reused': 0})
+            self.assertEqual(self.assemble(FOUR_SECTIONS, cache), {'sections': 4, 'reused': 4})
+            edited = FOUR_SECTIONS.replace('LDA     #2\n', 'LDA     #9\n         ADD     #1\n')
+            self.assertEqual(self.assemble(edited, cache), {'sections': 4, 'reused': 3})
+            self.assertEqual(len(os.listdir(directory)), 5)
+
+    # 總大小超過 max_bytes (CLI 的 --cache-size) 時，從最久沒用到的開始刪
+    def test_disk_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = sic_xe.SectionCache(directory)
+            for age, key in enumerate(('a', 'b', 'c'), 1):
+                cache.put(key, {'data': key * 100})
+                os.utime(os.path.join(directory, key + '.sec'), (age, age))
+            size = os.path.getsize(os.path.join(directory, 'a.sec'))
+            self.assertNotEqual(cache.get('a'), None) # a 變成最近用到的
+            cache.max_bytes = size * 2
+            cache.evict()
+            self.assertEqual(sorted(os.listdir(directory)), ['a.sec', 'c.sec'])
+            self.assertEqual(cache.get('b'), None)
+            cache.max_bytes = 0
+            cache.evict()
+            self.assertEqual(os.listdir(directory), [])
+
+    # cache 放不下時每次都重新組譯，結果不變
+    def test_cache_too_small(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = sic_xe.SectionCache(directory, max_bytes=1)
+            self.assertEqual(self.assemble(FOUR_SECTIONS, cache), {'sections': 4, 'reused': 0})
+            self.assertEqual(os.listdir(directory), [])
+            self.assertEqual(self.assemble(FOUR_SECTIONS, cache), {'sections': 4, 'reused': 0})
+
+class ParallelTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        self.asm.echo = False
+        self.expected = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(FOUR_SECTIONS).to_text()
+
+    # 區塊太小 (每個只有幾個指令) 時不建立 pool，直接完整組譯
+    def test_small_sections_fall_back(self):
+        with unittest.mock.patch.object(sic_xe, 'ProcessPoolExecutor', side_effect=AssertionError('pool created')):
+            program = self.asm.assemble_parallel(FOUR_SECTIONS, jobs=2)
+        self.assertEqual(program.to_text(), self.expected)
+
+    def test_always_parallel(self):
+        program = self.asm.assemble_parallel(FOUR_SECTIONS, jobs=2, min_section_size=0)
+        self.assertEqual(program.to_text(), self.expected)
+
+# watch mode 監看資料夾時，assembler 自己寫出的檔案與 opcode table 不是原始檔
+class WatchSourcesTest(unittest.TestCase):
+    def test_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('prog.txt', 'b.asm', 'prog_output.txt', '108213053王念祖_listing.txt', 'opCode.txt',
+                         'table.txt', 'prog_intermediate.bin', 'prog_output.txt.obj', 'notes.md'):
+                open(os.path.join(directory, name), 'w').close()
+            sources = sic_xe.expand_watch_sources([directory], os.path.join(directory, 'table.txt'))
+            self.assertEqual(sources, [os.path.join(directory, 'b.asm'), os.path.join(directory, 'prog.txt')])
+
+# 批次模式 -o 同一個資料夾時，不同資料夾裡同名的原始檔會寫到同一個輸出檔
+class OutputNameTest(unittest.TestCase):
+    def test_collisions(self):
+        out = os.path.join('build', 'prog_output.txt')
+        self.assertEqual(sic_xe.output_name_collisions(['a/prog.txt', 'b/prog.txt', 'c.txt'], 'build'),
+                         {out: ['a/prog.txt', 'b/prog.txt']})
+        self.assertEqual(sic_xe.output_name_collisions(['a/prog.txt', 'b/prog.txt']), {})
+        self.assertEqual(list(sic_xe.output_name_collisions(['prog.txt', 'prog.asm']).values()), [['prog.txt', 'prog.asm']])
+
+    def test_batch_rejects_collisions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            sources = []
+            for sub in ('a', 'b'):
+                os.mkdir(os.path.join(directory, sub))
+                sources.append(os.path.join(directory, sub, 'prog.txt'))
+                with open(sources[-1], 'w') as f:
+                    f.write(read_sample('108213053王念祖_input.txt'))
+            out_dir = os.path.join(directory, 'build')
+            os.mkdir(out_dir)
+            with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+                self.assertFalse(sic_xe.assemble_batch(sources, 1, out_dir))
+            self.assertEqual(os.listdir(out_dir), [])
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_dir = os.path.join(self.directory.name, 'build')
+        os.mkdir(self.out_dir)
+        self.sources = {}
+        for name in ('108213053王念祖_input.txt', '108213053王念祖_input2.txt'):
+            self.sources[os.path.join(self.directory.name, name)] = read_sample(name)
+        for path, text in self.sources.items():
+            with open(path, 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def batch(self, sources):
+        with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+            return sic_xe.assemble_batch(sources, 2, self.out_dir)
+
+    # 每個檔案寫出自己的 object program 與中間檔，內容與單獨組譯相同
+    def test_outputs(self):
+        self.assertTrue(self.batch(list(self.sources)))
+        asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        for path, text in self.sources.items():
+            write_file, intermediate_file = sic_xe.derive_output_names(path, self.out_dir)
+            with open(write_file) as f:
+                self.assertEqual(f.read(), asm.assemble(text).to_text())
+            self.assertTrue(os.path.isfile(intermediate_file))
+
+    # 有一個檔案失敗時回傳 False，但其他檔案照樣組譯並寫出輸出檔
+    def test_one_failure(self):
+        bad = os.path.join(self.directory.name, 'bad.txt')
+        with open(bad, 'w') as f:
+            f.write('P START 0\n        BAE     X\n        END     P\n')
+        self.assertFalse(self.batch([bad] + list(self.sources)))
+        self.assertFalse(os.path.exists(sic_xe.derive_output_names(bad, self.out_dir)[0]))
+        for path in self.sources:
+            self.assertTrue(os.path.isfile(sic_xe.derive_output_names(path, self.out_dir)[0]))
+
+# TextRecordBuilder : (說明, 依序的操作, records() 的結果)，操作為 (location, object code hex) 或 (location, None) 表示 RESW / RESB
+TEXT_RECORD_CASES = [
+    ('ten 3-byte instructions fill exactly 30 bytes',
+     [(i * 3, f'{i:02X}' * 3) for i in range(11)],
+     {0: '000000 010101 020202 030303 040404 050505 060606 070707 080808 090909 ', 30: '0A0A0A '}),
+    ('a 2-byte instruction ends the record exactly at 30 bytes',
+     [(i * 4, f'4B10{i:04X}') for i in range(7)] + [(28, 'B410'), (30, 'F1')],
+     {0: '4B100000 4B100001 4B100002 4B100003 4B100004 4B100005 4B100006 B410 ', 30: 'F1 '}),
+    ('one byte over 30 starts a new record',
+     [(i * 4, f'4B10{i:04X}') for i in range(7)] + [(28, '032010')],
+     {0: '4B100000 4B100001 4B100002 4B100003 4B100004 4B100005 4B100006 ', 28: '032010 '}),
+    ('RESW / RESB start a new record at the next instruction',
+     [(0, '172027'), (3, '032023'), (6, None), (9, None), (12, '454F46')],
+     {0: '172027 032023 ', 12: '454F46 '}),
+    ('RESB before any object code is ignored',
+     [(0, None), (6, 'F1')],
+     {6: 'F1 '}),
+    ('RESB at the end leaves an empty record (skipped by ObjectProgram.records)',
+     [(0, 'F1'), (1, None)],
+     {0: 'F1 ', 1: ''}),
+]
+
+class TextRecordTest(unittest.TestCase):
+    def test_cases(self):
+        builder = sic_xe.TextRecordBuilder()
+        for name, operations, records in TEXT_RECORD_CASES:
+            with self.subTest(name):
+                for location, objcode in operations:
+                    if objcode == None:
+                        builder.gap(location)
+                    else:
+                        builder.add(location, bytes.fromhex(objcode))
+                self.assertEqual(builder.records(), records) # records() 之後可以直接用在下一個程式區塊
+
+    def test_program(self):
+        program = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(
+            'P       START   0\n' +
+            '        LDA     #1\n' * 9 + # 9 個 3 bytes : 27 bytes
+            '        RSUB\n'             # 30 bytes，剛好一行
+            '        LDA     #2\n'
+            'BUF     RESW    2\n'
+            'TAIL    RESB    3\n'
+            'DATA    WORD    5\n'
+            "CHAR    BYTE    X'F1'\n"
+            '        END     P\n')
+        self.assertTrue(program.ok, program.errors)
+        self.assertEqual([record for record in program.to_text().splitlines() if record.startswith('T')], [
+            'T 000000 1E ' + '010001 ' * 9 + '4F0000 ',
+            'T 00001E 03 010002 ',
+            'T 00002A 04 000005 F1 ',
+        ])
+
+    # 範例程式的 object program 與原本的 assembler 產生的一個 byte 都不差
+    def test_sample_output(self):
+        program = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(read_sample('108213053王念祖_input.txt'))
+        self.assertEqual(program.to_text(), read_sample('108213053王念祖_output.txt'))
+
+# 二進位可重定位 object 檔讀回來要與文字格式的 object program 相同
+class RelocatableTest(unittest.TestCase):
+    def test_round_trip(self):
+        program = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(read_sample('108213053王念祖_input2.txt'))
+        self.assertTrue(program.ok, program.errors)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'input2.obj')
+            program.write_relocatable(path)
+            sections = sic_xe.read_relocatable(path)
+            self.assertEqual(sic_xe.read_object_file(path), sections)
+        expected = sic_xe.parse_object_text(program.to_text())
+        self.assertEqual([section['name'] for section in sections], ['COPY', 'RDREC', 'WRREC'])
+        self.assertEqual(sections, expected)
+        self.assertEqual(sections[1]['modified'], [(0x18, 5, '+', 'BUFFER'), (0x21, 5, '+', 'LENGTH'),
+                                                   (0x28, 6, '+', 'BUFEND'), (0x28, 6, '-', 'BUFFER')])
+
+    def test_truncated(self):
+        program = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt')).assemble(read_sample('108213053王念祖_input2.txt'))
+        data = sic_xe.pack_relocatable(program.binary_sections())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'input2.obj')
+            with open(path, 'wb') as f:
+                f.write(data[:-7])
+            with self.assertRaises(ValueError):
+                sic_xe.read_relocatable(path)
+
+# 組譯列表 (--listing) 的欄位 : 行號、位址、symbol / mnemonic / operand、object code
+class ListingTest(unittest.TestCase):
+    def test_columns(self):
+        source = ('P       START   0\n'
+                  "FIRST   LDA     =X'05'\n"
+                  '        BASE    FIRST\n'
+                  '        STA     UNDEF\n'
+                  '        LDCH    BUF,X\n'
+                  '        LTORG\n'
+                  'BUF     RESB    2\n'
+                  '        END     FIRST\n')
+        with tempfile.TemporaryDirectory() as directory:
+            read_file = os.path.join(directory, 'prog.txt')
+            with open(read_file, 'w') as f:
+                f.write(source)
+            asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+            asm.listing_file = os.path.join(directory, 'prog_listing.txt')
+            with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+                self.assertFalse(asm.execute(read_file, os.path.join(directory, 'prog_output.txt'), None))
+            with open(asm.listing_file) as f:
+                lines = f.read().splitlines()
+        header = ' Line  Loc     Source statement                          Object code'
+        self.assertEqual(lines[:11], [
+            header,
+            '',
+            '    1  000000  P        START    0',
+            "    2  000000  FIRST    LDA      =X'05'                  032006", # 指令
+            '    3                   BASE     FIRST',                         # 沒有位址的虛指令
+            '    4  000003           STA      UNDEF                   0F0000', # 有報錯的行
+            '    5  000006           LDCH     BUF,X                   53A001',
+            '    6                   LTORG',
+            "       000009  *        =X'05'                           05",     # LTORG 放置的 literal (沒有行號)
+            '    7  00000A  BUF      RESB     2',
+            '    8                   END      FIRST',
+        ])
+        self.assertEqual(lines[3].index('032006'), header.index('Object code'))
+        self.assertEqual(lines[-2:], ['Errors : 1', "    line 4 : Operand's symbol is undefined or Not found "])
+
+class SimulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        self.directory = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.directory.name, 'F1.dev'), 'wb') as f:
+            f.write(b'HELLO')
+        self.simulator = sic_xe.Simulator(self.asm.optable, self.directory.name)
+
+    def tearDown(self):
+        self.simulator.close()
+        self.directory.cleanup()
+
+    def device_output(self):
+        self.simulator.close()
+        with open(os.path.join(self.directory.name, '05.dev'), 'rb') as f:
+            return f.read()
+
+    # 範例的 WRREC 是 LDCH BUFFER (沒有 ,X)，所以每個字元都寫出 BUFFER 的第一個 byte
+    def test_copy(self):
+        program = self.asm.assemble(read_sample('108213053王念祖_input.txt'))
+        self.simulator.load(program)
+        self.assertEqual(self.simulator.run(100000), 'halt')
+        registers = self.simulator.dump()
+        self.assertEqual((registers['A'], registers['X'], registers['B'], registers['T'], registers['PC']),
+                         (0x45, 3, 0x1033, 3, sic_xe.HALT_ADDRESS))
+        self.assertEqual(self.device_output(), b'HHHHHEEE')
+
+    # END 之後放置的 =X'05' 要在 WRREC 的 T record 裡，不然 WD 會寫到裝置 00
+    def test_copy_control_sections(self):
+        program = self.asm.assemble(read_sample('108213053王念祖_input2.txt'))
+        self.simulator.load(program, 0x4000)
+        self.assertEqual(self.simulator.run(100000), 'halt')
+        self.assertEqual(self.device_output(), b'HELLOEOF')
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '00.dev')))
+
+    def test_decode_cache_invalidated(self):
+        program = self.asm.assemble('P START 0\nLDA #5\nRSUB\nEND P\n')
+        self.simulator.load(program)
+        self.simulator.run()
+        self.assertEqual(self.simulator.dump()['A'], 5)
+        self.simulator.write(0, bytes.fromhex('010007')) # 蓋掉已經解碼過的 LDA #5
+        self.simulator.registers[8] = 0
+        self.simulator.registers[2] = sic_xe.HALT_ADDRESS
+        self.simulator.run()
+        self.assertEqual(self.simulator.dump()['A'], 7)
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX'), 'daemon needs Unix domain sockets')
+class DaemonSocketTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'daemon.sock')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # 不是 socket 的檔案不能被刪掉
+    def test_refuse_regular_file(self):
+        with open(self.path, 'w') as f:
+            f.write('data')
+        with self.assertRaises(OSError):
+            sic_xe.prepare_daemon_socket(self.path)
+        self.assertTrue(os.path.isfile(self.path))
+
+    def test_remove_stale_socket(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(self.path)
+        sic_xe.prepare_daemon_socket(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_refuse_running_daemon(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as running:
+            running.bind(self.path)
+            running.listen()
+            with self.assertRaises(OSError):
+                sic_xe.prepare_daemon_socket(self.path)
+            self.assertTrue(os.path.exists(self.path))
+
+    # 整個 daemon : 用 client 的 request_daemon 送 ping、組譯 (結果與 assemble() 相同)、失敗的組譯、shutdown
+    # signal handler 只能在 main thread 設定，所以 daemon 在 main thread 的 event loop 跑，client 放到別的 thread
+    def test_end_to_end(self):
+        import asyncio
+        source = read_sample('108213053王念祖_input2.txt')
+        bad = 'P START 0\n        BAE     X\n        END     P\n'
+        requests = [
+            {'command': 'ping', 'id': 1},
+            {'id': 'input2', 'source': source},
+            {'id': 'bad', 'source': bad},
+            {'command': 'shutdown'},
+        ]
+
+        async def run():
+            daemon = asyncio.create_task(sic_xe.serve_daemon(self.path, jobs=1))
+            while not os.path.exists(self.path):
+                self.assertFalse(daemon.done())
+                await asyncio.sleep(0.01)
+            responses = await asyncio.to_thread(client.request_daemon, requests, self.path, 30)
+            await asyncio.wait_for(daemon, 30)
+            return responses
+
+        with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull, devnull:
+            ping, good, failed, shutdown = asyncio.run(run())
+        asm = sic_xe.Assembler(os.path.join(BASE_DIR, 'opCode.txt'))
+        self.assertEqual(ping, {'ok': True, 'id': 1})
+        self.assertEqual(good, {'id': 'input2', 'ok': True, 'object_program': asm.assemble(source).to_text(), 'errors': [], 'diagnostics': []})
+        expected = asm.assemble(bad)
+        self.assertEqual(failed, {'id': 'bad', 'ok': False, 'object_program': '', 'errors': expected.errors,
+                                  'diagnostics': [diagnostic.to_dict() for diagnostic in asm.diagnostics]})
+        self.assertEqual(shutdown, {'ok': True})
+        self.assertFalse(os.path.exists(self.path)) # 結束時刪掉 socket
+
+if __name__ == '__main__':
+    unittest.main()